@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Performance measurements (run modules with `python -m bench.<name>`)"""
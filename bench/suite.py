@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of hot paths on synthetic states
+
+Usage: python -m bench.suite [--preset NAME] [--output FILE]
+                             [--baseline FILE] [--threshold FRACTION]
+                             [--memory-threshold FRACTION]
+
+Every case is timed (best of `--repeat` runs) together with peak
+memory traced during one run.  Results are written as JSON; with
+`--baseline` they are compared to earlier results, and the exit code
+is 1 if any case became slower than allowed by `--threshold` or needs
+more memory than allowed by `--memory-threshold`.
+
+A case is a function of size and temporary directory which returns
+the function to run, or `(prepare, run)` pair for cases which change
+their state: `prepare()` is called (untimed) before every run and its
+result is passed to `run`.
+"""
+import argparse
+from collections import namedtuple
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from code import units
+from code.engine import Engine
+from code.commit import Action
+from code.shells.game import GameShell
+from code.state import GameState
+from code.units import abc
+
+
+Size = namedtuple("Size", ["width", "height", "unit_count"])
+
+PRESETS = {
+    "quick": (Size(20, 20, 10), Size(200, 200, 10000)),
+    "medium": (Size(20, 20, 10), Size(200, 200, 10000),
+               Size(1000, 1000, 100000)),
+    "full": (Size(20, 20, 10), Size(200, 200, 10000),
+             Size(1000, 1000, 100000), Size(2000, 2000, 1000000)),
+}
+
+# Number of actions queued for the commit case
+COMMIT_ACTIONS = 10000
+# The show case renders at most this many cells per side
+SHOW_LIMIT = 500
+
+
+def make_state(size, seed=0):
+    """Two-player state with `size.unit_count` units scattered randomly"""
+    rng = random.Random(seed)
+    game_state = GameState(2, size.width, size.height, array_store=True,
+                           seed=seed)
+    factories = [game_state.unit_dict[0], game_state.unit_dict[1]]
+    for i in range(size.unit_count):
+        game_state.add_unit(factories[i % 2].create_unit(
+            rng.choice(("infantry", "vehicle")),
+            (rng.randrange(size.width), rng.randrange(size.height))))
+    return game_state
+
+
+def _queue_actions(game_state, count, rng):
+    """Moves and attacks for up to `count` units of the current player"""
+    engine = Engine(game_state, rng)
+    color = engine.player_color()
+    actions = []
+    for unit_id in game_state.unit_dict:
+        if len(actions) >= count:
+            break
+        unit = game_state.unit_dict[unit_id]
+        if unit.color != color or not isinstance(unit, abc.BattleUnit):
+            continue
+        near = game_state.grid.units_within(
+            unit.position[0], unit.position[1], 1)
+        targets = [target for target in near
+                   if game_state.unit_dict[target].color != color
+                   and isinstance(game_state.unit_dict[target],
+                                  abc.BattleUnit)]
+        if targets:
+            actions.append(Action("attack", unit_id,
+                                  {"target_id": targets[0]}))
+        else:
+            delta = abc.Vector(
+                1 if unit.position[0] + 1 < game_state.width else -1, 0)
+            actions.append(Action("move", unit_id, {"delta": delta}))
+    actions.append(Action("spawn", 0, {"class": "infantry"}))
+    return engine, actions
+
+
+def case_commit(size, directory):
+    """`Engine.commit` of a queue of moves and attacks"""
+    # pylint: disable=unused-argument
+    def prepare():
+        # Commit changes the state, so every run gets a fresh one
+        return _queue_actions(make_state(size), COMMIT_ACTIONS,
+                              random.Random(1))
+
+    def run(prepared):
+        engine, actions = prepared
+        engine.action_queue.extend(actions)
+        engine.commit()
+    return prepare, run
+
+
+def case_show(size, directory):
+    """`show` of the whole field (up to `SHOW_LIMIT` cells per side)"""
+    # pylint: disable=unused-argument
+    game_state = make_state(size)
+    shell = GameShell(game_state, stdout=io.StringIO())
+    arg = "0 0 {} {}".format(min(size.width, SHOW_LIMIT) - 1,
+                             min(size.height, SHOW_LIMIT) - 1)
+
+    def run():
+        shell.stdout = io.StringIO()
+        shell.do_show(arg)
+    return run
+
+
+def _case_save_load(size, directory, suffix, load):
+    game_state = make_state(size)
+    filename = os.path.join(directory, "bench" + suffix)
+    if not load:
+        return lambda: game_state.save(filename)
+    game_state.save(filename)
+    loaded = GameState(1, 1, 1, array_store=True)
+    return lambda: loaded.load(filename)
+
+
+def case_save_json(size, directory):
+    """`GameState.save` to JSON"""
+    return _case_save_load(size, directory, ".json", False)
+
+
+def case_load_json(size, directory):
+    """`GameState.load` from JSON"""
+    return _case_save_load(size, directory, ".json", True)
+
+
+def case_save_bin(size, directory):
+    """`GameState.save` to binary format"""
+    return _case_save_load(size, directory, ".bin", False)
+
+
+def case_load_bin(size, directory):
+    """`GameState.load` from binary format"""
+    return _case_save_load(size, directory, ".bin", True)
+
+
+def case_spawn(size, directory):
+    """`Headquarters.create_unit` called once per unit"""
+    # pylint: disable=unused-argument
+    hq = units.Headquarters("HQ", (0, 0), 0xFF0000,
+                            units.allowed_units("hq"))
+    positions = [(i % size.width, i // size.width % size.height)
+                 for i in range(size.unit_count)]
+
+    def run():
+        for pos in positions:
+            hq.create_unit("infantry", pos)
+    return run
+
+
+CASES = (
+    ("commit", case_commit),
+    ("show", case_show),
+    ("save_json", case_save_json),
+    ("load_json", case_load_json),
+    ("save_bin", case_save_bin),
+    ("load_bin", case_load_bin),
+    ("spawn", case_spawn),
+)
+
+# JSON saves of the biggest states take too long to be useful
+SKIP = {("save_json", 1000000), ("load_json", 1000000)}
+
+
+def measure(setup, size, repeat, directory):
+    """Best time of `repeat` runs and peak memory of one run"""
+    run = setup(size, directory)
+    if isinstance(run, tuple):
+        prepare, run = run
+    else:
+        prepare = None
+    args = () if prepare is None else (prepare(),)
+    tracemalloc.start()
+    run(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    best = None
+    for _ in range(repeat):
+        args = () if prepare is None else (prepare(),)
+        start = time.perf_counter()
+        run(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def run_suite(preset, repeat=3, only=None, log=None):
+    """Measure all cases of the preset and return results dictionary"""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        _run_cases(preset, repeat, only, log, directory, results)
+    return {
+        "preset": preset,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def _run_cases(preset, repeat, only, log, directory, results):
+    # pylint: disable=too-many-arguments
+    for size in PRESETS[preset]:
+        for name, setup in CASES:
+            if only and name not in only:
+                continue
+            if (name, size.unit_count) in SKIP:
+                continue
+            key = "{}/{}x{}/{}".format(
+                name, size.width, size.height, size.unit_count)
+            results[key] = measure(setup, size, repeat, directory)
+            if log is not None:
+                log.write("{:<36}{:>12.6f} s{:>14} B\n".format(
+                    key, results[key]["seconds"],
+                    results[key]["peak_bytes"]))
+
+
+def compare(results, baseline, threshold, memory_threshold=None):
+    """
+    List of `(case, measure, old, new)` for cases which are slower
+    ("seconds") than in baseline by more than `threshold` or need more
+    memory ("peak_bytes") by more than `memory_threshold` (fractions;
+    memory is not compared if it's `None`)
+    """
+    limits = [("seconds", threshold)]
+    if memory_threshold is not None:
+        limits.append(("peak_bytes", memory_threshold))
+    regressions = []
+    old_results = baseline.get("results", {})
+    for key, value in sorted(results["results"].items()):
+        if key not in old_results:
+            continue
+        for name, limit in limits:
+            old = old_results[key].get(name)
+            if old is not None and value[name] > old * (1 + limit):
+                regressions.append((key, name, old, value[name]))
+    return regressions
+
+
+def main(argv=None):
+    """Command line entry point; return exit code"""
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.suite",
+        description="Benchmarks of game hot paths")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--case", action="append", dest="cases",
+                        choices=[name for name, _ in CASES],
+                        help="run only this case (may be repeated)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown (0.25 means 25%%)")
+    parser.add_argument("--memory-threshold", type=float, default=0.1,
+                        help="allowed growth of peak memory (0.1 means 10%%)")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.preset, args.repeat, args.cases, sys.stdout)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.threshold,
+                          args.memory_threshold)
+    for key, name, old, new in regressions:
+        if name == "seconds":
+            change = "{:.6f} s -> {:.6f} s".format(old, new)
+        else:
+            change = "{} B -> {} B".format(old, new)
+        sys.stdout.write("REGRESSION {}: {}\n".format(key, change))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Memory per unit and attribute access time of unit implementations
+
+Usage: python -m bench.units [count]
+"""
+import sys
+import timeit
+import tracemalloc
+
+from code import units
+from code.store import UnitStore
+from code.units import slotted
+
+
+COLOR = 0xFF0000
+
+
+def ordinary_units(count):
+    """Units made by ordinary `Headquarters`"""
+    hq = units.Headquarters("HQ", (0, 0), COLOR, units.allowed_units("hq"))
+    return [hq.create_unit("infantry", (i % 100, i // 100))
+            for i in range(count)]
+
+
+def slotted_units(count):
+    """Units made by slotted `Headquarters`"""
+    hq = slotted.Headquarters(
+        "HQ", (0, 0), COLOR, slotted.allowed_units("hq"))
+    return [hq.create_unit("infantry", (i % 100, i // 100))
+            for i in range(count)]
+
+
+def stored_units(count):
+    """Views of `UnitStore` rows (the store itself is kept by views)"""
+    store = UnitStore()
+    hq = units.Headquarters("HQ", (0, 0), COLOR, units.allowed_units("hq"))
+    for i in range(count):
+        store.add(hq.create_unit("infantry", (i % 100, i // 100)))
+    return [store.view(i) for i in range(count)]
+
+
+def bytes_per_unit(factory, count):
+    """Memory allocated for units by `factory` (without the list)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = factory(count)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before - sys.getsizeof(objects)) / count
+
+
+def access_time(factory, count, repeat=5):
+    """Best time (in ns) of reading position, health and color of a unit"""
+    objects = factory(count)
+
+    def read_all():
+        for unit in objects:
+            # pylint: disable=pointless-statement
+            unit.position
+            unit.health
+            unit.color
+    return min(timeit.repeat(read_all, number=1, repeat=repeat)) \
+        / count * 1e9
+
+
+def main(count):
+    """Print table of results"""
+    store = UnitStore()
+    hq = units.Headquarters("HQ", (0, 0), COLOR, units.allowed_units("hq"))
+    for i in range(count):
+        store.add(hq.create_unit("infantry", (0, 0)))
+    print("{:<10}{:>16}{:>16}".format("units", "bytes/unit", "ns/access"))
+    for name, factory in (("ordinary", ordinary_units),
+                          ("slotted", slotted_units)):
+        print("{:<10}{:>16.1f}{:>16.1f}".format(
+            name, bytes_per_unit(factory, count),
+            access_time(factory, count)))
+    print("{:<10}{:>16.1f}{:>16.1f}".format(
+        "store", store.nbytes() / count, access_time(stored_units, count)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
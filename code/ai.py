@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Computer players
+
+On its turn `AIPlayer` takes a snapshot of the field (enemy units by
+cell and by coarse sector), splits units of the player into batches
+and plans orders for every batch: HQs spawn units, battle units attack
+an adjacent enemy or step towards the nearest one.  Planning stops
+when the time budget of the turn is spent, so the rest of units just
+wait.  Batches may be planned in a pool of processes.
+"""
+from collections import namedtuple
+from functools import partial
+from multiprocessing import Pool
+import time
+
+from . import units
+from .engine import AttackOrder, MoveOrder, OrderError, SpawnOrder
+from .units import abc, registry
+
+
+Snapshot = namedtuple(
+    "Snapshot",
+    [
+        "width",
+        "height",
+        "own_count",
+        "enemies",
+        "sectors",
+        "sector_size",
+        "fallback",
+    ]
+)
+
+# Kinds of units in batches
+HQ, FIGHTER, MOVABLE_FIGHTER = range(3)
+
+
+def take_snapshot(game_state, color, sector_size=16):
+    """
+    Snapshot of the field as seen by player with given color
+    and list of `(unit_id, kind, x, y)` of player's units
+    """
+    enemies = {}
+    sectors = {}
+    fallback = None
+    own = []
+    for unit_id, unit in game_state.unit_dict.items():
+        # pylint: disable=invalid-name
+        x, y = unit.position
+        if unit.color == color:
+            if isinstance(unit, units.Headquarters):
+                own.append((unit_id, HQ, x, y))
+            elif isinstance(unit, abc.MovableUnit):
+                own.append((unit_id, MOVABLE_FIGHTER, x, y))
+            elif isinstance(unit, abc.BattleUnit):
+                own.append((unit_id, FIGHTER, x, y))
+        elif isinstance(unit, abc.BattleUnit):
+            if (x, y) not in enemies:
+                enemies[(x, y)] = []
+                sectors.setdefault(
+                    (x // sector_size, y // sector_size), []).append((x, y))
+            enemies[(x, y)].append(unit_id)
+        elif fallback is None:
+            fallback = (x, y)
+    snapshot = Snapshot(game_state.width, game_state.height, len(own),
+                        enemies, sectors, sector_size, fallback)
+    return snapshot, own
+
+
+def _nearest_enemy(snapshot, x, y):
+    """
+    Position of (nearly) the nearest enemy: sectors are searched in
+    growing rings, and the ring after the first hit is checked too
+    """
+    # pylint: disable=invalid-name
+    size = snapshot.sector_size
+    sx, sy = x // size, y // size
+    max_radius = max(snapshot.width, snapshot.height) // size + 1
+    best, best_distance, last_radius = None, None, max_radius
+    radius = 0
+    while radius <= last_radius:
+        if 8 * radius > len(snapshot.sectors):
+            # Ring has more sectors than there are occupied ones
+            for cells in snapshot.sectors.values():
+                for pos in cells:
+                    distance = max(abs(pos[0] - x), abs(pos[1] - y))
+                    if best is None or distance < best_distance:
+                        best, best_distance = pos, distance
+            break
+        for cell_x in range(sx - radius, sx + radius + 1):
+            for cell_y in range(sy - radius, sy + radius + 1):
+                if max(abs(cell_x - sx), abs(cell_y - sy)) != radius:
+                    continue
+                for pos in snapshot.sectors.get((cell_x, cell_y), ()):
+                    distance = max(abs(pos[0] - x), abs(pos[1] - y))
+                    if best is None or distance < best_distance:
+                        best, best_distance = pos, distance
+        if best is not None and last_radius == max_radius:
+            last_radius = radius + 1
+        radius += 1
+    return best if best is not None else snapshot.fallback
+
+
+def _sign(value):
+    return (value > 0) - (value < 0)
+
+
+def plan_batch(snapshot, batch):
+    """Orders for a batch of `(unit_id, kind, x, y)` (pure function)"""
+    orders = []
+    spawns = registry.KINDS["hq"].spawns
+    for unit_id, kind, x, y in batch:
+        # pylint: disable=invalid-name
+        if kind == HQ:
+            if spawns:
+                orders.append(SpawnOrder(
+                    unit_id, spawns[(snapshot.own_count + unit_id)
+                                    % len(spawns)]))
+            continue
+        target = None
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                ids = snapshot.enemies.get((x + dx, y + dy))
+                if ids:
+                    target = ids[0]
+                    break
+            if target is not None:
+                break
+        if target is not None:
+            orders.append(AttackOrder(unit_id, target))
+        elif kind == MOVABLE_FIGHTER:
+            pos = _nearest_enemy(snapshot, x, y)
+            if pos is not None and pos != (x, y):
+                orders.append(MoveOrder(
+                    unit_id, _sign(pos[0] - x), _sign(pos[1] - y)))
+    return orders
+
+
+class AIPlayer:
+    """
+    Fills action queue of the current player within time budget
+
+    `budget` is in seconds per turn.  If `processes` is given, batches
+    are planned in a pool of that many processes (call `close` or use
+    the player as context manager to stop it).
+    """
+    budget = 0.5
+    batch_size = 512
+    processes = None
+    _pool = None
+
+    def __init__(self, budget=0.5, batch_size=512, processes=None):
+        self.budget = budget
+        self.batch_size = batch_size
+        self.processes = processes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop worker processes"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def _planned(self, snapshot, batches):
+        """Iterator of planned batches (in order of `batches`)"""
+        if self.processes is None or len(batches) < 2:
+            return (plan_batch(snapshot, batch) for batch in batches)
+        if self._pool is None:
+            self._pool = Pool(self.processes)
+        return self._pool.imap(partial(plan_batch, snapshot), batches)
+
+    def play_turn(self, engine):
+        """Submit orders for the current player; get number of them"""
+        deadline = time.perf_counter() + self.budget
+        snapshot, own = take_snapshot(
+            engine.game_state, engine.player_color())
+        size = self.batch_size
+        if self.processes is not None:
+            # Fewer and larger tasks: snapshot is sent with every one
+            size = max(size, -(-len(own) // (4 * self.processes)))
+        batches = [own[i:i + size] for i in range(0, len(own), size)]
+        submitted = 0
+        for orders in self._planned(snapshot, batches):
+            for order in orders:
+                try:
+                    engine.submit(order)
+                except OrderError:
+                    continue
+                submitted += 1
+            if time.perf_counter() > deadline:
+                # Results of the rest of batches are not needed anymore
+                self.close()
+                break
+        return submitted
+
+
+def is_ai(game_state, player):
+    """Check if player is controlled by computer"""
+    return bool(game_state.list_of_player_infos[player].AI)
+
+
+def set_ai(game_state, player, enabled):
+    """Hand player over to computer (or back to human)"""
+    info = game_state.list_of_player_infos[player]
+    info.obj = info.obj._replace(AI=enabled)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Damage kernels of area attacks and their batched resolution
+
+Kernel is a list of `(dx, dy, weight)` offsets from the target cell,
+where weight is a percentage of damage of the attacker.  All area
+attacks of a turn are resolved together by `area_damage`: attacks of
+the same kernel at the same cell are merged, kernels are accumulated
+only over occupied cells, and every unit of a cell (stacked ones
+too) then takes the total damage of the cell.  Cost is O(distinct
+targets x kernel area + units hit) instead of O(attacks x kernel area
+x units in cell).
+"""
+from collections import namedtuple
+
+
+Kernel = namedtuple("Kernel", ["radius", "weights"])
+
+# Kernels by name (see `UnitKind.area`)
+KERNELS = {}
+
+
+def falloff(radius, edge=25):
+    """
+    Disc kernel with weight 100 in the center falling linearly
+    with distance down to `edge` at `radius`
+    """
+    weights = []
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            # pylint: disable=invalid-name
+            distance = (dx * dx + dy * dy) ** 0.5
+            if distance <= radius:
+                weights.append((dx, dy, round(
+                    100 - (100 - edge) * distance / max(radius, 1))))
+    return Kernel(radius, weights)
+
+
+def flat(radius, weight=100):
+    """Square kernel with the same weight everywhere"""
+    return Kernel(radius, [(dx, dy, weight)
+                           for dy in range(-radius, radius + 1)
+                           for dx in range(-radius, radius + 1)])
+
+
+def register_kernel(name, kernel):
+    """Add kernel which unit kinds can refer to"""
+    if name in KERNELS:
+        raise ValueError("Kernel {} is already registered".format(name))
+    KERNELS[name] = kernel
+
+
+register_kernel("grenade", falloff(1, edge=50))
+register_kernel("shell", falloff(2))
+
+
+def area_damage(game_state, attacks):
+    """
+    Damage of area attacks per unit ID
+
+    `attacks` are `(kernel_name, x, y, damage)`; damage of a cell is
+    the sum of weighted damage of kernels covering it (rounded down).
+    """
+    # pylint: disable=too-many-locals
+    impulses = {}
+    for name, x, y, damage in attacks:
+        # pylint: disable=invalid-name
+        key = (name, x, y)
+        impulses[key] = impulses.get(key, 0) + damage
+
+    grid = game_state.grid
+    width, height = game_state.width, game_state.height
+    count_at = grid.count_at
+    cells = {}
+    for (name, center_x, center_y), amount in impulses.items():
+        for dx, dy, weight in KERNELS[name].weights:
+            # pylint: disable=invalid-name
+            x, y = center_x + dx, center_y + dy
+            if 0 <= x < width and 0 <= y < height and count_at(x, y):
+                cells[(x, y)] = cells.get((x, y), 0) + amount * weight
+
+    result = {}
+    for (x, y), total in cells.items():
+        # pylint: disable=invalid-name
+        total //= 100
+        if total:
+            for unit_id in grid.units_at(x, y):
+                result[unit_id] = total
+    return result
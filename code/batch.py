@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Scripted runs of the shells without interactive overhead
+
+Usage: python -m code.batch [--discard COMMANDS] [--output FILE] SCRIPT
+
+Script has one command of `MenuShell` or `GameShell` per line (`-`
+reads it from standard input); `start` switches to the game shell and
+`menu` goes back, like in the interactive game.  Lines are dispatched
+to `do_*` methods directly, empty lines and lines starting with `#`
+are skipped, and output is written in blocks.  Commands listed in
+`--discard` (only ones without side effects, see `DISCARDABLE`) are
+not run at all, so their output is never formatted.
+"""
+import argparse
+from contextlib import ExitStack
+import io
+import sys
+
+from .shells.game import GameShell
+from .shells.menu import MenuShell
+
+
+# Commands which only write output
+DISCARDABLE = frozenset(("show", "inspect", "status", "help", "ls"))
+BLOCK_SIZE = 1 << 16
+
+
+class BlockWriter(io.StringIO):
+    """Buffer which passes text to `stream` in blocks"""
+    stream = None
+    block_size = BLOCK_SIZE
+
+    def __init__(self, stream, block_size=BLOCK_SIZE):
+        super().__init__()
+        self.stream = stream
+        self.block_size = block_size
+
+    def write(self, text):
+        result = super().write(text)
+        if self.tell() >= self.block_size:
+            self.flush()
+        return result
+
+    def flush(self):
+        """Pass buffered text to the stream"""
+        if self.tell():
+            self.stream.write(self.getvalue())
+            self.seek(0)
+            self.truncate()
+        self.stream.flush()
+
+
+class BatchRunner:
+    """Menu shell (and game shell after `start`) driven by script lines"""
+    menu = None
+    game = None
+    output = None
+    discard = frozenset()
+    commands = 0
+    _methods = None
+
+    def __init__(self, stream=None, discard=(), block_size=BLOCK_SIZE):
+        unknown = set(discard) - DISCARDABLE
+        if unknown:
+            raise ValueError("Can't discard commands with side effects: "
+                             + ", ".join(sorted(unknown)))
+        self.output = BlockWriter(
+            stream if stream is not None else sys.stdout, block_size)
+        self.discard = frozenset(discard)
+        self.menu = MenuShell(stdout=self.output)
+        self.game = None
+        self.commands = 0
+        self._methods = {}
+
+    def _method(self, shell, command):
+        """Bound `do_*` method (looked up once per shell and command)"""
+        key = (id(shell), command)
+        method = self._methods.get(key)
+        if method is None:
+            method = getattr(shell, "do_" + command, None)
+            self._methods[key] = method
+        return method
+
+    def _start(self):
+        if self.menu.game_state is None:
+            self.menu.do_start("")
+            return
+        self.game = GameShell(self.menu.game_state, stdout=self.output,
+                              instrumentation=self.menu.instrumentation,
+                              saver=self.menu.saver)
+        self._methods = {key: value for key, value in self._methods.items()
+                         if key[0] == id(self.menu)}
+        self.game.preloop()
+
+    def execute(self, line):
+        """Run one line; get `True` if the script should stop"""
+        line = line.strip()
+        if not line or line.startswith("#"):
+            return False
+        parts = line.split(None, 1)
+        command = parts[0]
+        if command in self.discard:
+            return False
+        self.commands += 1
+        shell = self.game if self.game is not None else self.menu
+        if shell is self.menu and command == "start":
+            self._start()
+            return False
+        if shell is self.game and command == "abort":
+            return True
+        instrumentation = shell.instrumentation
+        if instrumentation.enabled:
+            instrumentation.begin(command)
+        method = self._method(shell, command)
+        if method is None:
+            stop = shell.default(line)
+        else:
+            stop = method(parts[1] if len(parts) > 1 else "")
+        if instrumentation.enabled:
+            instrumentation.end(command)
+        if stop and shell is self.game:
+            self.game = None
+            return False
+        return bool(stop)
+
+    def run(self, lines):
+        """
+        Run lines until the end or a command which stops the menu
+        (and wait for saves written in background)
+        """
+        try:
+            for line in lines:
+                if self.execute(line):
+                    break
+        finally:
+            self.menu.saver.wait()
+            self.output.flush()
+        return self.commands
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(prog="python -m code.batch")
+    parser.add_argument("script")
+    parser.add_argument("--discard", default="",
+                        help="comma-separated commands to skip, e.g. show")
+    parser.add_argument("--output", help="write output to file")
+    args = parser.parse_args(argv)
+
+    discard = [name for name in args.discard.split(",") if name]
+    with ExitStack() as stack:
+        script, output = sys.stdin, sys.stdout
+        if args.script != "-":
+            script = stack.enter_context(
+                open(args.script, encoding="utf-8"))
+        if args.output is not None:
+            output = stack.enter_context(
+                open(args.output, "w", encoding="utf-8"))
+        BatchRunner(output, discard).run(script)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Compact binary save format
+
+File consists of fixed-size header and sections aligned to 8 bytes:
+JSON metadata (players, squads, allowed units of HQs), unit columns
+of `UnitStore`, arrays of `SpatialIndex` and the free list of the store
+(its order decides IDs of the next units).  Loading maps the file into
+memory and uses its sections as columns without copying them.
+
+Grid of sparse state (`ChunkedGrid`) is written as a section of
+`(x, y, unit_id)` records instead of arrays of the whole field.
+"""
+from array import array
+import json
+import mmap
+import os
+import struct
+
+from .chunks import ChunkedGrid
+from .spatial import SpatialIndex
+from .store import UnitStore
+
+
+SUFFIX = ".bin"
+MAGIC = b"STGB"
+VERSION = 1
+
+# magic, version, flags, width, height, unit_count, rows,
+# overflow (or cell records of sparse grid), meta length
+HEADER = struct.Struct("<4sHHIIQQQQ")
+
+FLAG_SPARSE = 1
+
+# (name, typecode) of unit columns in file order
+UNIT_COLUMNS = (
+    ("kind", 'B'),
+    ("color", 'I'),
+    ("x", 'i'),
+    ("y", 'i'),
+    ("health", 'i'),
+    ("damage", 'i'),
+    ("max_health", 'i'),
+)
+
+
+class FormatError(ValueError):
+    """File is not a binary save of supported version"""
+
+
+def _padding(size):
+    return -size % 8
+
+
+def _write_section(file, data):
+    file.write(data)
+    file.write(bytes(_padding(len(data))))
+
+
+def _store_of(game_state):
+    """Get `UnitStore` of the state (built from objects if needed)"""
+    if game_state.store is not None:
+        return game_state.store
+    store = UnitStore()
+    for unit_id in sorted(game_state.unit_dict):
+        store.put(unit_id, game_state.unit_dict[unit_id])
+    return store
+
+
+def save(game_state, filename):
+    """
+    Write state to binary file
+
+    New file replaces the old one by rename, so that a state which is
+    still mapped from the old file is never truncated under it.
+    """
+    # pylint: disable=protected-access
+    store = _store_of(game_state)
+    grid = game_state.grid
+    rows = store.capacity
+    meta = json.dumps({
+        "current_player": game_state.current_player,
+        "players": [info._asdict()
+                    for info in game_state.list_of_player_infos],
+        "squads": game_state.squad_dict,
+        "rng": game_state.rng_state(),
+        "allowed_units": {str(unit_id): names
+                          for unit_id, names in store._allowed.items()},
+        "free": len(store._free),
+    }).encode("utf-8")
+    flags = 0
+    overflow = array('i')
+    if isinstance(grid, ChunkedGrid):
+        flags |= FLAG_SPARSE
+        for x, y, ids in grid.occupied_cells():
+            # pylint: disable=invalid-name
+            for unit_id in ids:
+                overflow.extend((x, y, unit_id))
+        records = len(overflow) // 3
+    else:
+        for cell, bucket in sorted(grid.overflow.items()):
+            for unit_id in bucket:
+                overflow.extend((cell, unit_id))
+        records = len(overflow) // 2
+    temp_filename = "{}.tmp".format(filename)
+    with open(temp_filename, "wb") as file:
+        file.write(HEADER.pack(
+            MAGIC, VERSION, flags, grid.width, grid.height,
+            game_state.unit_count, rows, records, len(meta)))
+        _write_section(file, meta)
+        for name, _ in UNIT_COLUMNS:
+            _write_section(file, getattr(store, name).tobytes())
+        if not flags & FLAG_SPARSE:
+            for column in (grid.count, grid.first, grid.row_count):
+                _write_section(file, column.tobytes())
+        _write_section(file, overflow.tobytes())
+        _write_section(file, store._free.tobytes())
+    os.replace(temp_filename, filename)
+
+
+class _Reader:
+    """Cursor over sections of mapped file"""
+    # pylint: disable=too-few-public-methods
+    view = None
+    offset = 0
+
+    def __init__(self, view, offset):
+        self.view = view
+        self.offset = offset
+
+    def take(self, typecode, length):
+        """Get next section as memoryview of `length` items"""
+        size = struct.calcsize(typecode) * length
+        if self.offset + size > len(self.view):
+            raise FormatError("File is truncated")
+        section = self.view[self.offset:self.offset + size]
+        self.offset += size + _padding(size)
+        return section.cast(typecode)
+
+
+def load(filename):
+    """Map binary file and return dictionary with parts of the state"""
+    # pylint: disable=protected-access
+    with open(filename, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    if len(mapped) < HEADER.size:
+        raise FormatError("File is truncated")
+    magic, version, flags, width, height, unit_count, rows, records, \
+        meta_size = HEADER.unpack_from(mapped)
+    if magic != MAGIC:
+        raise FormatError("Not a binary save file")
+    if version != VERSION:
+        raise FormatError("Unsupported version {}".format(version))
+
+    reader = _Reader(memoryview(mapped), HEADER.size)
+    meta = json.loads(bytes(reader.take('B', meta_size)).decode("utf-8"))
+    kind_offset = reader.offset
+
+    store = UnitStore()
+    for name, typecode in UNIT_COLUMNS:
+        setattr(store, name, reader.take(typecode, rows))
+    store._allowed = {int(unit_id): tuple(names)
+                      for unit_id, names in meta["allowed_units"].items()}
+
+    if flags & FLAG_SPARSE:
+        triples = reader.take('i', 3 * records)
+        grid = ChunkedGrid(width, height)
+        for i in range(0, len(triples), 3):
+            grid.add(triples[i + 2], triples[i], triples[i + 1])
+    else:
+        count = reader.take('i', width * height)
+        first = reader.take('i', width * height)
+        row_count = reader.take('i', height)
+        overflow = {}
+        pairs = reader.take('i', 2 * records)
+        for i in range(0, len(pairs), 2):
+            overflow.setdefault(pairs[i], []).append(pairs[i + 1])
+        grid = SpatialIndex.from_buffers(
+            width, height, count, first, row_count, overflow)
+
+    if "free" in meta:
+        free = array('i', reader.take('i', meta["free"]))
+    else:
+        # Files written before the free list was saved: order is lost
+        free = array('i')
+        index = mapped.find(b"\0", kind_offset, kind_offset + rows)
+        while index != -1:
+            free.append(index - kind_offset)
+            index = mapped.find(b"\0", index + 1, kind_offset + rows)
+        free.reverse()
+    store._free = free
+    store._live = rows - len(free)
+
+    return {
+        "store": store,
+        "grid": grid,
+        "unit_count": unit_count,
+        "current_player": meta["current_player"],
+        "players": meta["players"],
+        "squads": {int(key): value for key, value in meta["squads"].items()},
+        "rng": meta.get("rng"),
+    }
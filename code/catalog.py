@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Index of save files kept in SQLite
+
+The catalog lives in the saves directory and is updated when games
+are created, saved and removed, so listing saves and checking them
+doesn't touch the save files.  A save is valid when its size and time
+of modification match the catalog.
+"""
+from collections import namedtuple
+import os
+from pathlib import Path
+import sqlite3
+
+from . import binfmt
+from .saving import COMPRESSED
+from .state import GameState
+
+
+FILENAME = "catalog.sqlite3"
+# Saves with these suffixes keep them in names
+SUFFIXES = (binfmt.SUFFIX,) + tuple(COMPRESSED)
+
+Entry = namedtuple(
+    "Entry",
+    [
+        "name",
+        "path",
+        "format",
+        "players",
+        "units",
+        "player",
+        "width",
+        "height",
+        "size",
+        "mtime",
+    ]
+)
+
+# Columns which can be used for sorting
+SORT_KEYS = frozenset(Entry._fields)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS saves (
+    name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    format TEXT NOT NULL,
+    players INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    player INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS saves_players ON saves (players);
+CREATE INDEX IF NOT EXISTS saves_mtime ON saves (mtime);
+"""
+INSERT = "INSERT OR REPLACE INTO saves VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def save_name(path):
+    """
+    Name of save as typed in the menu
+    (binary and compressed ones keep suffix)
+    """
+    path = Path(path)
+    return path.name if path.suffix in SUFFIXES else path.stem
+
+
+class Catalog:
+    """Metadata of saves in `directory`"""
+    directory = "saves"
+    _connection = None
+
+    def __init__(self, directory="saves"):
+        self.directory = directory
+        self._connection = None
+
+    @property
+    def path(self):
+        # pylint: disable=missing-docstring
+        return os.path.join(self.directory, FILENAME)
+
+    def _connect(self):
+        if self._connection is None:
+            exists = os.path.exists(self.path)
+            os.makedirs(self.directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.executescript(SCHEMA)
+            if not exists:
+                self.rescan()
+        return self._connection
+
+    def close(self):
+        """Close database (it's opened again when needed)"""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    @staticmethod
+    def _entry(path, game_state):
+        stat = os.stat(path)
+        return Entry(
+            save_name(path), str(path),
+            Path(path).suffix[1:] if Path(path).suffix in SUFFIXES
+            else "json",
+            len(game_state.list_of_player_infos), len(game_state.unit_dict),
+            game_state.current_player, game_state.width, game_state.height,
+            stat.st_size, stat.st_mtime)
+
+    def update(self, path, game_state):
+        """Record metadata of save file just written from `game_state`"""
+        entry = self._entry(path, game_state)
+        connection = self._connect()
+        with connection:
+            connection.execute(INSERT, entry)
+        return entry
+
+    def remove(self, path):
+        """Forget save file"""
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM saves WHERE name = ?",
+                               (save_name(path),))
+
+    def get(self, path):
+        """Entry of save file (`None` if it's not in the catalog)"""
+        row = self._connect().execute(
+            "SELECT * FROM saves WHERE name = ?",
+            (save_name(path),)).fetchone()
+        return None if row is None else Entry(*row)
+
+    def entries(self, sort="name", descending=False, **filters):
+        """
+        List of entries sorted by column `sort`; keyword arguments
+        select entries with equal columns (`pattern` is a glob of name)
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError("Can't sort by {!r}".format(sort))
+        conditions, values = [], []
+        for key, value in sorted(filters.items()):
+            if key == "pattern":
+                conditions.append("name GLOB ?")
+            elif key in SORT_KEYS:
+                conditions.append("{} = ?".format(key))
+            else:
+                raise ValueError("Unknown filter {!r}".format(key))
+            values.append(value)
+        query = "SELECT * FROM saves"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY {} {}".format(
+            sort, "DESC" if descending else "ASC")
+        return [Entry(*row)
+                for row in self._connect().execute(query, values)]
+
+    def validate(self, path):
+        """
+        Check that save file is in the catalog and wasn't changed
+        since it was recorded (only metadata of the file is read)
+        """
+        entry = self.get(path)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return stat.st_size == entry.size and stat.st_mtime == entry.mtime
+
+    def rescan(self):
+        """
+        Rebuild catalog from the directory (every save is loaded,
+        so it's done only when the catalog is created or on request)
+        """
+        entries = []
+        for file in sorted(Path(self.directory).iterdir()):
+            # Journals and the catalog itself have other suffixes
+            if file.suffix not in SUFFIXES + (".json",):
+                continue
+            game_state = GameState(1, 1, 1)
+            try:
+                game_state.load(str(file))
+            except (OSError, ValueError):
+                continue
+            entries.append(self._entry(str(file), game_state))
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM saves")
+            connection.executemany(INSERT, entries)
+        return len(entries)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Sparse grid for very large fields"""
+from array import array
+
+from .spatial import GridBase
+
+
+class Chunk:
+    """Square part of the field with at least one unit"""
+    # pylint: disable=too-few-public-methods
+    __slots__ = ("count", "first", "row_count", "overflow", "units")
+
+    def __init__(self, size):
+        self.count = array('i', bytes(4 * size * size))
+        self.first = array('i', [-1]) * (size * size)
+        self.row_count = array('i', bytes(4 * size))
+        self.overflow = {}
+        self.units = 0
+
+
+class ChunkedGrid(GridBase):
+    """
+    Occupancy of the field kept in chunks
+
+    Chunk of `chunk_size` x `chunk_size` cells is allocated when the
+    first unit enters it and freed when the last one leaves, so memory
+    depends on number of occupied chunks rather than on field area.
+    Inside a chunk cells are stored like in `SpatialIndex`.
+    """
+    chunk_size = 16
+    chunks = None
+    _units = 0
+
+    def __init__(self, width, height, chunk_size=16):
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.chunks = {}
+        self._units = 0
+
+    @classmethod
+    def from_cells(cls, width, height, cells):
+        """Build grid from iterable of `(x, y, ids)`"""
+        grid = cls(width, height)
+        for x, y, ids in cells:
+            # pylint: disable=invalid-name
+            for unit_id in ids:
+                grid.add(unit_id, x, y)
+        return grid
+
+    def __len__(self):
+        return self._units
+
+    def _locate(self, x, y):
+        """Get chunk key and index of cell inside chunk"""
+        # pylint: disable=invalid-name
+        size = self.chunk_size
+        return (x // size, y // size), (y % size) * size + x % size
+
+    def add(self, unit_id, x, y):
+        """Put unit to the end of the cell"""
+        # pylint: disable=invalid-name
+        key, cell = self._locate(x, y)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = Chunk(self.chunk_size)
+        if chunk.count[cell]:
+            chunk.overflow.setdefault(cell, []).append(unit_id)
+        else:
+            chunk.first[cell] = unit_id
+        chunk.count[cell] += 1
+        chunk.row_count[y % self.chunk_size] += 1
+        chunk.units += 1
+        self._units += 1
+
+    def remove(self, unit_id, x, y):
+        """Remove unit from the cell (and free the chunk if it's empty)"""
+        # pylint: disable=invalid-name
+        key, cell = self._locate(x, y)
+        chunk = self.chunks.get(key)
+        if chunk is None or chunk.count[cell] == 0:
+            raise ValueError("Unit {} is not in cell ({}, {})".format(
+                unit_id, x, y))
+        if chunk.first[cell] == unit_id:
+            bucket = chunk.overflow.get(cell)
+            chunk.first[cell] = bucket.pop(0) if bucket else -1
+        else:
+            chunk.overflow.get(cell, []).remove(unit_id)
+        if cell in chunk.overflow and not chunk.overflow[cell]:
+            del chunk.overflow[cell]
+        chunk.count[cell] -= 1
+        chunk.row_count[y % self.chunk_size] -= 1
+        chunk.units -= 1
+        self._units -= 1
+        if not chunk.units:
+            del self.chunks[key]
+
+    def count_at(self, x, y):
+        """Number of units in the cell"""
+        # pylint: disable=invalid-name
+        key, cell = self._locate(x, y)
+        chunk = self.chunks.get(key)
+        return chunk.count[cell] if chunk is not None else 0
+
+    def units_at(self, x, y):
+        """List of IDs of units in the cell"""
+        # pylint: disable=invalid-name
+        key, cell = self._locate(x, y)
+        chunk = self.chunks.get(key)
+        if chunk is None or chunk.count[cell] == 0:
+            return []
+        if chunk.count[cell] == 1:
+            return [chunk.first[cell]]
+        return [chunk.first[cell]] + chunk.overflow[cell]
+
+    def iter_chunks(self, x1=0, y1=0, x2=None, y2=None):
+        """
+        Iterate over `(chunk_x, chunk_y, chunk)` of allocated chunks
+        which intersect rectangle, in row-major order
+        """
+        # pylint: disable=too-many-arguments
+        size = self.chunk_size
+        if x2 is None:
+            x2 = self.width - 1
+        if y2 is None:
+            y2 = self.height - 1
+        cx1, cy1, cx2, cy2 = x1 // size, y1 // size, x2 // size, y2 // size
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) <= len(self.chunks):
+            keys = [(cx, cy) for cy in range(cy1, cy2 + 1)
+                    for cx in range(cx1, cx2 + 1) if (cx, cy) in self.chunks]
+        else:
+            keys = sorted(
+                (key for key in self.chunks
+                 if cx1 <= key[0] <= cx2 and cy1 <= key[1] <= cy2),
+                key=lambda key: (key[1], key[0]))
+        for key in keys:
+            yield key[0], key[1], self.chunks[key]
+
+    def cells_in_rect(self, x1, y1, x2, y2):
+        """
+        Iterate over `(x, y, ids)` of occupied cells in rectangle
+        (bounds are inclusive and clipped to the field)
+        """
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, self.width - 1), min(y2, self.height - 1)
+        if x1 > x2 or y1 > y2:
+            return
+        size = self.chunk_size
+        chunk_rows = {}
+        for chunk_x, chunk_y, chunk in self.iter_chunks(x1, y1, x2, y2):
+            chunk_rows.setdefault(chunk_y, []).append((chunk_x, chunk))
+        for chunk_y in sorted(chunk_rows):
+            row = chunk_rows[chunk_y]
+            for y in range(max(y1, chunk_y * size),
+                           min(y2, chunk_y * size + size - 1) + 1):
+                # pylint: disable=invalid-name
+                local_y = y - chunk_y * size
+                for chunk_x, chunk in row:
+                    if not chunk.row_count[local_y]:
+                        continue
+                    start = local_y * size - chunk_x * size
+                    for x in range(max(x1, chunk_x * size),
+                                   min(x2, chunk_x * size + size - 1) + 1):
+                        cell = start + x
+                        count = chunk.count[cell]
+                        if count == 1:
+                            yield x, y, [chunk.first[cell]]
+                        elif count:
+                            yield x, y, [chunk.first[cell]] \
+                                + chunk.overflow[cell]
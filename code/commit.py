@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Batch resolution of planned actions"""
+from collections import namedtuple
+import random
+
+from .area import area_damage
+from .units import abc, registry
+
+
+class Action(namedtuple("ActionTuple", ["name", "unit_id", "params"])):
+    """Small class fot storing player's actions"""
+
+    def __str__(self):
+        if self.name == "spawn":
+            return "Unit {}: Create unit of class \"{}\"".format(
+                self.unit_id, self.params["class"])
+        if self.name == "attack":
+            return "Unit {}: Attack unit {}".format(
+                self.unit_id, self.params["target_id"])
+        if self.name == "area":
+            return "Unit {}: Attack area around ({}, {})".format(
+                self.unit_id, *self.params["center"])
+        return ""
+
+
+CommitResult = namedtuple(
+    "CommitResult",
+    [
+        "spawned",
+        "moved",
+        "killed",
+    ]
+)
+
+
+def spawn_positions(game_state, pos):
+    """List cells around `pos` where new unit can appear"""
+    return game_state.grid.neighbour_cells(pos[0], pos[1])
+
+
+def group_actions(actions):
+    """
+    Split actions by kind
+
+    Spawns keep their order and indices in the queue, moves are
+    summed per unit (with index of the last move of the unit) and
+    attacks (single and area ones) are kept in order.
+    """
+    spawns = []
+    moves = {}
+    attacks = []
+    areas = []
+    for index, action in enumerate(actions):
+        if action.name == "spawn":
+            spawns.append((index, action.unit_id, action.params["class"]))
+        elif action.name == "move":
+            delta = action.params["delta"]
+            old = moves.get(action.unit_id, (0, 0, 0))
+            moves[action.unit_id] = (
+                old[0] + delta[0], old[1] + delta[1], index)
+        elif action.name == "attack":
+            attacks.append((index, action.unit_id, action.params["target_id"]))
+        elif action.name == "area":
+            areas.append((index, action.unit_id, action.params["center"]))
+    return spawns, moves, attacks, areas
+
+
+def resolve_attacks(game_state, attacks):
+    """
+    Sum damage per target
+
+    Return dictionary of total damage and list of `(index, target_id)`
+    for killed units, where `index` is position of the killing action
+    in the queue (that's when sequential resolution would remove it).
+    Attacks of units killed earlier in the queue are dropped.
+    """
+    unit_dict = game_state.unit_dict
+    damage = {}
+    deaths = []
+    dead = set()
+    for index, unit_id, target_id in attacks:
+        if target_id not in unit_dict or unit_id not in unit_dict \
+                or unit_id in dead:
+            continue
+        total = damage.get(target_id, 0)
+        if total and total >= unit_dict[target_id].health:
+            continue
+        total += unit_dict[unit_id].damage
+        damage[target_id] = total
+        if total >= unit_dict[target_id].health:
+            deaths.append((index, target_id))
+            dead.add(target_id)
+    return damage, deaths
+
+
+def resolve_area_attacks(game_state, areas, damage, deaths):
+    """
+    Add damage of all area attacks at once to results of
+    `resolve_attacks`; units they kill die right after the last
+    area attack in the queue, since the attacks are resolved together
+    (attackers killed by earlier single attacks don't take part)
+    """
+    unit_dict = game_state.unit_dict
+    killed_at = {target_id: index for index, target_id in deaths}
+    attacks = []
+    for index, unit_id, center in areas:
+        if unit_id not in unit_dict or killed_at.get(unit_id, index) < index:
+            continue
+        unit = unit_dict[unit_id]
+        attacks.append((registry.kind_of(unit).area, center[0], center[1],
+                        unit.damage))
+    if not attacks:
+        return
+    end = max([index for index, _, _ in areas]) + 1
+    dead = {target_id for _, target_id in deaths}
+    for target_id, total in sorted(area_damage(game_state, attacks).items()):
+        if target_id in dead or \
+                not isinstance(unit_dict[target_id], abc.BattleUnit):
+            continue
+        total += damage.get(target_id, 0)
+        damage[target_id] = total
+        if total >= unit_dict[target_id].health:
+            deaths.append((end, target_id))
+
+
+# Order of events with the same index in the queue
+_MOVE, _SPAWN, _DEATH = range(3)
+
+
+def commit_actions(game_state, actions, rng=random):
+    """
+    Apply all actions at once and return `CommitResult`
+
+    Resulting state is the same as if actions were applied one by one
+    in the given order (including order of units in cells): damage
+    of all attacks is summed per target, and then moves, deaths and
+    spawns are applied in one pass in queue order (a unit moves at
+    its last move, even if its moves sum to zero), so spawns consume
+    random numbers and free IDs in queue order.
+
+    Actions refer to units as they were before the commit: actions of
+    units killed earlier in the queue are dropped, even if a spawn has
+    reused the ID meanwhile (applying them one by one would give them
+    to the new unit).  Area attacks are resolved together, so they
+    hit cells where units were before the moves.
+    """
+    # pylint: disable=too-many-locals
+    spawns, moves, attacks, areas = group_actions(actions)
+    damage, deaths = resolve_attacks(game_state, attacks)
+    resolve_area_attacks(game_state, areas, damage, deaths)
+    unit_dict = game_state.unit_dict
+    dead = {target_id for _, target_id in deaths}
+
+    for target_id, total in damage.items():
+        if target_id not in dead:
+            unit_dict[target_id].health -= total
+
+    # Area deaths share index with the next action and come after it
+    events = [(index, _MOVE, unit_id, (dx, dy))
+              for unit_id, (dx, dy, index) in moves.items()
+              if unit_id not in dead and unit_id in unit_dict]
+    events.extend((index, _DEATH, target_id, None)
+                  for index, target_id in deaths)
+    events.extend((index, _SPAWN, hq_id, class_name)
+                  for index, hq_id, class_name in spawns)
+    events.sort()
+
+    moved = []
+    spawned = []
+    killed = []
+    removed = set()
+    width, height = game_state.width, game_state.height
+    for _, kind, unit_id, param in events:
+        if kind == _MOVE:
+            old_pos = unit_dict[unit_id].position
+            new_pos = (min(max(old_pos[0] + param[0], 0), width - 1),
+                       min(max(old_pos[1] + param[1], 0), height - 1))
+            game_state.move_unit(unit_id, new_pos)
+            if tuple(old_pos) != new_pos:
+                moved.append((unit_id, old_pos, new_pos))
+        elif kind == _DEATH:
+            pos = unit_dict[unit_id].position
+            game_state.remove_unit(unit_id)
+            killed.append((unit_id, pos))
+            removed.add(unit_id)
+        elif unit_id in unit_dict and unit_id not in removed:
+            hq = unit_dict[unit_id]
+            selected_pos = rng.choice(spawn_positions(game_state, hq.position))
+            new_id = game_state.add_unit(hq.create_unit(param, selected_pos))
+            spawned.append((new_id, selected_pos))
+    return CommitResult(spawned, moved, killed)
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""Headless game API (orders are checked here, shells only parse them)"""
+from collections import namedtuple
+from . import units
+from .commit import Action, commit_actions
+from .orders import OrderBuffer, OrderConflict
+from .pathing import Pathfinder
+from .squads import Squads
+from .units import abc, registry
+
+
+# Area attacks reach cells at most this far (in both coordinates)
+AREA_RANGE = 3
+
+
+SpawnOrder = namedtuple("SpawnOrder", ["unit_id", "class_name"])
+MoveOrder = namedtuple("MoveOrder", ["unit_id", "dx", "dy"])
+AttackOrder = namedtuple("AttackOrder", ["unit_id", "target_id"])
+AreaOrder = namedtuple("AreaOrder", ["unit_id", "x", "y"])
+GotoOrder = namedtuple("GotoOrder", ["unit_id", "x", "y"])
+SquadMoveOrder = namedtuple("SquadMoveOrder", ["squad_id", "dx", "dy"])
+SquadAreaOrder = namedtuple("SquadAreaOrder", ["squad_id", "x", "y"])
+SquadGotoOrder = namedtuple("SquadGotoOrder", ["squad_id", "x", "y"])
+
+
+class OrderError(ValueError):
+    """Order can't be accepted (message is meant for the player)"""
+
+
+class Engine:
+    """
+    Queue of orders of the current player and turn commits
+
+    `GotoOrder` is a standing order: destination is kept in
+    `destinations` and every commit of the owner adds a move along
+    the shared flow field until the unit arrives (or gets stuck).
+
+    Squad orders are kept in `squad_orders` (one move and one attack
+    per squad) and expanded into orders of all members at once by
+    `commit`; members which got orders of their own keep them.
+    """
+    game_state = None
+    action_queue = None
+    destinations = None
+    squads = None
+    squad_orders = None
+    _squads_changed = False
+    pathfinder = None
+    rng = None
+    recorder = None
+
+    def __init__(self, game_state, rng=None):
+        self.game_state = game_state
+        self.action_queue = OrderBuffer()
+        self.destinations = {}
+        self.squads = Squads(game_state)
+        # (squad ID, "move" or "area") -> (x, y)
+        self.squad_orders = {}
+        self._squads_changed = False
+        self.pathfinder = Pathfinder(game_state)
+        # Random choices come from the state unless told otherwise
+        self.rng = rng if rng is not None else game_state.rng
+        self.recorder = None
+
+    @property
+    def current_player(self):
+        # pylint: disable=missing-docstring
+        return self.game_state.current_player
+
+    def player_color(self, player=None):
+        """Color of player (current one by default)"""
+        if player is None:
+            player = self.current_player
+        return self.game_state.list_of_player_infos[player].color
+
+    def owner(self, unit_id):
+        """Index of player who owns the unit (`None` if it's nobody's)"""
+        color = self.game_state.unit_dict[unit_id].color
+        for player, info in enumerate(self.game_state.list_of_player_infos):
+            if info.color == color:
+                return player
+        return None
+
+    def units_of(self, player):
+        """IDs of all units of the player"""
+        color = self.player_color(player)
+        return [unit_id for unit_id, unit in self.game_state.unit_dict.items()
+                if unit.color == color]
+
+    def scores(self):
+        """Number of units of every player"""
+        colors = {info.color: player for player, info
+                  in enumerate(self.game_state.list_of_player_infos)}
+        result = [0] * len(colors)
+        for unit in self.game_state.unit_dict.values():
+            if unit.color in colors:
+                result[colors[unit.color]] += 1
+        return result
+
+    def _own_unit(self, unit_id, cls, message):
+        """Get unit of current player which is instance of `cls`"""
+        unit = self.game_state.unit_dict.get(unit_id)
+        if unit is None or not isinstance(unit, cls):
+            raise OrderError(message)
+        if unit.color != self.player_color():
+            raise OrderError("Please select YOUR unit.")
+        return unit
+
+    def submit(self, order, replace=False):
+        """
+        Check order and add it to the queue; return queued `Action`
+
+        Unit can have one move and one attack per turn; `replace`
+        allows to change them instead of rejecting new order.
+        """
+        damage = 0
+        if isinstance(order, SpawnOrder):
+            action = self._check_spawn(order)
+        elif isinstance(order, MoveOrder):
+            action = self._check_move(order)
+        elif isinstance(order, AttackOrder):
+            action = self._check_attack(order, replace)
+            damage = self.game_state.unit_dict[order.unit_id].damage
+        elif isinstance(order, AreaOrder):
+            action = self._check_area(order)
+        elif isinstance(order, GotoOrder):
+            return self._check_goto(order)
+        elif isinstance(order, (SquadMoveOrder, SquadAreaOrder,
+                                SquadGotoOrder)):
+            return self._check_squad(order)
+        else:
+            raise TypeError("Unknown order {!r}".format(order))
+        if replace:
+            self.action_queue.replace(action, damage)
+            return action
+        try:
+            self.action_queue.append(action, damage)
+        except OrderConflict as err:
+            raise OrderError("{} Use \"cancel\" to change it.".format(err))
+        return action
+
+    def _check_spawn(self, order):
+        hq = self._own_unit(
+            order.unit_id, units.Headquarters, "Please select HQ unit.")
+        if not hq.can_create(order.class_name):
+            raise OrderError(
+                "Error: invalid unit name (see help for allowed names)")
+        return Action("spawn", order.unit_id, {"class": order.class_name})
+
+    def _check_move(self, order):
+        unit = self._own_unit(order.unit_id, abc.MovableUnit,
+                              "Please select infantry of vehicle unit.")
+        for name, value in (("dx", order.dx), ("dy", order.dy)):
+            if value not in range(-1, 2):
+                raise OrderError("{} should lie in range [-1, 1].".format(
+                    name))
+        delta = abc.Vector(order.dx, order.dy)
+        new_pos = unit.position + delta
+        self._check_cell(new_pos[0], new_pos[1])
+        return Action("move", order.unit_id, {"delta": delta})
+
+    def _check_cell(self, x, y, adjective="New"):
+        """Raise `OrderError` if cell lies outside of the field"""
+        # pylint: disable=invalid-name
+        bounds = (self.game_state.width, self.game_state.height)
+        for index, (name, value) in enumerate(
+                (("horizontal", x), ("vertical", y))):
+            if value not in range(0, bounds[index]):
+                raise OrderError(
+                    "{} {} coordinate should lie in range [0, {}).".format(
+                        adjective, name, bounds[index]))
+
+    def _check_goto(self, order):
+        """Check and remember destination (it's not queued)"""
+        self._own_unit(order.unit_id, abc.MovableUnit,
+                       "Please select infantry of vehicle unit.")
+        self._check_cell(order.x, order.y)
+        self.destinations[order.unit_id] = (order.x, order.y)
+        return None
+
+    def _own_squad(self, squad_id):
+        """Get members of squad of current player"""
+        if squad_id not in self.squads:
+            raise OrderError("Please specify ID of an existing squad.")
+        if self.squads.color(squad_id) != self.player_color():
+            raise OrderError("Please specify ID of YOUR squad.")
+        return self.squads.members(squad_id)
+
+    def _check_squad(self, order):
+        """
+        Check and remember squad order (members' orders are queued
+        by `commit`, destinations of goto are set right away)
+        """
+        members = self._own_squad(order.squad_id)
+        if isinstance(order, SquadMoveOrder):
+            for name, value in (("dx", order.dx), ("dy", order.dy)):
+                if value not in range(-1, 2):
+                    raise OrderError("{} should lie in range [-1, 1].".format(
+                        name))
+            self.squad_orders[(order.squad_id, "move")] = (order.dx, order.dy)
+            return None
+        if isinstance(order, SquadAreaOrder):
+            self._check_cell(order.x, order.y, "Target")
+            self.squad_orders[(order.squad_id, "area")] = (order.x, order.y)
+            return None
+        self._check_cell(order.x, order.y)
+        width, height = self.game_state.width, self.game_state.height
+        for unit_id, dx, dy in members:
+            # pylint: disable=invalid-name
+            self.destinations[unit_id] = (
+                min(max(order.x + dx, 0), width - 1),
+                min(max(order.y + dy, 0), height - 1))
+        return None
+
+    def create_squad(self, unit_ids):
+        """Form squad of units of current player; get its ID"""
+        unit_ids = list(unit_ids)
+        if not unit_ids:
+            raise OrderError("Squad needs at least one unit.")
+        for unit_id in unit_ids:
+            self._own_unit(unit_id, abc.MovableUnit,
+                           "Squads consist of infantry and vehicle units.")
+        self._squads_changed = True
+        return self.squads.create(unit_ids)
+
+    def disband_squad(self, squad_id):
+        """Remove squad of current player and its orders; get its size"""
+        members = self._own_squad(squad_id)
+        self.cancel_squad(squad_id)
+        self.squads.disband(squad_id)
+        self._squads_changed = True
+        return len(members)
+
+    def cancel_squad(self, squad_id):
+        """Cancel move and attack of squad; get their number"""
+        self._own_squad(squad_id)
+        count = 0
+        for name in ("move", "area"):
+            if self.squad_orders.pop((squad_id, name), None) is not None:
+                count += 1
+        return count
+
+    def _expand_squads(self):
+        """Queue orders of members of squads of current player"""
+        # pylint: disable=invalid-name,too-many-locals
+        unit_dict = self.game_state.unit_dict
+        width, height = self.game_state.width, self.game_state.height
+        for (squad_id, name), (x, y) in self.squad_orders.items():
+            if squad_id not in self.squads:
+                continue
+            records = []
+            for unit_id, dx, dy in self.squads.members(squad_id):
+                unit = unit_dict[unit_id]
+                pos_x, pos_y = unit.position
+                if name == "move":
+                    if 0 <= pos_x + x < width and 0 <= pos_y + y < height:
+                        records.append((unit_id, x, y))
+                    continue
+                target_x, target_y = x + dx, y + dy
+                if 0 <= target_x < width and 0 <= target_y < height and \
+                        max(abs(target_x - pos_x),
+                            abs(target_y - pos_y)) <= AREA_RANGE and \
+                        registry.kind_of(unit).area is not None:
+                    records.append((unit_id, target_x, target_y))
+            self.action_queue.add_group(name, records)
+
+    def _advance_paths(self):
+        """Queue next steps of units of current player with destinations"""
+        color = self.player_color()
+        for unit_id, goal in list(self.destinations.items()):
+            unit = self.game_state.unit_dict.get(unit_id)
+            if unit is None:
+                del self.destinations[unit_id]
+                continue
+            if unit.color != color or \
+                    self.action_queue.order_of(unit_id, "move") is not None:
+                continue
+            step = self.pathfinder.step(unit.position, goal, color)
+            if step is None or step == (0, 0):
+                del self.destinations[unit_id]
+                continue
+            self.action_queue.append(
+                Action("move", unit_id, {"delta": abc.Vector(*step)}))
+
+    def _check_attack(self, order, replace=False):
+        unit = self._own_unit(order.unit_id, abc.BattleUnit,
+                              "Please select infantry of vehicle unit.")
+        if order.target_id not in self.game_state.unit_dict:
+            raise OrderError("Please specify ID of an existing unit.")
+        if not isinstance(self.game_state.unit_dict[order.target_id],
+                          abc.BattleUnit):
+            raise OrderError("Target must be infantry or vehicle unit.")
+        if order.target_id not in self.game_state.grid.units_within(
+                unit.position[0], unit.position[1], 1):
+            raise OrderError("Target must be located in adjacent cell.")
+        damage = self.action_queue.projected_damage(order.target_id)
+        if replace:
+            previous = self.action_queue.order_of(order.unit_id, "attack")
+            if previous is not None and previous.name == "attack" and \
+                    previous.params["target_id"] == order.target_id:
+                damage -= self.game_state.unit_dict[order.unit_id].damage
+        if damage >= self.game_state.unit_dict[order.target_id].health:
+            raise OrderError("Target will be killed by earlier orders.")
+        return Action("attack", order.unit_id, {"target_id": order.target_id})
+
+    def _check_area(self, order):
+        unit = self._own_unit(order.unit_id, abc.BattleUnit,
+                              "Please select infantry of vehicle unit.")
+        if registry.kind_of(unit).area is None:
+            raise OrderError("This unit has no area attack.")
+        self._check_cell(order.x, order.y, "Target")
+        if max(abs(order.x - unit.position[0]),
+               abs(order.y - unit.position[1])) > AREA_RANGE:
+            raise OrderError("Target cell must be at most {} cells away."
+                             .format(AREA_RANGE))
+        return Action("area", order.unit_id,
+                      {"center": abc.Vector(order.x, order.y)})
+
+    def undo(self):
+        """Remove last queued action (`IndexError` if queue is empty)"""
+        return self.action_queue.pop()
+
+    def cancel(self, unit_id):
+        """Cancel all orders of unit (destination too); get their number"""
+        count = self.action_queue.cancel(unit_id)
+        if self.destinations.pop(unit_id, None) is not None:
+            count += 1
+        return count
+
+    def commit(self):
+        """
+        Apply queued actions and pass turn to next player;
+        get `CommitResult`
+        """
+        self._advance_paths()
+        self._expand_squads()
+        self.squad_orders.clear()
+        result = commit_actions(self.game_state, self.action_queue, self.rng)
+        for unit_id, _ in result.killed:
+            self.destinations.pop(unit_id, None)
+        self.squads.remove_units(unit_id for unit_id, _ in result.killed)
+        player = self.current_player + 1
+        if player == len(self.game_state.list_of_player_infos):
+            player = 0
+        self.game_state.current_player = player
+        if self.game_state.journal is not None:
+            self.game_state.journal.record(
+                self.game_state, self.action_queue, result,
+                squads_changed=self._squads_changed)
+        self._squads_changed = False
+        if self.recorder is not None:
+            self.recorder.record(self.game_state, self.action_queue, result)
+        self.action_queue.clear()
+        return result
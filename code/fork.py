@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Copy-on-write forks of `GameState`
+
+Fork shares cells of the grid and units with its parent: a cell is
+copied when units enter or leave it, and a unit is copied when it's
+taken from `unit_dict` by ID (the only way game code changes units).
+Iteration over `unit_dict` yields shared units, which must not be
+changed.  Parent must stay unchanged while its forks are in use;
+`promote` applies changes of a fork to the parent.
+"""
+import copy
+from array import array
+from collections.abc import MutableMapping
+import random
+import weakref
+
+from .spatial import GridBase
+from .state import GameEncoder, GameState, Wrapper, game_object_hook
+from .store import _UnitView
+
+
+def private_copy(unit):
+    """Copy of unit which doesn't share state with the original"""
+    if isinstance(unit, _UnitView):
+        # View writes to the store of parent; make an ordinary unit
+        return game_object_hook(GameEncoder().default(unit))
+    return copy.copy(unit)
+
+
+def _peek(unit_dict, unit_id):
+    if isinstance(unit_dict, ForkUnits):
+        return unit_dict.peek(unit_id)
+    return unit_dict[unit_id]
+
+
+class ForkGrid(GridBase):
+    """Grid which copies cells of parent grid on first change"""
+    parent = None
+    cells = None
+    _delta = 0
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.width = parent.width
+        self.height = parent.height
+        self.cells = {}
+        self._delta = 0
+
+    def __len__(self):
+        return len(self.parent) + self._delta
+
+    def _cell(self, x, y):
+        # pylint: disable=invalid-name
+        cell = self.cells.get((x, y))
+        if cell is None:
+            cell = self.cells[(x, y)] = list(self.parent.units_at(x, y))
+        return cell
+
+    def add(self, unit_id, x, y):
+        """Put unit to the cell"""
+        # pylint: disable=invalid-name
+        self._cell(x, y).append(unit_id)
+        self._delta += 1
+
+    def remove(self, unit_id, x, y):
+        """Take unit from the cell"""
+        # pylint: disable=invalid-name
+        self._cell(x, y).remove(unit_id)
+        self._delta -= 1
+
+    def count_at(self, x, y):
+        """Number of units in the cell"""
+        # pylint: disable=invalid-name
+        cell = self.cells.get((x, y))
+        if cell is None:
+            return self.parent.count_at(x, y)
+        return len(cell)
+
+    def units_at(self, x, y):
+        """List of IDs of units in the cell"""
+        # pylint: disable=invalid-name
+        cell = self.cells.get((x, y))
+        if cell is None:
+            return self.parent.units_at(x, y)
+        return list(cell)
+
+    def cells_in_rect(self, x1, y1, x2, y2):
+        """
+        Iterate over `(x, y, ids)` of occupied cells in rectangle
+        row by row (cells of parent merged with copied ones)
+        """
+        # pylint: disable=invalid-name,too-many-arguments
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, self.width - 1), min(y2, self.height - 1)
+        own = sorted((y, x) for x, y in self.cells
+                     if x1 <= x <= x2 and y1 <= y <= y2)
+        index = 0
+        for x, y, ids in self.parent.cells_in_rect(x1, y1, x2, y2):
+            while index < len(own) and own[index] < (y, x):
+                cell = self.cells[own[index][1], own[index][0]]
+                if cell:
+                    yield own[index][1], own[index][0], list(cell)
+                index += 1
+            if index < len(own) and own[index] == (y, x):
+                index += 1
+                ids = self.cells[(x, y)]
+                if not ids:
+                    continue
+                ids = list(ids)
+            yield x, y, ids
+        for y, x in own[index:]:
+            if self.cells[(x, y)]:
+                yield x, y, list(self.cells[(x, y)])
+
+
+class ForkUnits(MutableMapping):
+    """
+    Units of fork: copied from parent mapping on access by ID
+
+    IDs of new units are chosen like parent would choose them
+    (free rows of `UnitStore` are reused in the same order).
+    """
+    parent = None
+    changed = None
+    deleted = None
+    free = None
+    capacity = 0
+
+    def __init__(self, parent, free, capacity):
+        self.parent = parent
+        self.changed = {}
+        # Used as ordered set of IDs of parent's units
+        self.deleted = {}
+        self.free = free
+        self.capacity = capacity
+
+    def __getitem__(self, unit_id):
+        unit = self.changed.get(unit_id)
+        if unit is not None:
+            return unit
+        if unit_id in self.deleted:
+            raise KeyError(unit_id)
+        unit = self.changed[unit_id] = private_copy(
+            _peek(self.parent, unit_id))
+        return unit
+
+    def peek(self, unit_id):
+        """Get unit without copying it (it must not be changed)"""
+        unit = self.changed.get(unit_id)
+        if unit is not None:
+            return unit
+        if unit_id in self.deleted:
+            raise KeyError(unit_id)
+        return _peek(self.parent, unit_id)
+
+    def __setitem__(self, unit_id, unit):
+        if unit_id not in self:
+            # Like `UnitStore.put`: the ID isn't free anymore
+            if self.free is not None and unit_id in self.free:
+                self.free.remove(unit_id)
+            self.capacity = max(self.capacity, unit_id + 1)
+        self.changed[unit_id] = unit
+        self.deleted.pop(unit_id, None)
+
+    def __delitem__(self, unit_id):
+        if unit_id not in self:
+            raise KeyError(unit_id)
+        self.changed.pop(unit_id, None)
+        if unit_id in self.parent:
+            self.deleted[unit_id] = None
+
+    def __contains__(self, unit_id):
+        if unit_id in self.changed:
+            return True
+        return unit_id not in self.deleted and unit_id in self.parent
+
+    def __iter__(self):
+        for unit_id, _ in self.items():
+            yield unit_id
+
+    def __len__(self):
+        added = sum(1 for unit_id in self.changed
+                    if unit_id not in self.parent)
+        return len(self.parent) - len(self.deleted) + added
+
+    def items(self):
+        """Pairs of ID and unit (shared with parent unless changed)"""
+        for unit_id, unit in self.parent.items():
+            if unit_id not in self.deleted:
+                yield unit_id, self.changed.get(unit_id, unit)
+        for unit_id, unit in list(self.changed.items()):
+            if unit_id not in self.parent:
+                yield unit_id, unit
+
+    def values(self):
+        """Units (shared with parent unless changed)"""
+        return (unit for _, unit in self.items())
+
+    def add(self, unit):
+        """Store new unit under the next free ID; return the ID"""
+        if self.free:
+            unit_id = self.free.pop()
+        else:
+            unit_id = self.capacity
+            self.capacity += 1
+        self.changed[unit_id] = unit
+        self.deleted.pop(unit_id, None)
+        return unit_id
+
+    def release(self, unit_id):
+        """Delete unit and make its ID free"""
+        del self[unit_id]
+        if self.free is not None:
+            self.free.append(unit_id)
+
+
+class GameFork(GameState):
+    """
+    Copy-on-write child of `GameState`
+
+    It can be committed (e.g. by its own `Engine`) and forked again;
+    `promote` writes its changes to the parent, `discard` drops it.
+    """
+    # pylint: disable=super-init-not-called
+    parent = None
+
+    def __init__(self, parent):
+        self.parent = parent
+        if parent.store is not None:
+            free, capacity = array('i', parent.store._free), \
+                parent.store.capacity
+        elif isinstance(parent, GameFork):
+            free = parent.unit_dict.free
+            free = None if free is None else array('i', free)
+            capacity = parent.unit_dict.capacity
+        else:
+            free, capacity = None, parent.unit_count
+        # pylint: disable=protected-access
+        self.unit_dict = ForkUnits(parent.unit_dict, free, capacity)
+        self.store = None
+        self.grid = ForkGrid(parent.grid)
+        self.unit_count = parent.unit_count
+        self.current_player = parent.current_player
+        self.rng = random.Random()
+        self.rng.setstate(parent.rng.getstate())
+        self.list_of_player_infos = [
+            Wrapper(info.obj) for info in parent.list_of_player_infos]
+        self.squad_dict = dict(parent.squad_dict)
+        self.width = parent.width
+        self.height = parent.height
+        self.journal = None
+        self.listeners = weakref.WeakSet()
+
+    def add_unit(self, unit):
+        """Register new unit, place it on the field and return its ID"""
+        unit_id = self.unit_dict.add(unit)
+        self.unit_count = max(self.unit_count, self.unit_dict.capacity)
+        self.grid.add(unit_id, unit.position[0], unit.position[1])
+        self._cell_changed(unit.position)
+        return unit_id
+
+    def remove_unit(self, unit_id):
+        """Delete unit from the field"""
+        pos = self.unit_dict[unit_id].position
+        self.grid.remove(unit_id, pos[0], pos[1])
+        self.unit_dict.release(unit_id)
+        self._cell_changed(pos)
+
+    def load(self, filename):
+        raise TypeError("Forks can't be loaded; load the parent instead")
+
+    def promote(self):
+        """
+        Apply changes to the parent and discard the fork
+
+        Cells copied by the fork replace cells of the parent (so units
+        stay stacked in the same order), and free IDs keep their order.
+        """
+        # pylint: disable=protected-access,invalid-name
+        parent = self.parent
+        units = self.unit_dict
+        grid = parent.grid
+        cells = self.grid.cells
+        for x, y in cells:
+            for unit_id in grid.units_at(x, y):
+                grid.remove(unit_id, x, y)
+        for unit_id in units.deleted:
+            del parent.unit_dict[unit_id]
+        for unit_id, unit in units.changed.items():
+            parent.unit_dict[unit_id] = unit
+        for (x, y), ids in cells.items():
+            for unit_id in ids:
+                grid.add(unit_id, x, y)
+            parent._cell_changed((x, y))
+        if parent.store is not None:
+            parent.store.set_free_list(list(units.free))
+            parent.unit_count = parent.store.capacity
+        else:
+            if isinstance(parent, GameFork):
+                parent.unit_dict.free = units.free
+                parent.unit_dict.capacity = units.capacity
+            parent.unit_count = max(parent.unit_count, self.unit_count)
+        parent.current_player = self.current_player
+        parent.rng.setstate(self.rng.getstate())
+        for info, own in zip(parent.list_of_player_infos,
+                             self.list_of_player_infos):
+            info.obj = own.obj
+        parent.squad_dict = self.squad_dict
+        self.discard()
+        return parent
+
+    def discard(self):
+        """Drop references to the parent (fork can't be used anymore)"""
+        self.parent = None
+        self.unit_dict = None
+        self.grid = None
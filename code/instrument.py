@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Latency histograms, commit counters and profiles of shell commands
+
+`Instrumentation` is disabled by default: shells check one flag per
+command then.  When enabled, every command is timed into a histogram
+with power-of-two buckets (in microseconds), commits add counters and
+one chosen command can be run under `cProfile`.
+"""
+import cProfile
+from contextlib import contextmanager
+import io
+import json
+import pstats
+import time
+
+
+# Bucket `i` counts samples shorter than 2**i microseconds
+BUCKETS = 32
+# Number of lines of profile kept per command
+PROFILE_LINES = 25
+
+
+class Histogram:
+    """Latencies of one command"""
+    count = 0
+    total = 0.0
+    minimum = None
+    maximum = None
+    buckets = None
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        """Add one sample"""
+        self.count += 1
+        self.total += seconds
+        if self.minimum is None or seconds < self.minimum:
+            self.minimum = seconds
+        if self.maximum is None or seconds > self.maximum:
+            self.maximum = seconds
+        index = min(int(seconds * 1e6).bit_length(), BUCKETS - 1)
+        self.buckets[index] += 1
+
+    def percentile(self, fraction):
+        """Upper bound of bucket with given fraction of samples (seconds)"""
+        if not self.count:
+            return 0.0
+        needed = fraction * self.count
+        seen = 0
+        for index, number in enumerate(self.buckets):
+            seen += number
+            if seen >= needed:
+                return (1 << index) / 1e6
+        return self.maximum
+
+    def as_dict(self):
+        """Summary which can be saved to JSON"""
+        return {
+            "count": self.count,
+            "total": self.total,
+            "min": self.minimum,
+            "max": self.maximum,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": self.buckets,
+        }
+
+
+class Instrumentation:
+    """Statistics of one session of shells"""
+    enabled = False
+    latencies = None
+    counters = None
+    profile_command = None
+    profiles = None
+    _running = None
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        """Forget collected data"""
+        self.latencies = {}
+        self.counters = {}
+        self.profiles = {}
+        # Stack of (command, start time, profiler) of running commands
+        # (`start` of the menu runs commands of the game shell)
+        self._running = []
+
+    def begin(self, command):
+        """Start timing command (and profiling it if it's chosen)"""
+        profiler = None
+        if command == self.profile_command and not any(
+                running[2] for running in self._running):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        self._running.append((command, time.perf_counter(), profiler))
+
+    def end(self, command):
+        """Stop timing command started by `begin`"""
+        if not self._running or self._running[-1][0] != command:
+            # Instrumentation was switched on during the command
+            return
+        _, started, profiler = self._running.pop()
+        elapsed = time.perf_counter() - started
+        if profiler is not None:
+            profiler.disable()
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text)\
+                .sort_stats("cumulative").print_stats(PROFILE_LINES)
+            self.profiles[command] = text.getvalue()
+        self.record(command, elapsed)
+
+    def record(self, name, seconds):
+        """Add sample to histogram `name`"""
+        histogram = self.latencies.get(name)
+        if histogram is None:
+            histogram = self.latencies[name] = Histogram()
+        histogram.add(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """Time block into histogram `name` (if enabled)"""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def count(self, name, number=1):
+        """Increase counter"""
+        self.counters[name] = self.counters.get(name, 0) + number
+
+    def count_commit(self, actions, result):
+        """Update counters with committed actions and `CommitResult`"""
+        self.count("commits")
+        for action in actions:
+            self.count("actions." + action.name)
+        self.count("units.spawned", len(result.spawned))
+        self.count("units.moved", len(result.moved))
+        self.count("units.killed", len(result.killed))
+        cells = {tuple(pos) for _, pos in result.spawned}
+        cells.update(tuple(pos) for _, pos in result.killed)
+        for _, old_pos, new_pos in result.moved:
+            cells.add(tuple(old_pos))
+            cells.add(tuple(new_pos))
+        self.count("cells.touched", len(cells))
+
+    def as_dict(self):
+        """All data which can be saved to JSON"""
+        return {
+            "latencies": {name: histogram.as_dict() for name, histogram
+                          in sorted(self.latencies.items())},
+            "counters": dict(sorted(self.counters.items())),
+            "profiles": self.profiles,
+        }
+
+    def export(self, filename):
+        """Write data to JSON file"""
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump(self.as_dict(), file, indent=2)
+
+    def report(self):
+        """Text table of latencies and counters"""
+        lines = ["{:<16}{:>8}{:>12}{:>12}{:>12}{:>12}".format(
+            "command", "count", "mean, ms", "p50, ms", "p99, ms", "max, ms")]
+        for name, histogram in sorted(self.latencies.items()):
+            lines.append("{:<16}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}{:>12.3f}"
+                         .format(name, histogram.count,
+                                 1e3 * histogram.total / histogram.count,
+                                 1e3 * histogram.percentile(0.5),
+                                 1e3 * histogram.percentile(0.99),
+                                 1e3 * histogram.maximum))
+        for name, value in sorted(self.counters.items()):
+            lines.append("{:<28}{:>12}".format(name, value))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Append-only log of committed turns stored next to a save file"""
+import json
+import os
+
+from .commit import Action, commit_actions
+from .squads import Squads
+from .units import abc
+
+
+SUFFIX = ".journal"
+DEFAULT_THRESHOLD = 1 << 20
+
+
+class JournalError(ValueError):
+    """Logged turn can't be replayed on the loaded state"""
+
+
+def journal_path(save_file):
+    """Get path of journal which belongs to the save file"""
+    return "{}{}".format(save_file, SUFFIX)
+
+
+def encode_action(action):
+    """JSON-serializable list describing action"""
+    if action.name == "spawn":
+        return [action.name, action.unit_id, action.params["class"]]
+    if action.name == "move":
+        return [action.name, action.unit_id, list(action.params["delta"])]
+    if action.name == "area":
+        return [action.name, action.unit_id, list(action.params["center"])]
+    return [action.name, action.unit_id, action.params["target_id"]]
+
+
+def decode_action(record):
+    """Action from list made by `encode_action`"""
+    name, unit_id, param = record
+    if name == "spawn":
+        return Action(name, unit_id, {"class": param})
+    if name == "move":
+        return Action(name, unit_id, {"delta": abc.Vector(*param)})
+    if name == "area":
+        return Action(name, unit_id, {"center": abc.Vector(*param)})
+    return Action(name, unit_id, {"target_id": param})
+
+
+class _RecordedChoices:
+    """
+    Replacement of `random` which returns recorded spawn positions
+    (generator of the state is advanced as if it chose them)
+    """
+    # pylint: disable=too-few-public-methods
+    _positions = None
+    _rng = None
+
+    def __init__(self, positions, rng):
+        self._positions = iter(positions)
+        self._rng = rng
+
+    def choice(self, seq):
+        # pylint: disable=missing-docstring
+        self._rng.choice(seq)
+        return tuple(next(self._positions))
+
+
+class Journal:
+    """
+    Log of turns committed after the last full save
+
+    Each line is a JSON record with actions of one commit, positions
+    and IDs of spawned units and the next player (and squads after
+    the commit if squads were formed or disbanded).  Replay checks that
+    spawned units get the same IDs, since later actions refer to them.
+    When the log grows beyond `threshold` bytes, it is folded into a new
+    snapshot.
+    """
+    save_file = None
+    threshold = DEFAULT_THRESHOLD
+
+    def __init__(self, save_file, threshold=DEFAULT_THRESHOLD):
+        self.save_file = save_file
+        self.threshold = threshold
+
+    @property
+    def path(self):
+        # pylint: disable=missing-docstring
+        return journal_path(self.save_file)
+
+    def size(self):
+        """Size of the log in bytes"""
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def record(self, game_state, actions, result, squads_changed=False):
+        """Append committed turn (and compact the log if it's too long)"""
+        record = {
+            "actions": [encode_action(action) for action in actions],
+            "spawned": [list(pos) for _, pos in result.spawned],
+            "spawned_ids": [unit_id for unit_id, _ in result.spawned],
+            "player": game_state.current_player,
+        }
+        if squads_changed:
+            record["squads"] = game_state.squad_dict
+        line = json.dumps(record)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + '\n')
+        if self.size() > self.threshold:
+            self.compact(game_state)
+
+    def compact(self, game_state):
+        """Write full snapshot (which also truncates the log)"""
+        game_state.save(self.save_file)
+
+    def discard(self):
+        """Delete the log (after a full snapshot has been written)"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def replay(self, game_state):
+        """
+        Apply all logged turns to the state loaded from the snapshot
+        (`JournalError` if spawned units get other IDs than logged ones)
+        """
+        try:
+            file = open(self.path, encoding="utf-8")
+        except FileNotFoundError:
+            return 0
+        count = 0
+        squads = Squads(game_state)
+        with file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last record was not written completely
+                    break
+                result = commit_actions(
+                    game_state,
+                    [decode_action(action) for action in record["actions"]],
+                    _RecordedChoices(record["spawned"], game_state.rng))
+                spawned_ids = [unit_id for unit_id, _ in result.spawned]
+                if spawned_ids != record.get("spawned_ids", spawned_ids):
+                    raise JournalError(
+                        "Turn {} of journal spawned units {} instead "
+                        "of {}".format(count + 1, spawned_ids,
+                                       record["spawned_ids"]))
+                squads.remove_units(unit_id for unit_id, _ in result.killed)
+                if "squads" in record:
+                    game_state.squad_dict = {
+                        int(key): value
+                        for key, value in record["squads"].items()}
+                game_state.current_player = record["player"]
+                count += 1
+        return count
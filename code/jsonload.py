@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming loader of JSON saves
+
+A JSON save is an array `[unit_count, field, players, unit_dict,
+squad_dict, state]` written by `json.dump` with default separators and
+`ensure_ascii`, so offsets of characters are offsets of bytes.  The
+sections before `unit_dict` are decoded one by one from blocks of the
+file.  `unit_dict` is split into chunks of about `CHUNK_SIZE` bytes
+at starts of its entries (`, "<id>": {"__unittype__"`), and units of
+every chunk are put into the state as soon as it is decoded, so only
+a few chunks of text are held in memory.  Chunks of large sections are
+decoded by a pool of processes; at most two chunks per process are in
+flight, so decoded chunks don't pile up waiting for the main process.
+Garbage collector is paused while units are created (they hold no
+cycles, and repeated passes over them made loading twice slower).
+"""
+from collections import deque
+import gc
+import json
+from multiprocessing import Pool
+import os
+import re
+
+
+BLOCK_SIZE = 1 << 16
+CHUNK_SIZE = 1 << 22
+# Sections of units larger than this are decoded by processes by default
+PARALLEL_SIZE = 1 << 26
+
+_ENTRY = re.compile(rb', "\d+": \{"__unittype__"')
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader:
+    """Values of JSON document decoded from blocks of file"""
+    file = None
+    text = ""
+    offset = 0
+    pos = 0
+    eof = False
+
+    def __init__(self, file, offset=0):
+        file.seek(offset)
+        self.file = file
+        self.text = ""
+        self.offset = offset
+        self.pos = 0
+        self.eof = False
+
+    def _read(self):
+        """Append next block (growing with text, so retries stay linear)"""
+        data = self.file.read(max(BLOCK_SIZE, len(self.text) - self.pos))
+        if not data:
+            self.eof = True
+            return
+        self.offset += self.pos
+        self.text = self.text[self.pos:] + data.decode("ascii")
+        self.pos = 0
+
+    @property
+    def position(self):
+        """Offset of the next character in the file"""
+        return self.offset + self.pos
+
+    def _skip_whitespace(self):
+        while True:
+            while self.pos < len(self.text) \
+                    and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text) or self.eof:
+                return
+            self._read()
+
+    def peek(self):
+        """Next character which is not whitespace ("" at the end)"""
+        self._skip_whitespace()
+        return self.text[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        """Skip `char` (raise `ValueError` if there is another one)"""
+        if self.peek() != char:
+            raise ValueError("Expected {!r} at offset {}".format(
+                char, self.position))
+        self.pos += 1
+
+    def value(self, object_hook=None):
+        """Decode next value"""
+        self._skip_whitespace()
+        decoder = _DECODER if object_hook is None \
+            else json.JSONDecoder(object_hook=object_hook)
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # Number at the end of the block may continue in the next one
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            self._read()
+
+
+def _boundaries(file, start, chunk_size):
+    """
+    Offsets of entries of `unit_dict` which start chunks
+    (the first one is `start`, the first entry of the section)
+    """
+    result = [start]
+    while True:
+        file.seek(result[-1] + chunk_size)
+        tail = b""
+        while True:
+            data = file.read(BLOCK_SIZE)
+            if not data:
+                return result
+            window = tail + data
+            match = _ENTRY.search(window)
+            if match is not None:
+                result.append(file.tell() - len(window) + match.start() + 2)
+                break
+            # Keep the end, since the pattern may cross blocks
+            tail = window[-64:]
+
+
+def decode_chunk(path, start, end):
+    """
+    Decode entries of `unit_dict` from `start` to `end` (or to the end
+    of the section if `end` is `None`); get dictionary of raw entries
+    and offset right after the chunk (it can run in worker process)
+    """
+    with open(path, "rb") as file:
+        file.seek(start)
+        if end is not None:
+            text = file.read(end - start).decode("ascii")
+            return json.loads("{" + text + "}"), end
+        text = file.read().decode("ascii")
+    entries, length = _DECODER.raw_decode("{" + text)
+    return entries, start + length - 1
+
+
+def load(game_state, path, processes=None, progress=None,
+         chunk_size=CHUNK_SIZE):
+    """
+    Load JSON save into `game_state` section by section
+
+    If `processes` is `None`, sections of units larger than
+    `PARALLEL_SIZE` are decoded by all CPUs, and smaller ones in this
+    process; 0 or 1 always decodes in this process.  `progress` is
+    called with number of loaded bytes and size of the file.
+    """
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        _load(game_state, path, processes, progress, chunk_size)
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def _load(game_state, path, processes, progress, chunk_size):
+    # pylint: disable=too-many-arguments,too-many-locals
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from .state import game_object_hook
+
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        reader = _Reader(file)
+        reader.expect("[")
+        head = []
+        for _ in range(3):
+            head.append(reader.value(game_object_hook))
+            reader.expect(",")
+        game_state.begin_json_load(*head)
+        reader.expect("{")
+        start = reader.position
+        if progress is not None:
+            progress(start, size)
+        if reader.peek() == "}":
+            reader.pos += 1
+            tail = reader.position
+            bounds = []
+        else:
+            bounds = _boundaries(file, reader.position, chunk_size)
+    # Chunks end before separator ", " of the next entry
+    chunks = [(path, first, second - 2) for first, second in
+              zip(bounds, bounds[1:])] + [(path, bound, None)
+                                          for bound in bounds[-1:]]
+
+    if processes is None:
+        processes = os.cpu_count() if size - start > PARALLEL_SIZE else 0
+    unit_dict = game_state.unit_dict
+    if processes > 1 and len(chunks) > 1:
+        with Pool(processes) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(decode_chunk, chunk))
+                if len(pending) >= 2 * processes:
+                    tail = _put_units(unit_dict, pending.popleft().get(),
+                                      size, progress)
+            while pending:
+                tail = _put_units(unit_dict, pending.popleft().get(),
+                                  size, progress)
+    else:
+        for chunk in chunks:
+            tail = _put_units(unit_dict, decode_chunk(*chunk), size, progress)
+
+    with open(path, "rb") as file:
+        reader = _Reader(file, tail)
+        reader.expect(",")
+        squads = reader.value()
+        state = None
+        if reader.peek() == ",":
+            reader.pos += 1
+            state = reader.value()
+        reader.expect("]")
+    game_state.finish_json_load(squads, state)
+    if progress is not None:
+        progress(size, size)
+
+
+def _put_units(unit_dict, result, size, progress):
+    """Add decoded units of chunk; get offset after the chunk"""
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from .state import game_object_hook
+
+    entries, end = result
+    for key, value in entries.items():
+        unit_dict[int(key)] = game_object_hook(value)
+    if progress is not None:
+        progress(end, size)
+    return end
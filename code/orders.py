@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled buffer of planned actions
+
+Actions are kept as records in parallel arrays (kind, unit, two
+arguments) and indexed by unit, so conflicting orders are found when
+they are added and orders of one unit are replaced or cancelled in
+constant time.  Cancelled records stay in place until the buffer is
+compacted; iteration yields `Action` tuples in order of insertion.
+"""
+from array import array
+
+from .commit import Action
+from .units import abc, registry
+
+
+# Kinds of records (0 marks cancelled one)
+CANCELLED, SPAWN, MOVE, ATTACK, AREA = range(5)
+NAMES = {SPAWN: "spawn", MOVE: "move", ATTACK: "attack", AREA: "area"}
+KINDS = {name: kind for kind, name in NAMES.items()}
+# Area attack takes the place of unit's attack
+_SLOTS = {SPAWN: SPAWN, MOVE: MOVE, ATTACK: ATTACK, AREA: ATTACK}
+
+# Buffer is compacted when it has more cancelled records than this
+# and than live ones
+MIN_COMPACT = 64
+
+
+class OrderConflict(ValueError):
+    """Unit already has an order of the same kind"""
+
+
+class OrderBuffer:
+    """
+    Queue of planned actions of one turn
+
+    Every unit can have at most one move and one attack (single
+    or area one); HQs may queue any number of spawns.  Attack records
+    keep damage they are going to deal, so `projected_damage` tells
+    if a target is already doomed.
+    """
+    kinds = None
+    unit_ids = None
+    first = None
+    second = None
+    _index = None
+    _damage = None
+    _live = 0
+
+    def __init__(self, actions=()):
+        self.clear()
+        self.extend(actions)
+
+    def clear(self):
+        """Remove all records"""
+        self.kinds = array('b')
+        self.unit_ids = array('i')
+        self.first = array('i')
+        self.second = array('i')
+        # unit ID -> {kind: slot} (list of slots for spawns)
+        self._index = {}
+        self._damage = {}
+        self._live = 0
+
+    def __len__(self):
+        return self._live
+
+    def __iter__(self):
+        kinds = self.kinds
+        for slot in range(len(kinds)):
+            if kinds[slot]:
+                yield self._action(slot)
+
+    def __repr__(self):
+        return "OrderBuffer({!r})".format(list(self))
+
+    def _action(self, slot):
+        kind = self.kinds[slot]
+        unit_id = self.unit_ids[slot]
+        if kind == SPAWN:
+            params = {"class": registry.kind_by_code(self.first[slot]).name}
+        elif kind == MOVE:
+            params = {"delta": abc.Vector(self.first[slot], self.second[slot])}
+        elif kind == AREA:
+            params = {
+                "center": abc.Vector(self.first[slot], self.second[slot])}
+        else:
+            params = {"target_id": self.first[slot]}
+        return Action(NAMES[kind], unit_id, params)
+
+    @staticmethod
+    def _compile(action):
+        """Get `(kind, first, second)` of action"""
+        kind = KINDS.get(action.name)
+        if kind == SPAWN:
+            unit_kind = registry.KINDS.get(action.params["class"])
+            if unit_kind is None:
+                raise ValueError("Unknown unit class {!r}".format(
+                    action.params["class"]))
+            return kind, registry.type_code(unit_kind), 0
+        if kind == MOVE:
+            delta = action.params["delta"]
+            return kind, delta[0], delta[1]
+        if kind == ATTACK:
+            return kind, action.params["target_id"], 0
+        if kind == AREA:
+            center = action.params["center"]
+            return kind, center[0], center[1]
+        raise ValueError("Unknown action {!r}".format(action.name))
+
+    def _write(self, slot, unit_id, kind, first, second):
+        if slot == len(self.kinds):
+            self.kinds.append(kind)
+            self.unit_ids.append(unit_id)
+            self.first.append(first)
+            self.second.append(second)
+        else:
+            self.kinds[slot] = kind
+            self.unit_ids[slot] = unit_id
+            self.first[slot] = first
+            self.second[slot] = second
+        if kind == ATTACK:
+            self._damage[first] = self._damage.get(first, 0) + second
+
+    def append(self, action, damage=0):
+        """
+        Add action (`damage` of attacker is needed for attacks);
+        `OrderConflict` if unit already has order of that kind
+        """
+        kind, first, second = self._compile(action)
+        if kind == ATTACK:
+            second = damage
+        orders = self._index.setdefault(action.unit_id, {})
+        if kind == SPAWN:
+            slot = len(self.kinds)
+            orders.setdefault(SPAWN, []).append(slot)
+        else:
+            if _SLOTS[kind] in orders:
+                raise OrderConflict("Unit {} already has {} order.".format(
+                    action.unit_id, NAMES[_SLOTS[kind]]))
+            slot = len(self.kinds)
+            orders[_SLOTS[kind]] = slot
+        self._write(slot, action.unit_id, kind, first, second)
+        self._live += 1
+
+    def extend(self, actions):
+        """Add actions one by one"""
+        for action in actions:
+            self.append(action)
+
+    def add_group(self, name, records):
+        """
+        Add moves or area attacks given as `(unit_id, x, y)` records
+        at once (`x, y` is delta of move or center of attack), skipping
+        units which already have order of that kind; get their number
+        """
+        kind = KINDS[name]
+        if kind not in (MOVE, AREA):
+            raise ValueError("Only moves and area attacks can be grouped")
+        slot_kind = _SLOTS[kind]
+        index = self._index
+        start = slot = len(self.kinds)
+        unit_ids, first, second = self.unit_ids, self.first, self.second
+        for unit_id, x, y in records:
+            # pylint: disable=invalid-name
+            orders = index.setdefault(unit_id, {})
+            if slot_kind in orders:
+                continue
+            orders[slot_kind] = slot
+            slot += 1
+            unit_ids.append(unit_id)
+            first.append(x)
+            second.append(y)
+        self.kinds.extend(array('b', [kind]) * (slot - start))
+        self._live += slot - start
+        return slot - start
+
+    def replace(self, action, damage=0):
+        """Add move or attack, overwriting unit's previous one in place"""
+        kind, first, second = self._compile(action)
+        slot = self._index.get(action.unit_id, {}).get(_SLOTS[kind])
+        if kind == SPAWN or slot is None:
+            self.append(action, damage)
+            return
+        if self.kinds[slot] == ATTACK:
+            self._damage[self.first[slot]] -= self.second[slot]
+        if kind == ATTACK:
+            second = damage
+        self._write(slot, action.unit_id, kind, first, second)
+
+    def order_of(self, unit_id, name):
+        """
+        Queued move or attack of unit (`None` if there is no one;
+        "attack" also finds area attack)
+        """
+        slot = self._index.get(unit_id, {}).get(_SLOTS[KINDS[name]])
+        return None if slot is None else self._action(slot)
+
+    def orders_of(self, unit_id):
+        """All queued actions of unit in order of insertion"""
+        slots = []
+        for kind, value in self._index.get(unit_id, {}).items():
+            slots.extend(value if kind == SPAWN else (value,))
+        return [self._action(slot) for slot in sorted(slots)]
+
+    def projected_damage(self, target_id):
+        """Sum of damage of queued attacks on target"""
+        return self._damage.get(target_id, 0)
+
+    def cancel(self, unit_id, name=None):
+        """Cancel unit's orders (of one kind if `name` is given); get count"""
+        orders = self._index.get(unit_id)
+        if not orders:
+            return 0
+        kinds = list(orders) if name is None else [_SLOTS[KINDS[name]]]
+        slots = []
+        for kind in kinds:
+            value = orders.get(kind)
+            if value is not None:
+                slots.extend(value if kind == SPAWN else (value,))
+        for slot in slots:
+            self._kill(slot)
+        self._trim()
+        return len(slots)
+
+    def pop(self):
+        """Remove and return last action (`IndexError` if there is none)"""
+        if not self._live:
+            raise IndexError("pop from empty buffer")
+        slot = len(self.kinds) - 1
+        action = self._action(slot)
+        self._kill(slot)
+        self._trim()
+        return action
+
+    def _kill(self, slot):
+        """Mark record as cancelled and remove it from indices"""
+        kind = self.kinds[slot]
+        unit_id = self.unit_ids[slot]
+        orders = self._index[unit_id]
+        if kind == SPAWN:
+            orders[SPAWN].remove(slot)
+            if not orders[SPAWN]:
+                del orders[SPAWN]
+        else:
+            del orders[_SLOTS[kind]]
+        if not orders:
+            del self._index[unit_id]
+        if kind == ATTACK:
+            self._damage[self.first[slot]] -= self.second[slot]
+        self.kinds[slot] = CANCELLED
+        self._live -= 1
+
+    def _trim(self):
+        """Drop cancelled records from the end; compact if too many left"""
+        kinds = self.kinds
+        while kinds and not kinds[-1]:
+            for column in (kinds, self.unit_ids, self.first, self.second):
+                column.pop()
+        dead = len(kinds) - self._live
+        if dead > MIN_COMPACT and dead > self._live:
+            self._compact()
+
+    def _compact(self):
+        records = [(self.unit_ids[slot], self.kinds[slot], self.first[slot],
+                    self.second[slot])
+                   for slot in range(len(self.kinds)) if self.kinds[slot]]
+        self.clear()
+        for slot, (unit_id, kind, first, second) in enumerate(records):
+            orders = self._index.setdefault(unit_id, {})
+            if kind == SPAWN:
+                orders.setdefault(SPAWN, []).append(slot)
+            else:
+                orders[_SLOTS[kind]] = slot
+            self._write(slot, unit_id, kind, first, second)
+        self._live = len(records)
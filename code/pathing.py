@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Flow fields for long-range moves
+
+A flow field keeps distance (in moves) from every cell to its goal,
+so any unit heading to the goal just steps to the neighbour cell with
+the smallest distance.  Cells with units of other players are blocked.
+Fields are cached per goal and color and shared by all units; they
+are dropped when a cell becomes blocked or free for their color
+(`GameState` reports changed cells to `Pathfinder` as to any other
+listener); moves which don't change that keep the fields.
+"""
+from array import array
+from collections import deque
+
+# Order of steps; straight steps are preferred over diagonal ones
+STEPS = ((0, -1), (-1, 0), (1, 0), (0, 1),
+         (-1, -1), (1, -1), (-1, 1), (1, 1))
+
+# Larger fields are not searched: units step straight to the goal
+MAX_FIELD_AREA = 1 << 20
+
+
+class FlowField:
+    """Distances to `goal` (-1 for blocked and unreachable cells)"""
+    width = 0
+    height = 0
+    goal = None
+    distance = None
+
+    def __init__(self, width, height, goal, blocked=()):
+        self.width = width
+        self.height = height
+        self.goal = goal
+        distance = array('i', [-1]) * (width * height)
+        for x, y in blocked:
+            # pylint: disable=invalid-name
+            distance[y * width + x] = -2
+        start = goal[1] * width + goal[0]
+        distance[start] = 0
+        queue = deque((goal,))
+        while queue:
+            x, y = queue.popleft()
+            # pylint: disable=invalid-name
+            next_distance = distance[y * width + x] + 1
+            for dx, dy in STEPS:
+                new_x, new_y = x + dx, y + dy
+                if 0 <= new_x < width and 0 <= new_y < height:
+                    cell = new_y * width + new_x
+                    if distance[cell] == -1:
+                        distance[cell] = next_distance
+                        queue.append((new_x, new_y))
+        for x, y in blocked:
+            # pylint: disable=invalid-name
+            if distance[y * width + x] == -2:
+                distance[y * width + x] = -1
+        self.distance = distance
+
+    def distance_at(self, x, y):
+        """Number of moves from cell to the goal (-1 if unreachable)"""
+        # pylint: disable=invalid-name
+        return self.distance[y * self.width + x]
+
+    def step(self, x, y):
+        """
+        Best move `(dx, dy)` from cell, `(0, 0)` at the goal
+        or `None` if the goal can't be reached from there
+        """
+        # pylint: disable=invalid-name
+        if (x, y) == self.goal:
+            return (0, 0)
+        best, best_distance = None, -1
+        for dx, dy in STEPS:
+            new_x, new_y = x + dx, y + dy
+            if 0 <= new_x < self.width and 0 <= new_y < self.height:
+                value = self.distance[new_y * self.width + new_x]
+                if value >= 0 and (best is None or value < best_distance):
+                    best, best_distance = (dx, dy), value
+        return best
+
+
+def _sign(value):
+    return (value > 0) - (value < 0)
+
+
+class Pathfinder:
+    """
+    Cache of flow fields of one `GameState`
+
+    `computed` counts fields built since creation (useful to check
+    that units heading to one goal share the field).
+    """
+    game_state = None
+    fields = None
+    computed = 0
+    # Color -> set of cells which were blocked when its fields were built
+    _blocked_cells = None
+
+    def __init__(self, game_state):
+        self.game_state = game_state
+        self.fields = {}
+        self._blocked_cells = {}
+        self.computed = 0
+        game_state.add_listener(self)
+
+    def reset(self):
+        """Forget all fields"""
+        self.fields.clear()
+        self._blocked_cells.clear()
+
+    def cell_changed(self, x, y):
+        """
+        Drop fields of colors for which the cell became blocked
+        or free (called by `GameState`)
+        """
+        # pylint: disable=invalid-name
+        if not self._blocked_cells:
+            return
+        unit_dict = self.game_state.unit_dict
+        colors = {unit_dict[unit_id].color
+                  for unit_id in self.game_state.grid.units_at(x, y)}
+        for color, blocked in list(self._blocked_cells.items()):
+            if ((x, y) in blocked) == bool(colors - {color}):
+                continue
+            del self._blocked_cells[color]
+            for key in [key for key in self.fields if key[2] == color]:
+                del self.fields[key]
+
+    def _blocked(self, color):
+        """Cells with units of other colors (remembered until they change)"""
+        blocked = self._blocked_cells.get(color)
+        if blocked is None:
+            grid = self.game_state.grid
+            unit_dict = self.game_state.unit_dict
+            blocked = {(x, y) for x, y, ids in grid.occupied_cells()
+                       if any(unit_dict[unit_id].color != color
+                              for unit_id in ids)}
+            self._blocked_cells[color] = blocked
+        return blocked
+
+    def field(self, goal, color):
+        """Flow field to `goal` for units of given color (cached)"""
+        key = (goal[0], goal[1], color)
+        field = self.fields.get(key)
+        if field is None:
+            field = FlowField(self.game_state.width, self.game_state.height,
+                              (goal[0], goal[1]), self._blocked(color))
+            self.fields[key] = field
+            self.computed += 1
+        return field
+
+    def step(self, pos, goal, color):
+        """Next move `(dx, dy)` from `pos` to `goal` (`None` if blocked)"""
+        if self.game_state.width * self.game_state.height > MAX_FIELD_AREA:
+            return (_sign(goal[0] - pos[0]), _sign(goal[1] - pos[1]))
+        return self.field(goal, color).step(pos[0], pos[1])
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Cached textual view of the field for `show` command"""
+
+
+class Renderer:
+    """
+    Character buffer of the field as seen by one player
+
+    Field is split into square tiles which are rendered on first view.
+    `GameState` reports changed cells, and only those are rendered
+    again before the next viewport.  Every cell takes two bytes in
+    the buffer (its character and a space), so a row of viewport is
+    a concatenation of slices of tiles.
+
+    With `visibility`, cells which units of the player don't see
+    are shown as `FOG`, and cells which change visibility for the
+    player are rendered again too.
+    """
+    game_state = None
+    player = 0
+    tile_size = 32
+    visibility = None
+    _tiles = None
+    _dirty = None
+
+    FOG = ord('?')
+
+    def __init__(self, game_state, player, tile_size=32, visibility=None):
+        self.game_state = game_state
+        self.player = player
+        self.tile_size = tile_size
+        self.visibility = visibility
+        self.reset()
+        game_state.add_listener(self)
+        if visibility is not None:
+            visibility.add_listener(self)
+
+    def reset(self):
+        """Forget all rendered tiles"""
+        self._tiles = {}
+        self._dirty = {}
+
+    def cell_changed(self, x, y):
+        """Mark cell to be rendered again (called by `GameState`)"""
+        # pylint: disable=invalid-name
+        tile = (x // self.tile_size, y // self.tile_size)
+        if tile in self._tiles:
+            self._dirty.setdefault(tile, set()).add((x, y))
+
+    def visibility_changed(self, color, x, y):
+        """Mark cell which player started or stopped seeing"""
+        # pylint: disable=invalid-name
+        if color == self._own_color():
+            self.cell_changed(x, y)
+
+    def _char(self, x, y, own_color):
+        # pylint: disable=invalid-name
+        if self.visibility is not None \
+                and not self.visibility.visible(own_color, x, y):
+            return self.FOG
+        ids = self.game_state.grid.units_at(x, y)
+        if not ids:
+            return ord('_')
+        if len(ids) > 1:
+            return ord('M')
+        unit = self.game_state.unit_dict[ids[0]]
+        if unit.color == own_color:
+            return ord(unit.char.upper())
+        return ord(unit.char.lower())
+
+    def _render_tile(self, tile):
+        """Render whole tile (only occupied cells need lookups)"""
+        size = self.tile_size
+        buffer = bytearray(b"_ " * (size * size))
+        own_color = self._own_color()
+        x0, y0 = tile[0] * size, tile[1] * size
+        if self.visibility is not None:
+            visible = self.visibility.visible
+            for y in range(y0, y0 + size):
+                # pylint: disable=invalid-name
+                for x in range(x0, x0 + size):
+                    if not visible(own_color, x, y):
+                        buffer[2 * ((y - y0) * size + x - x0)] = self.FOG
+        for x, y, _ in self.game_state.grid.cells_in_rect(
+                x0, y0, x0 + size - 1, y0 + size - 1):
+            # pylint: disable=invalid-name
+            buffer[2 * ((y - y0) * size + x - x0)] = \
+                self._char(x, y, own_color)
+        self._tiles[tile] = buffer
+        return buffer
+
+    def _own_color(self):
+        return self.game_state.list_of_player_infos[self.player].color
+
+    def _get_tile(self, tile):
+        """Get buffer of tile with all dirty cells rendered again"""
+        buffer = self._tiles.get(tile)
+        if buffer is None:
+            return self._render_tile(tile)
+        dirty = self._dirty.pop(tile, None)
+        if dirty:
+            size = self.tile_size
+            own_color = self._own_color()
+            for x, y in dirty:
+                # pylint: disable=invalid-name
+                buffer[2 * ((y % size) * size + x % size)] = \
+                    self._char(x, y, own_color)
+        return buffer
+
+    def viewport(self, x1, y1, x2, y2):
+        """Text of rectangle (bounds are inclusive), one line per row"""
+        size = self.tile_size
+        tiles_x = range(x1 // size, x2 // size + 1)
+        lines = []
+        for tile_y in range(y1 // size, y2 // size + 1):
+            row_tiles = [self._get_tile((tile_x, tile_y))
+                         for tile_x in tiles_x]
+            for y in range(max(y1, tile_y * size),
+                           min(y2, tile_y * size + size - 1) + 1):
+                # pylint: disable=invalid-name
+                offset = 2 * (y % size) * size
+                parts = []
+                for tile_x, buffer in zip(tiles_x, row_tiles):
+                    start = max(x1 - tile_x * size, 0)
+                    end = min(x2 - tile_x * size, size - 1) + 1
+                    parts.append(
+                        buffer[offset + 2 * start:offset + 2 * end])
+                line = b"".join(parts)
+                lines.append(line[:-1])
+        return b"\n".join(lines).decode("ascii") + "\n"
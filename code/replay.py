@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Recorded games and their headless replay
+
+Usage: python -m code.replay LOG
+
+Log is a file of JSON lines: the first one has the initial state (as
+in JSON saves, including state of the random generator), then every
+commit adds its actions and the next player, and `Recorder.finish`
+adds digest of the final state.  `replay` commits the same actions
+without any checks or output and compares digests.
+"""
+from collections import namedtuple
+import hashlib
+import json
+import sys
+
+from .commit import commit_actions
+from .journal import decode_action, encode_action
+from .state import GameEncoder, GameState, game_object_hook
+
+
+ReplayResult = namedtuple(
+    "ReplayResult",
+    [
+        "turns",
+        "digest",
+        "expected",
+        "game_state",
+    ]
+)
+
+
+def state_digest(game_state):
+    """SHA-256 of everything that affects the rest of the game"""
+    data = [
+        game_state.current_player,
+        game_state.list_of_player_infos,
+        {str(unit_id): unit for unit_id, unit in game_state.unit_dict.items()},
+        list(game_state.grid.occupied_cells()),
+        game_state.rng_state(),
+    ]
+    text = json.dumps(data, cls=GameEncoder, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Recorder:
+    """
+    Writes initial state and commits of an `Engine` to a log
+
+    Set it as `engine.recorder` before the first commit.
+    """
+    path = None
+    turns = 0
+
+    def __init__(self, path, game_state):
+        self.path = path
+        self.turns = 0
+        header = {
+            "array_store": game_state.store is not None,
+            "state": game_state.json_data(),
+        }
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(json.dumps(header, cls=GameEncoder) + '\n')
+
+    def record(self, game_state, actions, result):
+        """Append committed turn (called by `Engine.commit`)"""
+        # pylint: disable=unused-argument
+        line = json.dumps({
+            "actions": [encode_action(action) for action in actions],
+            "player": game_state.current_player,
+        })
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + '\n')
+        self.turns += 1
+
+    def finish(self, game_state):
+        """Append digest of the final state"""
+        line = json.dumps({"turns": self.turns,
+                           "digest": state_digest(game_state)})
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + '\n')
+
+
+def replay(path):
+    """Replay log and get `ReplayResult` (`expected` is `None` if unknown)"""
+    expected = None
+    turns = 0
+    with open(path, encoding="utf-8") as file:
+        header = json.loads(file.readline(), object_hook=game_object_hook)
+        game_state = GameState(1, 1, 1, array_store=header["array_store"])
+        game_state.load_json_data(header["state"])
+        for line in file:
+            record = json.loads(line)
+            if "digest" in record:
+                expected = record["digest"]
+                continue
+            commit_actions(
+                game_state,
+                [decode_action(action) for action in record["actions"]],
+                game_state.rng)
+            game_state.current_player = record["player"]
+            turns += 1
+    return ReplayResult(turns, state_digest(game_state), expected, game_state)
+
+
+def main(argv=None):
+    """Command line entry point; return exit code"""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        sys.stderr.write("Usage: python -m code.replay LOG\n")
+        return 2
+    result = replay(argv[0])
+    sys.stdout.write("Turns: {}\nDigest: {}\n".format(
+        result.turns, result.digest))
+    if result.expected is None:
+        sys.stdout.write("No digest recorded.\n")
+        return 0
+    if result.expected != result.digest:
+        sys.stdout.write("MISMATCH (expected {})\n".format(result.expected))
+        return 1
+    sys.stdout.write("OK\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed JSON saves and saving in background
+
+Saves with suffix `.gz` or `.xz` are JSON compressed by `gzip` or
+`lzma`.  Every JSON save is written to a temporary file next to the
+target and renamed over it, so a save is never left half-written.
+
+`BackgroundSaver` takes a `Snapshot` of the state (copies of units,
+the field and players, which takes a small part of the time of
+encoding) and encodes, compresses and writes it in a thread.  At most
+one save is in flight: a save requested meanwhile waits as the only
+pending one (a newer request replaces it), and autosaves are skipped.
+"""
+import copy
+import gc
+import gzip
+import json
+import lzma
+import os
+import tempfile
+import threading
+
+from .journal import Journal
+from .state import Wrapper
+from .store import UnitMapping
+
+
+# Openers of compressed files (they accept names and file objects)
+COMPRESSED = {
+    ".gz": gzip.open,
+    ".xz": lzma.open,
+}
+# Encoded text is written in pieces of about this size
+WRITE_SIZE = 1 << 16
+
+
+def compression(filename):
+    """Suffix of compressed save (`None` for plain JSON)"""
+    suffix = os.path.splitext(str(filename))[1]
+    return suffix if suffix in COMPRESSED else None
+
+
+def _copy_unit(unit):
+    try:
+        attributes = unit.__dict__
+    except AttributeError:
+        return copy.copy(unit)
+    # Attributes of units are replaced, never changed in place
+    other = object.__new__(type(unit))
+    other.__dict__.update(attributes)
+    return other
+
+
+class Snapshot:
+    """
+    Contents of JSON save which don't change with the state
+    (has attributes of `GameState` used by `catalog.Catalog`)
+    """
+    # pylint: disable=too-few-public-methods
+    data = None
+    width = 0
+    height = 0
+
+    def __init__(self, game_state):
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            data = game_state.json_data()
+            # Field and state of the game are built anew by `json_data`
+            # Wrappers are copied too: changes replace their `obj`
+            data[2] = [Wrapper(info.obj) for info in data[2]]
+            if game_state.store is not None:
+                data[3] = UnitMapping(game_state.store.copy())
+            else:
+                data[3] = {unit_id: _copy_unit(unit)
+                           for unit_id, unit in data[3].items()}
+            data[4] = copy.deepcopy(data[4])
+        finally:
+            if collecting:
+                gc.enable()
+        self.data = data
+        self.width = game_state.width
+        self.height = game_state.height
+
+    @property
+    def list_of_player_infos(self):
+        # pylint: disable=missing-docstring
+        return self.data[2]
+
+    @property
+    def unit_dict(self):
+        # pylint: disable=missing-docstring
+        return self.data[3]
+
+    @property
+    def current_player(self):
+        # pylint: disable=missing-docstring
+        return self.data[5]["current_player"]
+
+    def json_data(self):
+        """Contents of JSON save (see `GameState.json_data`)"""
+        return self.data
+
+
+def write_json(data, filename):
+    """
+    Encode contents of JSON save (compressed if filename has suffix
+    from `COMPRESSED`) to temporary file and rename it to `filename`
+    """
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from .state import GameEncoder
+
+    filename = str(filename)
+    directory, name = os.path.split(filename)
+    handle, temporary = tempfile.mkstemp(
+        prefix=name + ".", suffix=".tmp", dir=directory or ".")
+    try:
+        # Temporary files are private, saves are not
+        os.chmod(temporary, 0o644)
+        with open(handle, "wb") as raw:
+            suffix = compression(filename)
+            file = raw if suffix is None else COMPRESSED[suffix](raw, "wb")
+            pieces, size = [], 0
+            for piece in GameEncoder().iterencode(data):
+                pieces.append(piece)
+                size += len(piece)
+                if size >= WRITE_SIZE:
+                    file.write("".join(pieces).encode("utf-8"))
+                    pieces, size = [], 0
+            file.write("".join(pieces).encode("utf-8"))
+            if file is not raw:
+                # Closing compressor writes its trailer (not closing `raw`)
+                file.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temporary, filename)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+
+def read_json(filename, object_hook=None):
+    """Decode JSON save (compressed or not)"""
+    suffix = compression(filename)
+    if suffix is None:
+        with open(filename, encoding="utf-8") as file:
+            return json.load(file, object_hook=object_hook)
+    with COMPRESSED[suffix](filename, "rb") as file:
+        return json.loads(file.read().decode("utf-8"),
+                          object_hook=object_hook)
+
+
+class BackgroundSaver:
+    """
+    Writes snapshots of game states in a thread, one at a time
+
+    Results are reported by `poll` (call it from the thread of the
+    shell): every function in `listeners` gets the snapshot, the file
+    name and the exception (`None` if the save succeeded).  Autosave
+    is done by `committed` every `interval` commits to `filename`.
+    """
+    interval = 0
+    filename = None
+    listeners = None
+    _commits = 0
+    _lock = None
+    _thread = None
+    _pending = None
+    _finished = None
+
+    def __init__(self, interval=0):
+        self.interval = interval
+        self.filename = None
+        self.listeners = []
+        self._commits = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = None
+        self._finished = []
+
+    @property
+    def busy(self):
+        """Whether a save is in flight"""
+        with self._lock:
+            return self._thread is not None
+
+    def save(self, game_state, filename, skip_if_busy=False):
+        """
+        Snapshot state and write it in background; get `False`
+        if it's skipped because another save is in flight
+        """
+        if skip_if_busy and self.busy:
+            return False
+        job = (Snapshot(game_state), str(filename))
+        with self._lock:
+            if self._thread is not None:
+                if skip_if_busy:
+                    return False
+                self._pending = job
+                return True
+            self._thread = threading.Thread(
+                target=self._run, args=(job,), name="saver")
+            self._thread.start()
+        return True
+
+    def committed(self, game_state):
+        """Count commit and start autosave when it's time"""
+        # Journal already logs every commit of the state
+        if not self.interval or self.filename is None \
+                or game_state.journal is not None:
+            return False
+        self._commits += 1
+        if self._commits < self.interval:
+            return False
+        if not self.save(game_state, self.filename, skip_if_busy=True):
+            return False
+        self._commits = 0
+        return True
+
+    def _run(self, job):
+        while job is not None:
+            snapshot, filename = job
+            error = None
+            try:
+                write_json(snapshot.json_data(), filename)
+                Journal(filename).discard()
+            except Exception as err:  # pylint: disable=broad-except
+                error = err
+            with self._lock:
+                self._finished.append((snapshot, filename, error))
+                job, self._pending = self._pending, None
+                if job is None:
+                    self._thread = None
+
+    def poll(self):
+        """Report finished saves to listeners; get their number"""
+        with self._lock:
+            finished, self._finished = self._finished, []
+        for snapshot, filename, error in finished:
+            for listener in self.listeners:
+                listener(snapshot, filename, error)
+        return len(finished)
+
+    def wait(self):
+        """Wait for saves in flight and pending ones, then `poll`"""
+        while True:
+            with self._lock:
+                thread = self._thread
+            if thread is None:
+                break
+            thread.join()
+        return self.poll()
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Game server: many sessions in one process
+
+Usage: python -m code.server [--host HOST] [--port PORT] [--unix PATH]
+
+Protocol is line-based.  Outside of a session client may send
+`new <name> [<players> <width> <height>]`, `open <save>`, `join <name>
+<player>`, `sessions` and `quit`.  Inside a session lines are commands
+of `GameShell` (`show`, `select`, `move`, `commit`...), JSON orders like
+`{"order": "move", "unit_id": 2, "dx": 1, "dy": 0}`, `save [<save>]`
+and `leave`.  Every reply ends with a line containing only `.`; lines
+which are too long or fail get an error reply, and the client is
+served on.
+`show` and `inspect` reveal only what units of the client's player
+see, whoever's turn it is (fog of war can't be turned off).
+
+Commands of one session are executed one at a time; orders and
+commits are accepted only from the client of the current player.
+Saves and loads run in the default executor, so other sessions go on
+while the disk is busy.
+"""
+import argparse
+import asyncio
+import io
+import json
+from pathlib import Path
+
+from .ai import AIPlayer
+from .catalog import SUFFIXES
+from .engine import AreaOrder, AttackOrder, Engine, GotoOrder, MoveOrder, \
+    OrderError, SpawnOrder, SquadAreaOrder, SquadGotoOrder, SquadMoveOrder
+from .shells.game import GameShell
+from .state import FIELD_HEIGHT, FIELD_WIDTH, GameState
+from .visibility import Visibility
+
+
+END_OF_REPLY = "."
+
+# Commands of `GameShell` which change plans of the current player
+TURN_COMMANDS = {"spawn", "move", "attack", "goto", "undo", "cancel",
+                 "commit", "ai", "squad"}
+# Commands of `GameShell` which make no sense over network
+LOCAL_COMMANDS = {"abort", "menu", "exit", "EOF"}
+
+ORDERS = {
+    "spawn": (SpawnOrder, ("unit_id", "class_name")),
+    "move": (MoveOrder, ("unit_id", "dx", "dy")),
+    "attack": (AttackOrder, ("unit_id", "target_id")),
+    "area": (AreaOrder, ("unit_id", "x", "y")),
+    "goto": (GotoOrder, ("unit_id", "x", "y")),
+    "squad_move": (SquadMoveOrder, ("squad_id", "dx", "dy")),
+    "squad_area": (SquadAreaOrder, ("squad_id", "x", "y")),
+    "squad_goto": (SquadGotoOrder, ("squad_id", "x", "y")),
+}
+
+# AI turns run in the event loop, so they get a short budget
+AI_BUDGET = 0.05
+
+
+async def _read_line(reader):
+    """
+    Next line from client (`b""` at the end); `None` if the line
+    exceeds limit of the stream (the whole line is skipped then)
+    """
+    too_long = False
+    while True:
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as err:
+            return b"" if too_long else err.partial
+        except asyncio.LimitOverrunError as err:
+            # Drop the part which is in the buffer and look further
+            too_long = True
+            await reader.readexactly(err.consumed)
+            continue
+        return None if too_long else line
+
+
+class Session:
+    """Game shared by clients (one per player)"""
+    name = ""
+    game_state = None
+    engine = None
+    visibility = None
+    ai_player = None
+    lock = None
+    save_file = None
+
+    def __init__(self, name, game_state, save_file=None):
+        self.name = name
+        self.game_state = game_state
+        self.engine = Engine(game_state)
+        self.visibility = Visibility(game_state)
+        self.ai_player = AIPlayer(budget=AI_BUDGET)
+        self.lock = asyncio.Lock()
+        self.save_file = save_file
+
+    def shell(self, player):
+        """
+        New `GameShell` of client playing as `player` which writes
+        to a buffer (it shows the field as seen by that player, and
+        its renderers and fog switch are its own)
+        """
+        shell = GameShell(self.game_state, stdout=io.StringIO(),
+                          engine=self.engine, viewer=player)
+        shell.visibility = self.visibility
+        shell.ai_player = self.ai_player
+        return shell
+
+
+class Client:
+    """State of one connection"""
+    # pylint: disable=too-few-public-methods
+    session = None
+    player = None
+    shell = None
+
+
+class GameServer:
+    """Sessions by name and handler of client connections"""
+    directory = "saves"
+    sessions = None
+    server = None
+
+    def __init__(self, directory="saves"):
+        self.directory = directory
+        self.sessions = {}
+
+    def _save_path(self, name):
+        """Path of save file like in `MenuShell` (only inside directory)"""
+        name = Path(name).name
+        if Path(name).suffix not in SUFFIXES:
+            name += ".json"
+        return str(Path(self.directory) / name)
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        """Listen on TCP port (or Unix socket if `path` is given)"""
+        if path is not None:
+            self.server = await asyncio.start_unix_server(
+                self.handle, path=path)
+        else:
+            self.server = await asyncio.start_server(
+                self.handle, host=host, port=port)
+        return self.server
+
+    async def handle(self, reader, writer):
+        """
+        Serve one client until it quits or disconnects (errors of
+        single lines are reported to the client, which is served on)
+        """
+        client = Client()
+        try:
+            while True:
+                line = await _read_line(reader)
+                if line is None:
+                    reply, done = "Error: Line is too long.", False
+                elif not line:
+                    break
+                else:
+                    reply, done = await self._reply(client, line)
+                if reply and not reply.endswith("\n"):
+                    reply += "\n"
+                writer.write((reply + END_OF_REPLY + "\n").encode("utf-8"))
+                await writer.drain()
+                if done:
+                    break
+        except ConnectionError:
+            # Client is gone, so there is nobody to reply to
+            pass
+        finally:
+            writer.close()
+
+    async def _reply(self, client, line):
+        try:
+            return await self.execute(client, line.decode("utf-8").strip())
+        except (ValueError, KeyError, TypeError, IndexError) as err:
+            return "Error: {} ({}).".format(err, type(err).__name__), False
+
+    async def execute(self, client, line):
+        """Get reply to line and flag telling to close the connection"""
+        if line == "quit":
+            return "Bye.", True
+        if client.session is None:
+            return await self._menu_command(client, line), False
+        if line == "leave":
+            client.session = client.shell = None
+            return "Left the session.", False
+        async with client.session.lock:
+            return await self._game_command(client, line), False
+
+    async def _menu_command(self, client, line):
+        args = line.split()
+        if not args:
+            return ""
+        if args[0] == "sessions":
+            return "\n".join(
+                "{} ({} players)".format(
+                    name, len(session.game_state.list_of_player_infos))
+                for name, session in sorted(self.sessions.items()))
+        if args[0] == "new":
+            return self._new_session(args[1:])
+        if args[0] == "open":
+            return await self._open_session(args[1:])
+        if args[0] == "join":
+            return self._join(client, args[1:])
+        return "Unknown command: {}".format(args[0])
+
+    def _new_session(self, args):
+        if not args:
+            return "Please specify name of session."
+        if args[0] in self.sessions:
+            return "Session {} already exists.".format(args[0])
+        try:
+            players, width, height = (
+                [int(value) for value in args[1:4]] if len(args) > 1
+                else (2, FIELD_WIDTH, FIELD_HEIGHT))
+        except ValueError:
+            return "Please specify number of players, width and height."
+        if players not in (2, 4) or min(width, height) < 2:
+            return "There should be 2 or 4 players and at least 2x2 cells."
+        self.sessions[args[0]] = Session(
+            args[0], GameState(players, width, height))
+        return "Created session {}.".format(args[0])
+
+    async def _open_session(self, args):
+        if not args:
+            return "Please specify name of save file."
+        if args[0] in self.sessions:
+            return "Session {} already exists.".format(args[0])
+        path = self._save_path(args[0])
+        game_state = GameState(1, 1, 1)
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, game_state.load, path)
+        except (OSError, ValueError) as err:
+            return "Error: {}".format(err)
+        except (KeyError, TypeError, IndexError):
+            return "Error: Malformed save file."
+        if args[0] in self.sessions:
+            return "Session {} already exists.".format(args[0])
+        self.sessions[args[0]] = Session(args[0], game_state, path)
+        return "Opened session {}.".format(args[0])
+
+    def _join(self, client, args):
+        if len(args) < 2 or args[0] not in self.sessions:
+            return "Please specify existing session and player index."
+        session = self.sessions[args[0]]
+        players = len(session.game_state.list_of_player_infos)
+        try:
+            player = int(args[1])
+        except ValueError:
+            player = -1
+        if player not in range(players):
+            return "Index should lie in range [0, {}).".format(players)
+        client.session = session
+        client.player = player
+        client.shell = session.shell(player)
+        return "Joined session {} as player {}.".format(args[0], player)
+
+    async def _game_command(self, client, line):
+        session = client.session
+        if line.startswith("{"):
+            return self._structured_order(client, line)
+        command = line.split(maxsplit=1)[0] if line else ""
+        if command == "save":
+            return await self._save(session, line.split()[1:])
+        if command in LOCAL_COMMANDS:
+            return "Use \"leave\" or \"quit\" instead."
+        if command == "fog":
+            return "Fog of war is always on in network games."
+        if command in TURN_COMMANDS and \
+                session.game_state.current_player != client.player:
+            return "It's turn of player {}.".format(
+                session.game_state.current_player)
+        shell = client.shell
+        shell.stdout = io.StringIO()
+        shell.onecmd(line)
+        return shell.stdout.getvalue()
+
+    @staticmethod
+    def _structured_order(client, line):
+        try:
+            data = json.loads(line)
+            order_class, fields = ORDERS[data["order"]]
+            order = order_class(*(data[field] for field in fields))
+        except (ValueError, KeyError, TypeError):
+            return json.dumps({"ok": False, "error": "Malformed order."})
+        session = client.session
+        if session.game_state.current_player != client.player:
+            return json.dumps({"ok": False, "error": "Not your turn."})
+        try:
+            session.engine.submit(order)
+        except OrderError as err:
+            return json.dumps({"ok": False, "error": str(err)})
+        return json.dumps({"ok": True})
+
+    async def _save(self, session, args):
+        path = self._save_path(args[0]) if args else session.save_file
+        if path is None:
+            return "Please specify name of save file."
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_event_loop()
+        try:
+            # The session stays locked, so nobody changes it meanwhile
+            await loop.run_in_executor(None, session.game_state.save, path)
+        except OSError as err:
+            return "System error: {}".format(err)
+        session.save_file = path
+        return "Saved."
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(prog="python -m code.server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="path of Unix socket")
+    parser.add_argument("--directory", default="saves")
+    args = parser.parse_args(argv)
+
+    # Loop API of Python 3.6 (`asyncio.run` needs 3.7)
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(GameServer(args.directory).start(
+        args.host, args.port, args.unix))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
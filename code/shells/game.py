@@ -1,33 +1,101 @@
 # -*- coding: utf-8 -*-
 """This module contains the only class, `GameShell`"""
-import cmd
-from collections import deque, namedtuple
-import random
 import sys
 
 from .. import units
+from ..ai import AIPlayer, is_ai, set_ai
+from ..commit import Action  # pylint: disable=unused-import
+from ..engine import (
+    AreaOrder, AttackOrder, Engine, GotoOrder, MoveOrder, OrderError,
+    SpawnOrder, SquadAreaOrder, SquadGotoOrder, SquadMoveOrder)
+from ..render import Renderer
 from ..units import abc as units_abc
+from ..visibility import Visibility
+from .instrumented import InstrumentedShell
 
 
-class GameShell(cmd.Cmd):
+class GameShell(InstrumentedShell):
     """Class for handling game commands"""
     intro = "You are in the game. Congratulations!"
     prompt = "Game> "
 
     game_state = None
-    current_player = 0
-    action_queue = None
+    engine = None
+    renderers = None
+    ai_player = None
+    saver = None
+    visibility = None
+    viewer = None
+    fog = True
     selected_unit = None
     selected_unit_id = None
-    unit_count = 0
 
-    def __init__(self, game_state, stdin=None, stdout=None):
-        super().__init__(stdin=stdin, stdout=stdout)
+    def __init__(self, game_state, stdin=None, stdout=None, engine=None,
+                 instrumentation=None, saver=None, viewer=None):
+        # pylint: disable=too-many-arguments
+        super().__init__(stdin=stdin, stdout=stdout,
+                         instrumentation=instrumentation)
         self.game_state = game_state
-        self.current_player = game_state.current_player
-        self.unit_count = game_state.unit_count
+        self.saver = saver
+        # Player whose view is shown (current one in hot-seat games)
+        self.viewer = viewer
+        self.engine = engine if engine is not None else Engine(game_state)
+        self.renderers = {}
+        self.ai_player = AIPlayer()
         self.prompt = "Game[{}]> ".format(self.current_player)
-        self.action_queue = deque()
+
+    @property
+    def current_player(self):
+        # pylint: disable=missing-docstring
+        return self.game_state.current_player
+
+    @property
+    def viewing_player(self):
+        """Player whose units decide what `show` and `inspect` reveal"""
+        if self.viewer is not None:
+            return self.viewer
+        return self.current_player
+
+    @property
+    def action_queue(self):
+        # pylint: disable=missing-docstring
+        return self.engine.action_queue
+
+    @property
+    def unit_count(self):
+        # pylint: disable=missing-docstring
+        return self.game_state.unit_count
+
+    def _visibility(self):
+        """Get (and create once) fog of war of the game"""
+        if self.visibility is None:
+            self.visibility = Visibility(self.game_state)
+        return self.visibility
+
+    def _hidden(self, x, y):
+        """Whether cell is covered by fog for viewing player"""
+        # pylint: disable=invalid-name
+        if not self.fog:
+            return False
+        player = self.viewing_player
+        color = self.game_state.list_of_player_infos[player].color
+        return not self._visibility().visible(color, x, y)
+
+    def _renderer(self):
+        """Get (and create once) renderer for viewing player"""
+        player = self.viewing_player
+        if player not in self.renderers:
+            self.renderers[player] = Renderer(
+                self.game_state, player,
+                visibility=self._visibility() if self.fog else None)
+        return self.renderers[player]
+
+    def _submit(self, order):
+        """Pass order to the engine and report if it's rejected"""
+        try:
+            self.engine.submit(order)
+        except OrderError as err:
+            self.stdout.write("{}\n".format(err))
 
     @staticmethod
     def _get_ints(string, count):
@@ -74,7 +142,8 @@ Return to the menu (use "abort" to exit game forcefully)"""
 
     def do_show(self, arg):
         """Usage: show <x1> <y1> <x2> <y2>
-Show part of field as textual axis-aligned rectangle"""
+Show part of field as textual axis-aligned rectangle
+(cells which your units don't see are shown as "?", see "fog")"""
         arg = self._get_ints(arg, 4)
         if not arg or arg[-1] is None:
             self.stdout.write("""\
@@ -98,27 +167,13 @@ Please specify four integers as rectangle coordinates.\n""")
             )
             return
 
-        for line in self.game_state.game_field[arg[1]:arg[3] + 1]:
-            str_list = []
-            for cell in line[arg[0]:arg[2] + 1]:
-                if not cell:
-                    str_list.append('_')
-                elif len(cell) > 1:
-                    str_list.append('M')
-                elif self.game_state.unit_dict[cell[0]].color == \
-                    self.game_state\
-                    .list_of_player_infos[self.current_player]\
-                        .color:
-                    str_list.append(self.game_state.unit_dict[cell[0]]
-                                    .char.upper())
-                else:
-                    str_list.append(self.game_state.unit_dict[cell[0]]
-                                    .char.lower())
-            self.stdout.write(' '.join(str_list) + '\n')
+        arg[2] = min(arg[2], self.game_state.width - 1)
+        arg[3] = min(arg[3], self.game_state.height - 1)
+        self.stdout.write(self._renderer().viewport(*arg))
 
     def do_inspect(self, arg):
         """Usage: inspect <x> <y>
-Show info about unit(s) in specified cell."""
+Show info about unit(s) in specified cell (if your units see it)."""
         arg = self._get_ints(arg, 2)
         if not arg or arg[-1] is None:
             self.stdout.write(
@@ -133,8 +188,12 @@ Show info about unit(s) in specified cell."""
             )
             return
 
-        if self.game_state.game_field[arg[1]][arg[0]]:
-            for unit_id in self.game_state.game_field[arg[1]][arg[0]]:
+        if self._hidden(arg[0], arg[1]):
+            self.stdout.write("Your units don't see this cell.\n")
+            return
+        cell = self.game_state.grid.units_at(arg[0], arg[1])
+        if cell:
+            for unit_id in cell:
                 self.stdout.write("Unit {} - ".format(unit_id)
                                   + str(self.game_state.unit_dict[unit_id])
                                   + '\n')
@@ -159,19 +218,18 @@ Please specify two or three integers as cell coordinates and index.\n""")
             )
             return
 
-        if not self.game_state.game_field[arg[1]][arg[0]]:
+        cell = self.game_state.grid.units_at(arg[0], arg[1])
+        if not cell:
             self.stdout.write("Nothing to select.\n")
             return
         arg[2] = arg[2] if arg[2] else 0
-        if arg[2] not in range(len(
-                self.game_state.game_field[arg[1]][arg[0]])):
+        if arg[2] not in range(len(cell)):
             self.stdout.write(
-                "Index should lie in range [0, {}).\n".format(
-                    len(self.game_state.game_field[arg[1]][arg[0]]))
+                "Index should lie in range [0, {}).\n".format(len(cell))
             )
             return
 
-        unit_id = self.game_state.game_field[arg[1]][arg[0]][arg[2]]
+        unit_id = cell[arg[2]]
         if self.game_state.unit_dict[unit_id].color != \
                 self.game_state\
                 .list_of_player_infos[self.current_player].color:
@@ -190,22 +248,86 @@ Deselect currently selected unit"""
         self.selected_unit_id = None
         self.prompt = "Game[{}]> ".format(self.current_player)
 
+    def do_fog(self, arg):
+        """Usage: fog [on|off]
+Hide cells which your units don't see in "show"
+and "inspect" (on by default).  Without argument, show current mode."""
+        arg = arg.split()
+        if not arg:
+            self.stdout.write("Fog of war is {}.\n".format(
+                "on" if self.fog else "off"))
+            return
+        if arg[0] not in ("on", "off"):
+            self.stdout.write("Please specify \"on\" or \"off\".\n")
+            return
+        self.fog = arg[0] == "on"
+        for renderer in self.renderers.values():
+            renderer.visibility = self._visibility() if self.fog else None
+            if self.fog:
+                self.visibility.add_listener(renderer)
+            renderer.reset()
+
     def do_status(self, arg):
-        """Usage: status
-List all planned actions"""
-        # pylint: disable=unused-argument
-        for action in self.action_queue:
+        """Usage: status [unit_id]
+List all planned actions (or only actions of one unit)"""
+        unit_id = None
+        if arg:
+            arg = self._get_ints(arg, 1)
+            if not arg:
+                self.stdout.write("Please specify unit ID.\n")
+                return
+            unit_id = arg[0]
+        if unit_id is None:
+            actions = self.action_queue
+        else:
+            actions = self.action_queue.orders_of(unit_id)
+        for action in actions:
             self.stdout.write(str(action) + '\n')
+        color = self.engine.player_color()
+        for unit_id, goal in sorted(self.engine.destinations.items()):
+            if arg and unit_id != arg[0]:
+                continue
+            if self.game_state.unit_dict[unit_id].color == color:
+                self.stdout.write("Unit {}: Go to ({}, {})\n".format(
+                    unit_id, goal[0], goal[1]))
+        if not arg:
+            descriptions = {"move": "Move by ({}, {})",
+                            "area": "Attack area around ({}, {})"}
+            for (squad_id, name), target in sorted(
+                    self.engine.squad_orders.items()):
+                self.stdout.write("Squad {}: {}\n".format(
+                    squad_id, descriptions[name].format(*target)))
 
     def do_undo(self, arg):
         """Usage: undo
 Cancel last planned action"""
         # pylint: disable=unused-argument
         try:
-            self.action_queue.pop()
+            self.engine.undo()
         except IndexError:
             self.stdout.write("Nothing to cancel.\n")
 
+    def do_cancel(self, arg):
+        """Usage: cancel [unit_id]
+Cancel all planned actions of unit (selected one by default)"""
+        if arg:
+            arg = self._get_ints(arg, 1)
+            if not arg:
+                self.stdout.write("Please specify unit ID.\n")
+                return
+            unit_id = arg[0]
+        else:
+            unit_id = self.selected_unit_id
+        if unit_id is None:
+            self.stdout.write("Please select unit or specify its ID.\n")
+            return
+        if unit_id not in self.game_state.unit_dict or \
+                self.engine.owner(unit_id) != self.current_player:
+            self.stdout.write("Please select YOUR unit.\n")
+            return
+        count = self.engine.cancel(unit_id)
+        self.stdout.write("Cancelled {} action(s).\n".format(count))
+
     def do_spawn(self, arg):
         """Usage: spawn <name>
 Create unit with a given name.
@@ -216,13 +338,7 @@ List of allowed names: infantry, vehicle"""
         if not arg:
             self.stdout.write("Please specify a unit name.\n")
             return
-        arg = arg.split()[0]
-        if not self.selected_unit.can_create(arg):
-            self.stdout.write("Error: invalid unit name \
-(see help for allowed names)\n")
-            return
-        self.action_queue.append(Action(
-            "spawn", self.selected_unit_id, {"class": arg}))
+        self._submit(SpawnOrder(self.selected_unit_id, arg.split()[0]))
 
     def do_move(self, arg):
         """Usage: move <dx> <dy>
@@ -236,110 +352,171 @@ Move selected unit on vector (dx, dy)
             self.stdout.write(
                 "Please specify two integers as cell coordinates.\n")
             return
-        index = self._validate_ints(arg, (2, 2,), (-1, -1,))
-        if index < 2:
-            self.stdout.write(
-                "{} should lie in range [-1, 1].\n".format(("dx", "dy")[index])
-            )
+        self._submit(MoveOrder(self.selected_unit_id, arg[0], arg[1]))
+
+    def do_goto(self, arg):
+        """Usage: goto <x> <y>
+Move selected unit to cell (x, y), one step per turn
+(the order stays until the unit arrives or can't go further)"""
+        if not isinstance(self.selected_unit, units_abc.MovableUnit):
+            self.stdout.write("Please select infantry of vehicle unit.\n")
             return
-        bounds = (self.game_state.width, self.game_state.height,)
-        index = self._validate_ints(
-            self.selected_unit.position + units_abc.Vector(*arg), bounds)
-        if index < 2:
+        arg = self._get_ints(arg, 2)
+        if not arg or arg[-1] is None:
             self.stdout.write(
-                "New {} coordinate should lie in range [0, {}).\n".format(
-                    ("horizontal", "vertical")[index], bounds[index])
-            )
+                "Please specify two integers as cell coordinates.\n")
             return
-        self.action_queue.append(Action(
-            "move", self.selected_unit_id, {"delta": units_abc.Vector(*arg)}))
+        self._submit(GotoOrder(self.selected_unit_id, arg[0], arg[1]))
 
     def do_attack(self, arg):
-        """Usage: attack <target_id>
-Attack selected unit if it is located in adjacent cell"""
+        """Usage: attack <target_id> | attack <x> <y>
+Attack unit if it is located in adjacent cell, or attack area around
+the cell (at most 3 cells away): all units near it, including yours,
+take damage which falls with distance from the cell"""
         if not isinstance(self.selected_unit, units_abc.BattleUnit):
             self.stdout.write("Please select infantry of vehicle unit.\n")
             return
+        if len(arg.split()) == 2:
+            arg = self._get_ints(arg, 2)
+            if not arg or arg[-1] is None:
+                self.stdout.write("Please specify two integers "
+                                  "as cell coordinates.\n")
+                return
+            self._submit(AreaOrder(self.selected_unit_id, arg[0], arg[1]))
+            return
         arg = self._get_ints(arg, 1)
         if not arg or arg[0] is None:
             self.stdout.write("Please specify unit ID.\n")
             return
-        arg = arg[0]
-        if arg not in self.game_state.unit_dict:
-            self.stdout.write("Please specify ID of an existing unit.\n")
+        self._submit(AttackOrder(self.selected_unit_id, arg[0]))
+
+    def do_squad(self, arg):
+        """Usage: squad new <x1> <y1> <x2> <y2> | squad disband <id>
+       squad list | squad move <id> <dx> <dy>
+       squad attack <id> <x> <y> | squad goto <id> <x> <y>
+       squad cancel <id>
+Form squad of your infantry and vehicles in rectangle (they leave
+their old squads) or disband it.  Orders to squad are given to all
+its members keeping the formation: member targets the cell shifted
+by its offset from the center of the squad.  Members which have
+orders of their own keep them."""
+        # pylint: disable=too-many-return-statements
+        args = arg.split()
+        command, args = (args[0], args[1:]) if args else (None, [])
+        arity = {"new": 4, "disband": 1, "list": 0, "move": 3,
+                 "attack": 3, "goto": 3, "cancel": 1}
+        if command not in arity:
+            self.stdout.write("Please specify one of subcommands: {}.\n"
+                              .format(", ".join(arity)))
             return
-        if not isinstance(self.game_state.unit_dict[arg],
-                          units_abc.BattleUnit):
-            self.stdout.write("Target must be infantry or vehicle unit.\n")
+        ints = self._get_ints(" ".join(args), arity[command]) or []
+        if len(args) != arity[command] or None in ints:
+            self.stdout.write(
+                "Please specify {} integers.\n".format(arity[command]))
             return
-        target_pos = self.game_state.unit_dict[arg].position
-        if max(map(abs, target_pos - self.selected_unit.position)) > 1:
-            self.stdout.write("Target must be located in adjacent cell.\n")
+        squads = self.engine.squads
+        if command == "list":
+            for squad_id in squads.squads_of(self.engine.player_color()):
+                self.stdout.write("Squad {}: {} unit(s)\n".format(
+                    squad_id, len(squads.members(squad_id))))
             return
-        self.action_queue.append(Action(
-            "attack", self.selected_unit_id, {"target_id": arg}))
+        if command == "new":
+            color = self.engine.player_color()
+            unit_dict = self.game_state.unit_dict
+            rect = (min(ints[0], ints[2]), min(ints[1], ints[3]),
+                    max(ints[0], ints[2]), max(ints[1], ints[3]))
+            unit_ids = [
+                unit_id
+                for _, _, ids in self.game_state.grid.cells_in_rect(*rect)
+                for unit_id in ids
+                if unit_dict[unit_id].color == color and
+                isinstance(unit_dict[unit_id], units_abc.MovableUnit)]
+            try:
+                squad_id = self.engine.create_squad(unit_ids)
+            except OrderError as err:
+                self.stdout.write("{}\n".format(err))
+                return
+            self.stdout.write("Squad {}: {} unit(s)\n".format(
+                squad_id, len(unit_ids)))
+            return
+        try:
+            if command == "disband":
+                count = self.engine.disband_squad(ints[0])
+                self.stdout.write("Disbanded {} unit(s).\n".format(count))
+            elif command == "cancel":
+                count = self.engine.cancel_squad(ints[0])
+                self.stdout.write("Cancelled {} order(s).\n".format(count))
+            else:
+                order_class = {"move": SquadMoveOrder,
+                               "attack": SquadAreaOrder,
+                               "goto": SquadGotoOrder}[command]
+                self.engine.submit(order_class(*ints))
+        except OrderError as err:
+            self.stdout.write("{}\n".format(err))
+
+    def _commit(self):
+        """
+        Commit turn, update counters of instrumentation
+        and let saver start autosave
+        """
+        if not self.instrumentation.enabled:
+            result = self.engine.commit()
+        else:
+            actions = list(self.action_queue)
+            with self.instrumentation.timer("engine.commit"):
+                result = self.engine.commit()
+            self.instrumentation.count_commit(actions, result)
+        if self.saver is not None:
+            self.saver.committed(self.game_state)
+        return result
+
+    def postcmd(self, stop, line):
+        if self.saver is not None:
+            self.saver.poll()
+        return super().postcmd(stop, line)
+
+    def preloop(self):
+        self._play_ai_turns()
+
+    def _play_ai_turns(self):
+        """Let computer play until it's turn of a human (one round at most)"""
+        for _ in self.game_state.list_of_player_infos:
+            if not is_ai(self.game_state, self.current_player):
+                break
+            player = self.current_player
+            count = self.ai_player.play_turn(self.engine)
+            self._commit()
+            self.stdout.write(
+                "Player {} (AI) made {} actions.\n".format(player, count))
+        self.do_deselect(None)
+
+    def do_ai(self, arg):
+        """Usage: ai <player> [on|off]
+Show or change whether player is controlled by computer
+(computer moves right after the previous player commits)"""
+        args = arg.split()
+        players = len(self.game_state.list_of_player_infos)
+        try:
+            player = int(args[0])
+        except (IndexError, ValueError):
+            self.stdout.write("Please specify index of player.\n")
+            return
+        if player not in range(players):
+            self.stdout.write(
+                "Index should lie in range [0, {}).\n".format(players))
+            return
+        if len(args) > 1:
+            if args[1] not in ("on", "off"):
+                self.stdout.write("Please specify \"on\" or \"off\".\n")
+                return
+            set_ai(self.game_state, player, args[1] == "on")
+        self.stdout.write("Player {}: {}\n".format(
+            player, "AI" if is_ai(self.game_state, player) else "human"))
 
     def do_commit(self, arg):
         """Apply all planned actions"""
         # pylint: disable=unused-argument
-        for action in self.action_queue:
-            if action.name == "spawn":
-                hq = self.game_state.unit_dict[action.unit_id]
-                possible_pos = []
-                for dy in range(-1, 2):
-                    for dx in range(-1, 2):
-                        if (dy != 0 or dx != 0)\
-                                and hq.position.x + dx\
-                                in range(0, self.game_state.width)\
-                                and hq.position.y + dy\
-                                in range(0, self.game_state.height):
-                            possible_pos.append(
-                                (hq.position.x + dx,
-                                 hq.position.y + dy,))
-                selected_pos = random.choice(possible_pos)
-
-                new_unit = hq.create_unit(action.params["class"], selected_pos)
-
-                self.game_state.game_field[selected_pos[1]][selected_pos[0]]\
-                    .append(self.unit_count)
-                self.game_state.unit_dict[self.unit_count] = new_unit
-                self.unit_count += 1
-                self.game_state.unit_count = self.unit_count
-            elif action.name == "move":
-                old_pos = self.game_state.unit_dict[action.unit_id].position
-                new_pos = old_pos + action.params["delta"]
-                self.game_state.unit_dict[action.unit_id].position = new_pos
-                self.game_state.game_field[old_pos[1]][old_pos[0]].remove(
-                    action.unit_id)
-                self.game_state.game_field[new_pos[1]][new_pos[0]].append(
-                    action.unit_id)
-            elif action.name == "attack":
-                if action.params["target_id"] not in self.game_state.unit_dict:
-                    continue
-                target = self.game_state.unit_dict[action.params["target_id"]]
-                self.game_state.unit_dict[action.unit_id].attack(target)
-                if target.health <= 0:
-                    self.game_state.game_field[target.position[1]]\
-                        [target.position[0]].remove(action.params["target_id"])
-                    del self.game_state.unit_dict[action.params["target_id"]]
-
-        self.action_queue.clear()
-        self.current_player += 1
-        if self.current_player == len(
-                self.game_state.list_of_player_infos):
-            self.current_player = 0
-        self.game_state.current_player = self.current_player
+        self._commit()
         self.do_deselect(None)
+        self._play_ai_turns()
 
-
-class Action(namedtuple("ActionTuple", ["name", "unit_id", "params"])):
-    """Small class fot storing player's actions"""
-
-    def __str__(self):
-        if self.name == "spawn":
-            return "Unit {}: Create unit of class \"{}\"".format(
-                self.unit_id, self.params["class"])
-        if self.name == "attack":
-            return "Unit {}: Attack unit {}".format(
-                self.unit_id, self.params["target_id"])
-        return ""
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""This module contains base class of shells, `InstrumentedShell`"""
+import cmd
+import shlex
+
+from ..instrument import Instrumentation
+
+
+class InstrumentedShell(cmd.Cmd):
+    """Shell which can time its commands (see `stats` command)"""
+    instrumentation = None
+
+    def __init__(self, stdin=None, stdout=None, instrumentation=None):
+        super().__init__(stdin=stdin, stdout=stdout)
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation
+
+    def precmd(self, line):
+        if self.instrumentation.enabled:
+            self.instrumentation.begin(self.parseline(line)[0] or "")
+        return line
+
+    def postcmd(self, stop, line):
+        if self.instrumentation.enabled:
+            self.instrumentation.end(self.parseline(line)[0] or "")
+        return stop
+
+    def do_stats(self, arg):
+        """Usage: stats [on|off|reset|export <file>]
+       stats profile <command>|off
+Show latencies of commands and counters of commits,
+switch collecting them, write them to JSON file
+or run every next call of the command under profiler"""
+        args = shlex.split(arg)
+        instrumentation = self.instrumentation
+        if not args:
+            self.stdout.write("Statistics are {}.\n".format(
+                "on" if instrumentation.enabled else "off"))
+            self.stdout.write(instrumentation.report())
+            for command, text in sorted(instrumentation.profiles.items()):
+                self.stdout.write("Profile of \"{}\":\n{}".format(
+                    command, text))
+        elif args[0] in ("on", "off"):
+            instrumentation.enabled = args[0] == "on"
+        elif args[0] == "reset":
+            instrumentation.reset()
+        elif args[0] == "export" and len(args) > 1:
+            try:
+                instrumentation.export(args[1])
+            except OSError as err:
+                self.stdout.write("System error: {}\n".format(err))
+        elif args[0] == "profile" and len(args) > 1:
+            instrumentation.profile_command = \
+                None if args[1] == "off" else args[1]
+        else:
+            self.stdout.write("Unknown arguments (see \"help stats\").\n")
@@ -1,16 +1,23 @@
 # -*- coding: utf-8 -*-
 """This module contains the only class, `MenuShell`"""
-import cmd
 import errno
+import getopt
 import os
 from pathlib import Path
 import shlex
+import sqlite3
+import time
 
 from .game import GameShell
+from .instrumented import InstrumentedShell
+from .. import binfmt
+from ..catalog import Catalog, SORT_KEYS, SUFFIXES
+from ..journal import Journal, JournalError, journal_path
+from ..saving import BackgroundSaver
 from ..state import FIELD_WIDTH, FIELD_HEIGHT, GameState
 
 
-class MenuShell(cmd.Cmd):
+class MenuShell(InstrumentedShell):
     """Class for handling menu commands"""
     intro = "Welcome to the game! Please create new save file \
 or load an existing one."
@@ -18,35 +25,143 @@ or load an existing one."
 
     game_state = None
     last_savefile = ""
+    journal_mode = False
+    _catalog = None
+    _saver = None
+
+    @property
+    def catalog(self):
+        """Index of saves (opened on first use)"""
+        if self._catalog is None:
+            self._catalog = Catalog("saves")
+        return self._catalog
+
+    @property
+    def saver(self):
+        """`BackgroundSaver` of JSON saves (created on first use)"""
+        if self._saver is None:
+            self._saver = BackgroundSaver()
+            self._saver.listeners.append(self._saved)
+        return self._saver
+
+    def _catalog_update(self, path, game_state=None):
+        """Record save file just written or loaded"""
+        try:
+            self.catalog.update(path, game_state or self.game_state)
+        except (OSError, sqlite3.Error) as err:
+            self.stdout.write("Catalog error: {}\n".format(err))
+
+    def _saved(self, snapshot, path, error):
+        """Report save finished in background"""
+        if error is not None:
+            self.stdout.write("Saving {} failed: {}\n".format(path, error))
+        else:
+            self._catalog_update(path, snapshot)
+
+    def postcmd(self, stop, line):
+        if self._saver is not None:
+            self._saver.poll()
+        return super().postcmd(stop, line)
 
     @staticmethod
-    def do_exit(arg):
+    def _save_path(name):
+        """
+        Get path of save file with given name (JSON file unless name
+        has suffix of binary format or of compressed JSON)
+        """
+        if Path(name).suffix in SUFFIXES:
+            return "saves/{}".format(name)
+        return "saves/{}.json".format(name)
+
+    def _set_savefile(self, path):
+        """Remember save file of current game (and target of autosave)"""
+        self.last_savefile = path
+        self.saver.filename = \
+            None if path.endswith(binfmt.SUFFIX) else path
+
+    def do_exit(self, arg):
         """Usage: exit
-Exit game without save (use "save" to explicitly save progress)"""
+Exit game without save (use "save" to explicitly save progress;
+saves which are still being written are finished first)"""
         # pylint: disable=unused-argument
+        self.saver.wait()
         return True
 
-    @staticmethod
-    def do_EOF(arg):
+    def do_EOF(self, arg):
         """Usage: EOF
-Exit game without save (use "save" to explicitly save progress)"""
+Exit game without save (use "save" to explicitly save progress;
+saves which are still being written are finished first)"""
         # pylint: disable=invalid-name,unused-argument
+        self.saver.wait()
         return True
 
     def do_ls(self, arg):
-        """Usage: ls
-List all saved games"""
-        # pylint: disable=unused-argument
-        for file in Path("saves").iterdir():
-            self.stdout.write(file.stem + '\n')
+        """Usage: ls [-l] [-r] [-s <column>] [-p <players>] [-f json|bin]
+          [-u] [pattern]
+List saved games from the catalog (binary saves are listed with suffix).
+-l shows players, units, current player, size and time of modification,
+-s sorts by column (name, players, units, player, size, mtime, ...),
+-r reverses order, -p and -f select saves by number of players and format,
+pattern is a glob of names and -u rebuilds catalog from the directory"""
+        try:
+            opts, args = getopt.getopt(shlex.split(arg), "lrs:p:f:u")
+        except getopt.GetoptError as err:
+            self.stdout.write("Error: {}\n".format(err))
+            return
+        opts = dict(opts)
+        filters = {}
+        if args:
+            filters["pattern"] = args[0]
+        if "-f" in opts:
+            filters["format"] = opts["-f"]
+        if "-p" in opts:
+            try:
+                filters["players"] = int(opts["-p"])
+            except ValueError:
+                self.stdout.write("Please specify number of players.\n")
+                return
+        sort = opts.get("-s", "name")
+        if sort not in SORT_KEYS:
+            self.stdout.write("Unknown column: {}\n".format(sort))
+            return
+        try:
+            if "-u" in opts:
+                self.catalog.rescan()
+            entries = self.catalog.entries(sort, "-r" in opts, **filters)
+        except (OSError, sqlite3.Error) as err:
+            self.stdout.write("Catalog error: {}\n".format(err))
+            return
+        for entry in entries:
+            if "-l" in opts:
+                self.stdout.write(
+                    "{:<24}{:>5} players{:>8} units  player {:<3}"
+                    "{:>10} B  {}\n".format(
+                        entry.name, entry.players, entry.units, entry.player,
+                        entry.size, time.strftime(
+                            "%Y-%m-%d %H:%M", time.localtime(entry.mtime))))
+            else:
+                self.stdout.write(entry.name + '\n')
 
     def do_touch(self, arg):
-        """Usage: touch <filename>
-Create new save file in directory \"saves\""""
+        """Usage: touch <filename> [<width> <height>]
+Create new save file in directory \"saves\"
+(use suffix ".bin" for compact binary format;
+very large fields are stored sparsely)"""
         if not arg:
             self.stdout.write("Please specify name of save file.\n")
             return
-        arg = "saves/{}.json".format(shlex.split(arg)[0])
+        args = shlex.split(arg)
+        size = (FIELD_WIDTH, FIELD_HEIGHT)
+        if len(args) > 1:
+            try:
+                size = (int(args[1]), int(args[2]))
+            except (IndexError, ValueError):
+                self.stdout.write("Please specify width and height.\n")
+                return
+            if min(size) < 2:
+                self.stdout.write("Field should be at least 2x2.\n")
+                return
+        arg = self._save_path(args[0])
 
         saves_path = Path("saves")
         if not saves_path.exists():
@@ -62,14 +177,17 @@ Create new save file in directory \"saves\""""
             self.stdout.write("Error: {}\n".format(os.strerror(errno.EEXIST)))
             return
 
-        self.game_state = GameState(2, FIELD_WIDTH, FIELD_HEIGHT)
+        self.game_state = GameState(2, *size)
         try:
-            self.game_state.save(arg)
+            with self.instrumentation.timer("io.save"):
+                self.game_state.save(arg)
         except OSError as err:
             self.stdout.write("System error: {}\n".format(err))
             self.game_state = None
             return
-        self.last_savefile = arg
+        self._catalog_update(arg)
+        self._set_savefile(arg)
+        self._attach_journal()
 
     def do_load(self, arg):
         """Usage: load <filename>
@@ -78,30 +196,118 @@ Load existing save file"""
             self.stdout.write("Please specify name of save file.\n")
             return
 
-        arg = "saves/{}.json".format(shlex.split(arg)[0])
-        if not Path(arg).exists():
+        arg = self._save_path(shlex.split(arg)[0])
+        # The file may be being written
+        self.saver.wait()
+        try:
+            # Only metadata of the file is checked here
+            known = self.catalog.validate(arg)
+        except (OSError, sqlite3.Error):
+            known = False
+        if not known and not Path(arg).exists():
             self.stdout.write("Error: {}\n".format(os.strerror(errno.ENOENT)))
             return
 
         if not self.game_state:
             self.game_state = GameState(1, 1, 1)
-        self.game_state.load(arg)
-        self.last_savefile = arg
+        try:
+            with self.instrumentation.timer("io.load"):
+                self.game_state.load(arg)
+        except (binfmt.FormatError, JournalError) as err:
+            self.stdout.write("Error: {}\n".format(err))
+            return
+        if not known:
+            # New file or one changed outside of the game
+            self._catalog_update(arg)
+        self._set_savefile(arg)
+        self._attach_journal()
 
     def do_save(self, arg):
         """Usage: save [filename]
 Save game to the specified file
-(defaults to the file from which it was loaded)"""
+(defaults to the file from which it was loaded).
+JSON saves are written in background (compressed if name
+ends with ".gz" or ".xz"), binary ones right away."""
         arg = shlex.split(arg)
         if not arg:
             arg = self.last_savefile
         else:
-            arg = "saves/{}.json".format(arg[0])
+            arg = self._save_path(arg[0])
+        if self.game_state.journal is not None \
+                and self.game_state.journal.save_file == arg:
+            # All committed turns are already in the journal (which
+            # may have been folded into the save file meanwhile)
+            self._catalog_update(arg)
+            return
+        if not arg.endswith(binfmt.SUFFIX):
+            with self.instrumentation.timer("io.save"):
+                self.saver.save(self.game_state, arg)
+            return
         try:
-            self.game_state.save(arg)
+            with self.instrumentation.timer("io.save"):
+                self.game_state.save(arg)
         except OSError as err:
             self.stdout.write("System error: {}\n".format(err))
             return
+        self._catalog_update(arg)
+
+    def do_autosave(self, arg):
+        """Usage: autosave [<commits>|off]
+Save game in background every given number of commits
+(to the file from which it was loaded, unless it's binary
+or journal is on).  Without argument, show current setting."""
+        arg = shlex.split(arg)
+        if not arg:
+            interval = self.saver.interval
+            self.stdout.write("Autosave is {}.\n".format(
+                "every {} commits".format(interval) if interval else "off"))
+            return
+        if arg[0] == "off":
+            self.saver.interval = 0
+            return
+        try:
+            interval = int(arg[0])
+        except ValueError:
+            interval = 0
+        if interval < 1:
+            self.stdout.write("Please specify number of commits.\n")
+            return
+        self.saver.interval = interval
+
+    def _attach_journal(self):
+        """Log turns of current game next to the last save file"""
+        if self.journal_mode \
+                or Path(journal_path(self.last_savefile)).exists():
+            self.journal_mode = True
+            self.game_state.journal = Journal(self.last_savefile)
+        else:
+            self.game_state.journal = None
+
+    def do_journal(self, arg):
+        """Usage: journal [on|off]
+Log every commit next to the save file instead of saving whole game
+("save" then only folds the log into the save file when it gets long).
+Without argument, show current mode."""
+        arg = shlex.split(arg)
+        if not arg:
+            self.stdout.write("Journal is {}.\n".format(
+                "on" if self.journal_mode else "off"))
+            return
+        if arg[0] not in ("on", "off"):
+            self.stdout.write("Please specify \"on\" or \"off\".\n")
+            return
+        if arg[0] == "off" and self.game_state is not None \
+                and self.game_state.journal is not None:
+            self.saver.wait()
+            try:
+                self.game_state.journal.compact(self.game_state)
+            except OSError as err:
+                self.stdout.write("System error: {}\n".format(err))
+                return
+            self._catalog_update(self.game_state.journal.save_file)
+        self.journal_mode = arg[0] == "on"
+        if self.game_state is not None and self.last_savefile:
+            self._attach_journal()
 
     def do_rm(self, arg):
         """Usage: rm <filename>
@@ -110,13 +316,20 @@ Remove specified save file"""
             self.stdout.write("Please specify name of save file.\n")
             return
 
-        arg = "saves/{}.json".format(shlex.split(arg)[0])
+        arg = self._save_path(shlex.split(arg)[0])
+        self.saver.wait()
         try:
             Path(arg).unlink()
+            Journal(arg).discard()
         except FileNotFoundError:
             self.stdout.write("There is no such save file.\n")
         except OSError as err:
             self.stdout.write("System error: {}\n".format(err))
+            return
+        try:
+            self.catalog.remove(arg)
+        except (OSError, sqlite3.Error) as err:
+            self.stdout.write("Catalog error: {}\n".format(err))
 
     def do_start(self, arg):
         """Usage: start
@@ -125,4 +338,5 @@ Start game"""
         if self.game_state is None:
             self.stdout.write("Please create or load save file to start.\n")
             return
-        GameShell(self.game_state).cmdloop()
+        GameShell(self.game_state, instrumentation=self.instrumentation,
+                  saver=self.saver).cmdloop()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Batch runs of headless games in a pool of processes"""
+from collections import namedtuple
+from multiprocessing import Pool
+import random
+
+from . import units
+from .ai import AIPlayer
+from .engine import AttackOrder, Engine, MoveOrder, OrderError, SpawnOrder
+from .state import GameState
+from .units import abc
+
+
+GameResult = namedtuple(
+    "GameResult",
+    [
+        "seed",
+        "turns",
+        "winner",
+        "scores",
+    ]
+)
+
+GameSettings = namedtuple(
+    "GameSettings",
+    [
+        "player_count",
+        "width",
+        "height",
+        "max_turns",
+    ]
+)
+
+DEFAULT_SETTINGS = GameSettings(2, 20, 20, 100)
+
+
+def random_policy(engine, rng):
+    """
+    Submit orders for all units of the current player:
+    HQs spawn sometimes, units attack an adjacent enemy or step randomly
+    """
+    game_state = engine.game_state
+    color = engine.player_color()
+    for unit_id in engine.units_of(engine.current_player):
+        unit = game_state.unit_dict[unit_id]
+        try:
+            if isinstance(unit, units.Headquarters):
+                if rng.random() < 0.5:
+                    engine.submit(SpawnOrder(
+                        unit_id, rng.choice(("infantry", "vehicle"))))
+                continue
+            targets = [
+                target_id for target_id in game_state.grid.units_within(
+                    unit.position[0], unit.position[1], 1)
+                if game_state.unit_dict[target_id].color != color
+                and isinstance(game_state.unit_dict[target_id],
+                               abc.BattleUnit)]
+            if targets:
+                engine.submit(AttackOrder(unit_id, rng.choice(targets)))
+            else:
+                engine.submit(MoveOrder(
+                    unit_id, rng.randint(-1, 1), rng.randint(-1, 1)))
+        except OrderError:
+            pass
+
+
+def ai_policy(engine, rng):
+    """Submit orders chosen by `AIPlayer` (it doesn't use `rng`)"""
+    # pylint: disable=unused-argument
+    AIPlayer(budget=1.0).play_turn(engine)
+
+
+def play_game(seed, settings=DEFAULT_SETTINGS, policy=random_policy):
+    """Play one game with given seed and return `GameResult`"""
+    # The game and the policy use separate streams of random numbers
+    rng = random.Random(seed)
+    game_state = GameState(
+        settings.player_count, settings.width, settings.height, seed=seed)
+    engine = Engine(game_state)
+    turns = settings.max_turns * len(game_state.list_of_player_infos)
+    for _ in range(turns):
+        policy(engine, rng)
+        engine.commit()
+    scores = engine.scores()
+    best = max(scores)
+    winner = scores.index(best) if scores.count(best) == 1 else None
+    return GameResult(seed, settings.max_turns, winner, scores)
+
+
+def _play_game(args):
+    return play_game(*args)
+
+
+def run_games(seeds, settings=DEFAULT_SETTINGS, policy=random_policy,
+              processes=None, chunksize=1):
+    """
+    Play one game per seed in a pool of processes
+    and return list of `GameResult` in order of seeds
+
+    `policy` must be a module-level function (it's sent to workers).
+    """
+    # pylint: disable=too-many-arguments
+    tasks = [(seed, settings, policy) for seed in seeds]
+    if processes == 1:
+        return [_play_game(task) for task in tasks]
+    with Pool(processes) as pool:
+        return pool.map(_play_game, tasks, chunksize)
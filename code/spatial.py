@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Flat occupancy grid with range queries"""
+from array import array
+
+
+class GridBase:
+    """
+    Queries shared by grids
+
+    Subclasses implement `add`, `remove`, `count_at`, `units_at`
+    and `cells_in_rect` (which yields occupied cells row by row).
+    """
+    width = 0
+    height = 0
+
+    def to_nested(self):
+        """Get list of rows of lists of unit IDs"""
+        field = [[[] for _ in range(self.width)] for _ in range(self.height)]
+        for x, y, ids in self.occupied_cells():
+            field[y][x] = ids
+        return field
+
+    def occupied_cells(self):
+        """Iterate over `(x, y, ids)` of all occupied cells"""
+        return self.cells_in_rect(0, 0, self.width - 1, self.height - 1)
+
+    def move(self, unit_id, old_pos, new_pos):
+        """Move unit between cells"""
+        self.remove(unit_id, old_pos[0], old_pos[1])
+        self.add(unit_id, new_pos[0], new_pos[1])
+
+    def units_in_rect(self, x1, y1, x2, y2):
+        """List of IDs of units in rectangle (bounds are inclusive)"""
+        result = []
+        for _, _, ids in self.cells_in_rect(x1, y1, x2, y2):
+            result.extend(ids)
+        return result
+
+    def units_within(self, x, y, radius):
+        """List of IDs of units within Chebyshev distance `radius`"""
+        # pylint: disable=invalid-name
+        return self.units_in_rect(x - radius, y - radius,
+                                  x + radius, y + radius)
+
+    def neighbour_cells(self, x, y):
+        """List of cells adjacent to `(x, y)` which lie on the field"""
+        # pylint: disable=invalid-name
+        return [(x + dx, y + dy)
+                for dy in range(-1, 2) for dx in range(-1, 2)
+                if (dx or dy) and 0 <= x + dx < self.width
+                and 0 <= y + dy < self.height]
+
+
+class SpatialIndex(GridBase):
+    """
+    Occupancy of the game field
+
+    Every cell keeps number of units and ID of the first one in flat
+    arrays; IDs of other units in stacked cells are kept in overflow
+    buckets.  Rows without units are skipped by range queries.
+    """
+    count = None
+    first = None
+    row_count = None
+    overflow = None
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.count = array('i', bytes(4 * width * height))
+        self.first = array('i', [-1]) * (width * height)
+        self.row_count = array('i', bytes(4 * height))
+        self.overflow = {}
+
+    @classmethod
+    def from_nested(cls, field):
+        """Build index from list of rows of lists of unit IDs"""
+        grid = cls(len(field[0]), len(field))
+        for y, row in enumerate(field):
+            for x, cell in enumerate(row):
+                for unit_id in cell:
+                    grid.add(unit_id, x, y)
+        return grid
+
+    @classmethod
+    def from_buffers(cls, width, height, count, first, row_count, overflow):
+        """
+        Build index on top of existing arrays (or writable memoryviews)
+        without copying them
+        """
+        # pylint: disable=too-many-arguments
+        grid = cls.__new__(cls)
+        grid.width = width
+        grid.height = height
+        grid.count = count
+        grid.first = first
+        grid.row_count = row_count
+        grid.overflow = overflow
+        return grid
+
+    def __len__(self):
+        return sum(self.row_count)
+
+    def add(self, unit_id, x, y):
+        """Put unit to the end of the cell"""
+        # pylint: disable=invalid-name
+        cell = y * self.width + x
+        if self.count[cell]:
+            self.overflow.setdefault(cell, []).append(unit_id)
+        else:
+            self.first[cell] = unit_id
+        self.count[cell] += 1
+        self.row_count[y] += 1
+
+    def remove(self, unit_id, x, y):
+        """Remove unit from the cell"""
+        # pylint: disable=invalid-name
+        cell = y * self.width + x
+        if self.count[cell] == 0:
+            raise ValueError("Unit {} is not in cell ({}, {})".format(
+                unit_id, x, y))
+        if self.first[cell] == unit_id:
+            bucket = self.overflow.get(cell)
+            if bucket:
+                self.first[cell] = bucket.pop(0)
+            else:
+                self.first[cell] = -1
+        else:
+            bucket = self.overflow.get(cell, [])
+            bucket.remove(unit_id)
+        if cell in self.overflow and not self.overflow[cell]:
+            del self.overflow[cell]
+        self.count[cell] -= 1
+        self.row_count[y] -= 1
+
+    def count_at(self, x, y):
+        """Number of units in the cell"""
+        # pylint: disable=invalid-name
+        return self.count[y * self.width + x]
+
+    def units_at(self, x, y):
+        """List of IDs of units in the cell"""
+        # pylint: disable=invalid-name
+        cell = y * self.width + x
+        if self.count[cell] == 0:
+            return []
+        if self.count[cell] == 1:
+            return [self.first[cell]]
+        return [self.first[cell]] + self.overflow[cell]
+
+    def cells_in_rect(self, x1, y1, x2, y2):
+        """
+        Iterate over `(x, y, ids)` of occupied cells in rectangle
+        (bounds are inclusive and clipped to the field)
+        """
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, self.width - 1), min(y2, self.height - 1)
+        count, first = self.count, self.first
+        for y in range(y1, y2 + 1):
+            # pylint: disable=invalid-name
+            if not self.row_count[y]:
+                continue
+            start = y * self.width
+            for x in range(x1, x2 + 1):
+                cell = start + x
+                if count[cell] == 1:
+                    yield x, y, [first[cell]]
+                elif count[cell]:
+                    yield x, y, [first[cell]] + self.overflow[cell]
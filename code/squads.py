@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Squads: groups of units which take orders together
+
+Squads are kept in `GameState.squad_dict` (so they are saved with the
+game) as lists of `[unit_id, dx, dy]` members, where `(dx, dy)` is the
+offset of the member from the center of the squad when it was formed.
+Orders to a squad target a cell, and every member goes to (or attacks)
+that cell shifted by its offset, so the squad keeps its formation.
+`Squads` also indexes squad of every unit, so changes of membership
+never scan squads or `unit_dict`; the index is built again whenever
+`squad_dict` is replaced (by loading or promoting a fork).
+"""
+
+
+class Squads:
+    """Squads of one `GameState` and index of their members"""
+    game_state = None
+    _squad_of = None
+    _indexed = None
+
+    def __init__(self, game_state):
+        self.game_state = game_state
+        self.reset()
+        game_state.add_listener(self)
+
+    def reset(self):
+        """Index members of squads again (called on load)"""
+        self._indexed = self.game_state.squad_dict
+        self._squad_of = {}
+        for squad_id, members in self._indexed.items():
+            for unit_id, _, _ in members:
+                self._squad_of[unit_id] = squad_id
+
+    def _index(self):
+        """Index of squads of units (up to date with `squad_dict`)"""
+        if self._indexed is not self.game_state.squad_dict:
+            self.reset()
+        return self._squad_of
+
+    def cell_changed(self, x, y):
+        """Positions don't matter to squads (deaths are passed by engine)"""
+
+    def __contains__(self, squad_id):
+        return squad_id in self.game_state.squad_dict
+
+    def __len__(self):
+        return len(self.game_state.squad_dict)
+
+    def squad_of(self, unit_id):
+        """ID of squad of the unit (`None` if it's in no squad)"""
+        return self._index().get(unit_id)
+
+    def members(self, squad_id):
+        """List of `(unit_id, dx, dy)` members (`KeyError` if no squad)"""
+        return self.game_state.squad_dict[squad_id]
+
+    def color(self, squad_id):
+        """Color of units of the squad"""
+        unit_id = self.members(squad_id)[0][0]
+        return self.game_state.unit_dict[unit_id].color
+
+    def squads_of(self, color):
+        """IDs of squads of the color in ascending order"""
+        return sorted(squad_id for squad_id in self.game_state.squad_dict
+                      if self.color(squad_id) == color)
+
+    def create(self, unit_ids):
+        """
+        Form squad of units (they leave their old squads) around
+        their center; get its ID
+        """
+        unit_dict = self.game_state.unit_dict
+        unit_ids = sorted(set(unit_ids))
+        if not unit_ids:
+            raise ValueError("Squad needs at least one unit")
+        positions = [unit_dict[unit_id].position for unit_id in unit_ids]
+        colors = {unit_dict[unit_id].color for unit_id in unit_ids}
+        if len(colors) > 1:
+            raise ValueError("Units of squad must have the same color")
+        self.remove_units(unit_ids)
+        center_x = round(sum(pos[0] for pos in positions) / len(positions))
+        center_y = round(sum(pos[1] for pos in positions) / len(positions))
+        squad_dict = self.game_state.squad_dict
+        squad_id = max(squad_dict, default=-1) + 1
+        squad_dict[squad_id] = [
+            [unit_id, pos[0] - center_x, pos[1] - center_y]
+            for unit_id, pos in zip(unit_ids, positions)]
+        index = self._index()
+        for unit_id in unit_ids:
+            index[unit_id] = squad_id
+        return squad_id
+
+    def disband(self, squad_id):
+        """Remove squad (`KeyError` if there is none); get its members"""
+        index = self._index()
+        members = self.game_state.squad_dict.pop(squad_id)
+        for unit_id, _, _ in members:
+            del index[unit_id]
+        return members
+
+    def remove_units(self, unit_ids):
+        """
+        Take units out of their squads (empty squads are removed);
+        get number of units which were in squads
+        """
+        index = self._index()
+        leaving = {}
+        for unit_id in unit_ids:
+            squad_id = index.pop(unit_id, None)
+            if squad_id is not None:
+                leaving.setdefault(squad_id, set()).add(unit_id)
+        squad_dict = self.game_state.squad_dict
+        for squad_id, gone in leaving.items():
+            # Lists are replaced, not changed (forks share them)
+            members = [member for member in squad_dict[squad_id]
+                       if member[0] not in gone]
+            if members:
+                squad_dict[squad_id] = members
+            else:
+                del squad_dict[squad_id]
+        return sum(map(len, leaving.values()))
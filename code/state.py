@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 """This module contains basic classes for managing game state"""
 from collections import namedtuple
+from collections.abc import Mapping
 import json
 import random
-import sys
+import weakref
 
-from . import units
+from . import binfmt, units
+from .journal import Journal
+from .chunks import ChunkedGrid
+from .spatial import SpatialIndex
+from .store import UnitMapping, UnitStore
+from .units import registry
 
 
 FIELD_WIDTH = 20
 FIELD_HEIGHT = 20
+# Fields with larger area are kept in `ChunkedGrid` by default
+SPARSE_AREA = 1 << 20
 
 
 PlayerInfo = namedtuple(
@@ -42,39 +50,27 @@ class GameEncoder(json.JSONEncoder):
     # pylint: disable=method-hidden,arguments-differ
 
     def default(self, obj):
+        if isinstance(obj, Mapping):
+            # `UnitMapping` and units of forks
+            return dict(obj.items())
         if isinstance(obj, Wrapper):
             return {
                 "__type__": "player_info",
                 "__data__": obj._asdict()
             }
-        if isinstance(obj, units.Headquarters):
-            return {
-                "__unittype__": "hq",
+        kind = registry.kind_of(obj)
+        if kind is not None:
+            dct = {
+                "__unittype__": kind.name,
                 "color": obj.color,
                 "name": obj.name,
                 "pos": obj.position,
-                "allowed_units": obj._allowed_units_names
-            }
-        if isinstance(obj, units.Infantry):
-            return {
-                "__unittype__": "infantry",
-                "color": obj.color,
-                "name": obj.name,
-                "pos": obj.position,
-                "health": obj.health,
-                "damage": obj.damage,
-                "max_health": obj.max_health
-            }
-        if isinstance(obj, units.Vehicle):
-            return {
-                "__unittype__": "vehicle",
-                "color": obj.color,
-                "name": obj.name,
-                "pos": obj.position,
-                "health": obj.health,
-                "damage": obj.damage,
-                "max_health": obj.max_health
             }
+            for key in kind.stats:
+                dct[key] = getattr(obj, key)
+            if kind.spawns:
+                dct["allowed_units"] = obj._allowed_units_names
+            return dct
         return json.JSONEncoder.default(self, obj)
 
 
@@ -84,28 +80,20 @@ def game_object_hook(dct):
         if dct["__type__"] == "player_info":
             return Wrapper(PlayerInfo(**dct["__data__"]))
     if "__unittype__" in dct:
-        if dct["__unittype__"] == "hq":
+        kind = registry.KINDS[dct["__unittype__"]]
+        if kind.spawns:
             type_dict = {}
             for name in dct["allowed_units"]:
-                type_dict[name.lower()] = getattr(
-                    getattr(sys.modules[__name__], "units"), name)
-            return units.Headquarters(
+                type_dict[name.lower()] = \
+                    registry.kind_by_class_name(name).base
+            return kind.base(
                 dct["name"], dct["pos"],
                 dct["color"], type_dict)
-        if dct["__unittype__"] == "infantry":
-            obj = units.Infantry(dct["name"], dct["pos"])
-            obj.color = dct["color"]
-            obj.health = dct["health"]
-            obj.damage = dct["damage"]
-            obj.max_health = dct["max_health"]
-            return obj
-        if dct["__unittype__"] == "vehicle":
-            obj = units.Vehicle(dct["name"], dct["pos"])
-            obj.color = dct["color"]
-            obj.health = dct["health"]
-            obj.damage = dct["damage"]
-            obj.max_health = dct["max_health"]
-            return obj
+        obj = registry.colored_class(kind.base, dct["color"])(
+            dct["name"], dct["pos"])
+        for key in kind.stats:
+            setattr(obj, key, dct[key])
+        return obj
     return dct
 
 
@@ -116,16 +104,35 @@ class GameState:
     """
 
     current_player = 0
+    rng = None
     list_of_player_infos = None
-    game_field = None
+    grid = None
     unit_count = 0
     unit_dict = None
     squad_dict = None
+    store = None
+    journal = None
+    listeners = None
     width = 0
     height = 0
 
-    def __init__(self, player_count, width, height):
-        """Number of player is always equal to 2 or 4"""
+    def __init__(self, player_count, width, height, array_store=False,
+                 sparse=None, seed=None):
+        """
+        Number of player is always equal to 2 or 4
+
+        If `array_store` is true, units are kept in `UnitStore`
+        and `unit_dict` contains views of its rows.
+        If `sparse` is true, field is kept in `ChunkedGrid`
+        (by default it's used for fields larger than `SPARSE_AREA`).
+        All random choices of the game (colors of players, positions
+        of spawned units) come from `rng` seeded with `seed`; its state
+        is saved with the game.
+        """
+        # pylint: disable=too-many-arguments
+        self.rng = random.Random(seed)
+        if sparse is None:
+            sparse = width * height > SPARSE_AREA
         if player_count < 2:
             player_count = 2
         if player_count > 2:
@@ -140,46 +147,218 @@ class GameState:
         if player_count == 4:
             hq_pos[1], hq_pos[2] = hq_pos[2], hq_pos[1]
         self.list_of_player_infos = []
-        self.game_field = [[[] for _ in range(width)] for _ in range(height)]
-        self.unit_dict = {}
+        self.listeners = weakref.WeakSet()
+        if sparse:
+            self.grid = ChunkedGrid(width, height)
+        else:
+            self.grid = SpatialIndex(width, height)
+        self._init_units(array_store)
         self.squad_dict = {}
         for i in range(player_count):
-            color = random.randrange(0, 2**24)
+            color = self.rng.randrange(0, 2**24)
             self.list_of_player_infos.append(Wrapper(PlayerInfo(
                 color, False, 1000
             )))
-            self.unit_dict[i] = units.Headquarters(
-                "HQ", hq_pos[i], color,
-                {"infantry": units.Infantry, "vehicle": units.Vehicle})
-            self.game_field[hq_pos[i][1]][hq_pos[i][0]] = [i]
+            self.add_unit(units.Headquarters(
+                "HQ", hq_pos[i], color, units.allowed_units("hq")))
         self.width = width
         self.height = height
-        self.unit_count = player_count
+
+    def _init_units(self, array_store):
+        """Create empty `unit_dict` of requested kind"""
+        self.unit_count = 0
+        if array_store:
+            self.store = UnitStore()
+            self.unit_dict = UnitMapping(self.store)
+        else:
+            self.store = None
+            self.unit_dict = {}
+
+    @property
+    def game_field(self):
+        """
+        Read-only rows of tuples of unit IDs, built from `grid` on every
+        access (so it costs time and memory of the whole field; use `grid`
+        in game code); `ValueError` for sparse fields
+        """
+        if isinstance(self.grid, ChunkedGrid) \
+                or self.width * self.height > SPARSE_AREA:
+            raise ValueError("Sparse field can't be listed as a whole")
+        return tuple(tuple(tuple(ids) for ids in row)
+                     for row in self.grid.to_nested())
+
+    def fork(self):
+        """
+        Get copy-on-write child state (see `fork.GameFork`);
+        this state must not change while the child is in use
+        """
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from .fork import GameFork
+        return GameFork(self)
+
+    def add_listener(self, listener):
+        """
+        Report changes of the field to `listener` (which is kept only
+        while somebody else references it): `listener.cell_changed(x, y)`
+        is called when units appear in the cell, leave it or die,
+        and `listener.reset()` is called when the state is loaded
+        """
+        self.listeners.add(listener)
+
+    def _cell_changed(self, pos):
+        for listener in self.listeners:
+            listener.cell_changed(pos[0], pos[1])
+
+    def add_unit(self, unit):
+        """Register new unit, place it on the field and return its ID"""
+        if self.store is not None:
+            unit_id = self.store.add(unit)
+            self.unit_count = self.store.capacity
+        else:
+            unit_id = self.unit_count
+            self.unit_dict[unit_id] = unit
+            self.unit_count += 1
+        self.grid.add(unit_id, unit.position[0], unit.position[1])
+        self._cell_changed(unit.position)
+        return unit_id
+
+    def move_unit(self, unit_id, new_pos):
+        """Change position of unit and update the field"""
+        unit = self.unit_dict[unit_id]
+        old_pos = unit.position
+        unit.position = new_pos
+        self.grid.move(unit_id, old_pos, new_pos)
+        self._cell_changed(old_pos)
+        self._cell_changed(new_pos)
+
+    def remove_unit(self, unit_id):
+        """Delete unit from the field"""
+        pos = self.unit_dict[unit_id].position
+        self.grid.remove(unit_id, pos[0], pos[1])
+        del self.unit_dict[unit_id]
+        self._cell_changed(pos)
 
     def load(self, filename):
-        """Replace current state with one loaded from file"""
-        with open(filename, encoding="utf-8") as file:
-            self.unit_count, self.game_field, self.list_of_player_infos,\
-                self.unit_dict, self.squad_dict =\
-                json.load(
-                    file,
-                    object_hook=game_object_hook)
-        new_dict = {}
-        for key, value in self.unit_dict.items():
-            new_dict[int(key)] = value
-        self.unit_dict = new_dict
-        new_dict = {}
-        for key, value in self.squad_dict.items():
-            new_dict[int(key)] = value
-        self.squad_dict = new_dict
-
-        self.width = len(self.game_field[0])
-        self.height = len(self.game_field)
+        """
+        Replace current state with one loaded from file
+        (binary files are recognized by suffix `binfmt.SUFFIX`)
+
+        Turns logged in the journal of the file are replayed on top of it.
+        """
+        if str(filename).endswith(binfmt.SUFFIX):
+            self._load_binary(filename)
+        else:
+            self._load_json(filename)
+        for listener in self.listeners:
+            listener.reset()
+        Journal(filename).replay(self)
+
+    def rng_state(self):
+        """State of `rng` as JSON-serializable list"""
+        version, internal, gauss_next = self.rng.getstate()
+        return [version, list(internal), gauss_next]
+
+    def set_rng_state(self, state):
+        """Restore state of `rng` got from `rng_state`"""
+        self.rng.setstate((state[0], tuple(state[1]), state[2]))
+
+    def _load_json(self, filename):
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from . import jsonload, saving
+        if saving.compression(filename) is not None:
+            self.load_json_data(saving.read_json(filename, game_object_hook))
+        else:
+            jsonload.load(self, filename)
+
+    def load_json_data(self, data):
+        """Replace current state with decoded contents of JSON save"""
+        self.begin_json_load(*data[:3])
+        for key, value in data[3].items():
+            self.unit_dict[int(key)] = value
+        self.finish_json_load(data[4], data[5] if len(data) > 5 else None)
+
+    def begin_json_load(self, unit_count, game_field, player_infos):
+        """
+        Start loading sections of JSON save: the field and players
+        are replaced, `unit_dict` is emptied to be filled by the caller
+        (then `finish_json_load` must be called)
+        """
+        self._init_units(self.store is not None)
+        self.unit_count = unit_count
+        self.list_of_player_infos = player_infos
+        if isinstance(game_field, dict):
+            self.grid = ChunkedGrid.from_cells(
+                game_field["width"], game_field["height"],
+                game_field["cells"])
+        else:
+            self.grid = SpatialIndex.from_nested(game_field)
+        self.width = self.grid.width
+        self.height = self.grid.height
+
+    def finish_json_load(self, squad_dict, state=None):
+        """Load the last sections of JSON save (see `begin_json_load`)"""
+        self.squad_dict = {int(key): value
+                           for key, value in squad_dict.items()}
+        if state is not None:
+            # Saves made before the state of the game was saved lack it
+            self.current_player = state["current_player"]
+            self.set_rng_state(state["rng"])
+            if self.store is not None and "free" in state:
+                self.store.set_free_list(state["free"])
+
+    def _load_binary(self, filename):
+        parts = binfmt.load(filename)
+        self.store = parts["store"]
+        self.unit_dict = UnitMapping(self.store)
+        self.grid = parts["grid"]
+        self.unit_count = parts["unit_count"]
+        self.current_player = parts["current_player"]
+        self.list_of_player_infos = [
+            Wrapper(PlayerInfo(**info)) for info in parts["players"]]
+        self.squad_dict = parts["squads"]
+        self.width = self.grid.width
+        self.height = self.grid.height
+        if parts["rng"] is not None:
+            self.set_rng_state(parts["rng"])
+
+    def _saved_field(self):
+        """
+        Field for JSON save: list of rows of cells,
+        or list of occupied cells for sparse grid
+        """
+        if isinstance(self.grid, ChunkedGrid):
+            return {
+                "width": self.grid.width,
+                "height": self.grid.height,
+                "cells": list(self.grid.occupied_cells()),
+            }
+        return self.grid.to_nested()
+
+    def json_data(self):
+        """
+        Contents of JSON save (to be encoded with `GameEncoder`);
+        free list of `store` is saved, since it decides IDs of new units
+        """
+        state = {"current_player": self.current_player,
+                 "rng": self.rng_state()}
+        if self.store is not None:
+            state["free"] = self.store.free_list()
+        return [self.unit_count, self._saved_field(),
+                self.list_of_player_infos, self.unit_dict, self.squad_dict,
+                state]
 
     def save(self, filename):
-        """Save state to the file"""
-        with open(filename, "w", encoding="utf-8") as file:
-            json.dump(
-                [self.unit_count, self.game_field, self.list_of_player_infos,
-                 self.unit_dict, self.squad_dict],
-                file, cls=GameEncoder)
+        """
+        Save state to the file
+        (in binary format if its name ends with `binfmt.SUFFIX`,
+        otherwise in JSON compressed according to `saving.COMPRESSED`)
+
+        Journal of the file is deleted, since the snapshot includes it.
+        """
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from . import saving
+        if str(filename).endswith(binfmt.SUFFIX):
+            binfmt.save(self, filename)
+        else:
+            saving.write_json(self.json_data(), filename)
+        Journal(filename).discard()
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""Struct-of-arrays storage for units (compact alternative to `unit_dict`)"""
+from array import array
+from collections.abc import MutableMapping
+
+from .units import abc, registry
+
+
+def _type_code(unit):
+    """Get type code of unit object (position of its kind in registry)"""
+    kind = registry.kind_of(unit)
+    if kind is None:
+        raise TypeError("Unit of type {} can't be stored".format(
+            type(unit).__name__))
+    return registry.type_code(kind)
+
+
+class UnitStore:
+    """
+    Columns of unit attributes indexed by unit ID
+
+    Every unit takes one row (25 bytes); rows of dead units
+    are kept in the free list and reused by `add()`.
+    """
+    kind = None
+    color = None
+    x = None
+    y = None
+    health = None
+    damage = None
+    max_health = None
+    _free = None
+    _allowed = None
+    _live = 0
+
+    COLUMNS = ("kind", "color", "x", "y", "health", "damage", "max_health")
+
+    def __init__(self):
+        self.kind = array('B')
+        self.color = array('I')
+        self.x = array('i')
+        self.y = array('i')
+        self.health = array('i')
+        self.damage = array('i')
+        self.max_health = array('i')
+        self._free = array('i')
+        self._allowed = {}
+        self._live = 0
+
+    def _columns(self):
+        return tuple(getattr(self, name) for name in self.COLUMNS)
+
+    def __len__(self):
+        return self._live
+
+    def __contains__(self, unit_id):
+        return 0 <= unit_id < len(self.kind) and self.kind[unit_id] != 0
+
+    @property
+    def capacity(self):
+        """Number of rows (live and free)"""
+        return len(self.kind)
+
+    def nbytes(self):
+        """Memory used by columns"""
+        return sum(column.itemsize * len(column)
+                   for column in self._columns() + (self._free,))
+
+    def copy(self):
+        """Independent copy of all rows (columns of mapped files are read)"""
+        other = UnitStore()
+        for name in self.COLUMNS + ("_free",):
+            column = getattr(self, name)
+            if isinstance(column, array):
+                column = array(column.typecode, column)
+            else:
+                column = array(column.format, column.tobytes())
+            setattr(other, name, column)
+        other._allowed = dict(self._allowed)
+        other._live = self._live
+        return other
+
+    def _grow(self, size):
+        """Add free rows until there are `size` rows"""
+        old_size = len(self.kind)
+        if size <= old_size:
+            return
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            if not isinstance(column, array):
+                # Column is a view of mapped file, so copy it before growing
+                column = array(column.format, column.tobytes())
+                setattr(self, name, column)
+            column.extend(array(column.typecode, bytes(
+                column.itemsize * (size - old_size))))
+        self._free.extend(reversed(range(old_size, size)))
+
+    def free_list(self):
+        """IDs of free rows in order of release (the last is reused first)"""
+        return list(self._free)
+
+    def set_free_list(self, unit_ids):
+        """
+        Restore saved order of free rows (rows are added up to the
+        largest ID); `ValueError` unless they are exactly the free rows
+        """
+        if unit_ids:
+            self._grow(max(unit_ids) + 1)
+        kind = self.kind
+        if sorted(unit_ids) != [i for i in range(len(kind)) if not kind[i]]:
+            raise ValueError("Free list doesn't match free rows")
+        self._free = array('i', unit_ids)
+
+    def add(self, unit):
+        """Copy attributes of new unit object to a free row; return its ID"""
+        code = _type_code(unit)
+        if not self._free:
+            self._grow(len(self.kind) + 1)
+        unit_id = self._free.pop()
+        self._live += 1
+        self._write(unit_id, code, unit)
+        return unit_id
+
+    def put(self, unit_id, unit):
+        """Copy attributes of unit object to the row `unit_id`"""
+        code = _type_code(unit)
+        if unit_id >= len(self.kind):
+            self._grow(unit_id + 1)
+        if self.kind[unit_id] == 0:
+            if self._free and self._free[-1] == unit_id:
+                self._free.pop()
+            else:
+                self._free.remove(unit_id)
+            self._live += 1
+        self._write(unit_id, code, unit)
+
+    def _write(self, unit_id, code, unit):
+        self.kind[unit_id] = code
+        self.color[unit_id] = unit.color
+        self.x[unit_id], self.y[unit_id] = unit.position
+        kind = registry.kind_by_code(code)
+        if "health" in kind.stats:
+            self.health[unit_id] = unit.health
+            self.damage[unit_id] = unit.damage
+            self.max_health[unit_id] = unit.max_health
+        else:
+            self.health[unit_id] = 0
+            self.damage[unit_id] = 0
+            self.max_health[unit_id] = 0
+        if kind.spawns:
+            # pylint: disable=protected-access
+            self._allowed[unit_id] = tuple(unit._allowed_units_names)
+
+    def release(self, unit_id):
+        """Free the row of dead unit"""
+        if unit_id not in self:
+            raise KeyError(unit_id)
+        self.kind[unit_id] = 0
+        self._allowed.pop(unit_id, None)
+        self._free.append(unit_id)
+        self._live -= 1
+
+    def ids(self):
+        """Iterate over IDs of live units"""
+        kind = self.kind
+        return (i for i in range(len(kind)) if kind[i])
+
+    def view(self, unit_id):
+        """Get unit object which reads and writes this row"""
+        if unit_id not in self:
+            raise KeyError(unit_id)
+        return _view_class(self.kind[unit_id])(self, unit_id)
+
+
+class UnitMapping(MutableMapping):
+    """`unit_dict`-like interface to `UnitStore`"""
+    store = None
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, unit_id):
+        return self.store.view(unit_id)
+
+    def __setitem__(self, unit_id, unit):
+        self.store.put(unit_id, unit)
+
+    def __delitem__(self, unit_id):
+        self.store.release(unit_id)
+
+    def __contains__(self, unit_id):
+        return isinstance(unit_id, int) and unit_id in self.store
+
+    def __iter__(self):
+        return self.store.ids()
+
+    def __len__(self):
+        return len(self.store)
+
+
+class _UnitView:
+    """Mixin which redirects unit attributes to a row of `UnitStore`"""
+    # pylint: disable=super-init-not-called,protected-access
+    _store = None
+    _id = None
+
+    def __init__(self, store, unit_id):
+        self._store = store
+        self._id = unit_id
+
+    def __eq__(self, other):
+        return isinstance(other, _UnitView) and \
+            self._store is other._store and self._id == other._id
+
+    def __hash__(self):
+        return hash((id(self._store), self._id))
+
+    @property
+    def name(self):
+        # pylint: disable=missing-docstring
+        return registry.kind_by_code(self._store.kind[self._id]).name
+
+    @property
+    def position(self):
+        # pylint: disable=missing-docstring
+        return abc.Vector(self._store.x[self._id], self._store.y[self._id])
+
+    @position.setter
+    def position(self, value):
+        self._store.x[self._id], self._store.y[self._id] = value
+
+    def move_to(self, x, y):
+        # pylint: disable=invalid-name,missing-docstring
+        self.position = (x, y)
+
+    @property
+    def color(self):
+        # pylint: disable=missing-docstring
+        return self._store.color[self._id]
+
+
+class _BattleView(_UnitView):
+    """Battle stats of `_UnitView`"""
+
+    @property
+    def health(self):
+        # pylint: disable=missing-docstring
+        return self._store.health[self._id]
+
+    @health.setter
+    def health(self, value):
+        self._store.health[self._id] = value
+
+    @property
+    def damage(self):
+        # pylint: disable=missing-docstring
+        return self._store.damage[self._id]
+
+    @damage.setter
+    def damage(self, value):
+        self._store.damage[self._id] = value
+
+    @property
+    def max_health(self):
+        # pylint: disable=missing-docstring
+        return self._store.max_health[self._id]
+
+    @max_health.setter
+    def max_health(self, value):
+        self._store.max_health[self._id] = value
+
+
+class _FactoryView(_UnitView):
+    """Unit creation of `_UnitView` (allowed units are kept in the store)"""
+
+    @property
+    def _allowed_units_names(self):
+        return list(self._store._allowed.get(self._id, ()))
+
+    def can_create(self, name):
+        # pylint: disable=missing-docstring
+        return name in (
+            allowed.lower() for allowed in self._allowed_units_names)
+
+    def create_unit(self, name, pos):
+        # pylint: disable=missing-docstring
+        if self.can_create(name):
+            base = registry.KINDS[name].base
+        else:
+            base = abc.Unit
+        return registry.colored_class(base, self.color)(name, pos)
+
+
+_VIEW_CLASSES = {}
+
+
+def _view_class(code):
+    """Get (and create once) view class of the kind with given type code"""
+    cls = _VIEW_CLASSES.get(code)
+    if cls is None:
+        kind = registry.kind_by_code(code)
+        mixin = _UnitView
+        if kind.spawns:
+            mixin = _FactoryView
+        elif "health" in kind.stats:
+            mixin = _BattleView
+        cls = type(kind.base.__name__ + "View", (mixin, kind.base),
+                   {"_char": kind.char})
+        _VIEW_CLASSES[code] = cls
+    return cls
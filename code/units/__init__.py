@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 """Real classes for game"""
-from . import abc
+from . import abc, registry
 
 
 class Headquarters(abc.Unit, abc.UnitFactory):
@@ -15,22 +15,13 @@ class Headquarters(abc.Unit, abc.UnitFactory):
         self._color = color
         self._allowed_units_dict = {}
         self._allowed_units_names = []
-        self._char = 'H'
+        registry.KINDS["hq"].apply(self)
 
-        def getcolor(self):
-            return self._color
         for key, value in unit_dict.items():
-            self._allowed_units_dict[key] = type(
-                "Colored" + value.__name__,
-                (value,),
-                {"_color": color,
-                 "color": property(getcolor)})
+            self._allowed_units_dict[key] = registry.colored_class(
+                value, color)
             self._allowed_units_names.append(value.__name__)
-        self._colored_unit = type(
-            "ColoredUnit",
-            (abc.Unit,),
-            {"_color": color,
-             "color": property(getcolor)})
+        self._colored_unit = registry.colored_class(abc.Unit, color)
 
     @property
     def color(self):
@@ -58,7 +49,7 @@ class Infantry(abc.MovableBattleUnit):
     # pylint: disable=missing-docstring
     def __init__(self, name, pos):
         super().__init__(name, pos)
-        self._char = 'I'
+        registry.KINDS["infantry"].apply(self)
 
     def __str__(self):
         # pylint: disable=no-member
@@ -70,13 +61,25 @@ class Vehicle(abc.MovableBattleUnit):
     # pylint: disable=missing-docstring
     def __init__(self, name, pos):
         super().__init__(name, pos)
-        self.max_health = 200
-        self.damage = 5
-        self._char = 'V'
-
-        self.health = self.max_health
+        registry.KINDS["vehicle"].apply(self)
 
     def __str__(self):
         # pylint: disable=no-member
         return "Vehicle\n\tColor: #{:X}\n\tHealth: {}/{}\n\tDamage: {}"\
             .format(self.color, self.health, self.max_health, self.damage)
+
+
+registry.register(registry.UnitKind(
+    "hq", Headquarters, 'H', {}, ("infantry", "vehicle"), 4, None))
+registry.register(registry.UnitKind(
+    "infantry", Infantry, 'I',
+    {"max_health": 100, "damage": 10, "health": 100}, (), 3, "grenade"))
+registry.register(registry.UnitKind(
+    "vehicle", Vehicle, 'V',
+    {"max_health": 200, "damage": 5, "health": 200}, (), 5, "shell"))
+
+
+def allowed_units(kind_name):
+    """Get `unit_dict` for `Headquarters` from allowed spawns of the kind"""
+    return {name: registry.KINDS[name].base
+            for name in registry.KINDS[kind_name].spawns}
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 """Abstract base classes for game"""
+from abc import ABCMeta
 from collections import namedtuple
 
 
@@ -13,8 +14,13 @@ class Vector(namedtuple("Vector", ["x", "y"])):
         return Vector(self.x - other.x, self.y - other.y)
 
 
-class Unit:
-    """Abstract unit which can't do anything"""
+class Unit(metaclass=ABCMeta):
+    """
+    Abstract unit which can't do anything
+
+    Classes are `ABCMeta`, so other implementations (see `slotted`)
+    can be registered as virtual subclasses and pass `isinstance`.
+    """
     _name = None
     _position = None
     _char = 'U'
@@ -87,7 +93,7 @@ class MovableBattleUnit(BattleUnit, MovableUnit):
     """Auxiliary class for units which can \"move and fight\""""
 
 
-class UnitFactory:
+class UnitFactory(metaclass=ABCMeta):
     """Abstract factory which can create abstract Units"""
 
     def create_unit(self, name, pos):
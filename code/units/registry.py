@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Data-driven registry of unit kinds and shared colored classes"""
+from collections import namedtuple, OrderedDict
+
+
+class UnitKind(namedtuple("UnitKind", [
+        "name",
+        "base",
+        "char",
+        "stats",
+        "spawns",
+        "vision",
+        "area",
+])):
+    """
+    Description of unit kind
+
+    `base` is the class of units, `stats` is a dictionary of
+    initial attribute values, `spawns` lists names of kinds
+    which units of this kind can create, `vision` is radius
+    of cells which units see (for fog of war) and `area` is name
+    of damage kernel of area attacks (see `area.KERNELS`).
+    """
+
+    def apply(self, unit):
+        """Set initial attributes of new unit"""
+        # pylint: disable=protected-access
+        unit._char = self.char
+        self.apply_stats(unit)
+
+    def apply_stats(self, unit):
+        """Set initial stats of new unit (but not its character)"""
+        for key, value in self.stats.items():
+            setattr(unit, key, value)
+
+
+# Default `vision` and `area` (`namedtuple(defaults=...)` needs 3.7)
+UnitKind.__new__.__defaults__ = (3, None)
+
+
+# Kinds in order of registration (it defines type codes of `UnitStore`)
+KINDS = OrderedDict()
+_KINDS_BY_CLASS = {}
+_CODES = {}
+_KINDS_BY_CODE = [None]
+_COLORED_CLASSES = {}
+
+
+def register(kind):
+    """Add new unit kind"""
+    if kind.name in KINDS:
+        raise ValueError("Unit kind {} is already registered".format(
+            kind.name))
+    KINDS[kind.name] = kind
+    _KINDS_BY_CLASS[kind.base] = kind
+    _CODES[kind.name] = len(_KINDS_BY_CODE)
+    _KINDS_BY_CODE.append(kind)
+
+
+def register_class(cls, kind_name):
+    """Treat instances of another class as units of registered kind"""
+    _KINDS_BY_CLASS[cls] = KINDS[kind_name]
+
+
+def type_code(kind):
+    """Get number of kind (starting with 1) in order of registration"""
+    return _CODES[kind.name]
+
+
+def kind_by_code(code):
+    """Get kind by its number"""
+    return _KINDS_BY_CODE[code]
+
+
+def kind_of(unit):
+    """Get kind of unit object (`None` if it isn't registered)"""
+    for cls in type(unit).__mro__:
+        kind = _KINDS_BY_CLASS.get(cls)
+        if kind is not None:
+            return kind
+    return None
+
+
+def kind_by_class_name(class_name):
+    """Get kind by name of its base class"""
+    for kind in KINDS.values():
+        if kind.base.__name__ == class_name:
+            return kind
+    raise KeyError(class_name)
+
+
+def _getcolor(self):
+    # pylint: disable=protected-access
+    return self._color
+
+
+def colored_class(base, color):
+    """
+    Get subclass of `base` which has given color
+
+    Every class is created once per process, so all headquarters
+    (including loaded ones) of the same color share it.
+    """
+    key = (base, color)
+    cls = _COLORED_CLASSES.get(key)
+    if cls is None:
+        cls = type(
+            "Colored" + base.__name__,
+            (base,),
+            {"__slots__": (),
+             "_color": color,
+             "color": property(_getcolor)})
+        _COLORED_CLASSES[key] = cls
+    return cls
+
+
+def colored_class_count():
+    """Number of colored classes created so far"""
+    return len(_COLORED_CLASSES)
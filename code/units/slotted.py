@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Variant of unit classes without instance `__dict__`
+
+Hierarchy mirrors `abc` and the classes from `units`: only `Unit`,
+`SelfMovableUnit`, `BattleUnit` and `Headquarters` add slots, so
+`MovableBattleUnit` and `Headquarters` can still use multiple
+inheritance.  Characters stay class attributes; stats are set from
+the registry in `__init__`.  Slotted units are saved as kinds of
+the ordinary classes and loaded as those.  Every slotted class is
+registered as virtual subclass of its ordinary counterpart, so the
+engine and shells accept slotted units wherever ordinary ones go.
+"""
+from . import abc, registry
+from .. import units
+
+
+class Unit:
+    """Abstract unit which can't do anything"""
+    __slots__ = ("_name", "_position")
+    _char = 'U'
+
+    def __init__(self, name, pos):
+        self._name = name
+        self._position = abc.Vector(pos[0], pos[1])
+
+    @property
+    def name(self):
+        # pylint: disable=missing-docstring
+        return self._name
+
+    @property
+    def position(self):
+        # pylint: disable=missing-docstring
+        return self._position
+
+    @property
+    def char(self):
+        """Used for `show` command"""
+        return self._char
+
+
+class MovableUnit(Unit):
+    """Unit which position can be changed"""
+    __slots__ = ()
+
+    def move_to(self, x, y):
+        # pylint: disable=invalid-name
+        """Change position of unit (function call)"""
+        self._position = abc.Vector(x, y)
+
+    # pylint: disable=no-member
+    @Unit.position.setter
+    def position(self, value):
+        """Change position of unit (assignment)"""
+        self._position = abc.Vector(value[0], value[1])
+
+
+class SelfMovableUnit(MovableUnit):
+    """Unit which can change its position"""
+    __slots__ = ("speed",)
+
+    def __init__(self, name, pos, speed):
+        super().__init__(name, pos)
+        self.speed = abc.Vector(speed[0], speed[1])
+
+    def move(self):
+        """Tell unit to change its postion"""
+        self._position += self.speed
+
+
+class BattleUnit(Unit):
+    """Unit which can give and take damage"""
+    __slots__ = ("health", "damage", "max_health")
+
+    def __init__(self, name, pos):
+        super().__init__(name, pos)
+        self.health = 100
+        self.damage = 10
+        self.max_health = 100
+
+    def attack(self, other):
+        """Give damage to another BattleUnit"""
+        other.health -= self.damage
+
+    def heal(self, delta_hp):
+        """Increase current health points"""
+        self.health = min(self.max_health, self.health + delta_hp)
+
+
+class MovableBattleUnit(BattleUnit, MovableUnit):
+    """Auxiliary class for units which can \"move and fight\""""
+    __slots__ = ()
+
+
+class UnitFactory:
+    """Abstract factory which can create abstract Units"""
+    __slots__ = ()
+
+    def create_unit(self, name, pos):
+        """Create abstract Unit"""
+        # pylint: disable=no-self-use
+        return Unit(name, pos)
+
+
+class Headquarters(Unit, UnitFactory):
+    """Factory which can create units from given list with given color"""
+    __slots__ = ("_color", "_allowed_units_dict", "_allowed_units_names",
+                 "_colored_unit")
+    _char = 'H'
+
+    def __init__(self, name, pos, color, unit_dict):
+        super().__init__(name, pos)
+        self._color = color
+        self._allowed_units_dict = {}
+        self._allowed_units_names = []
+        for key, value in unit_dict.items():
+            self._allowed_units_dict[key] = registry.colored_class(
+                value, color)
+            self._allowed_units_names.append(value.__name__)
+        self._colored_unit = registry.colored_class(Unit, color)
+
+    @property
+    def color(self):
+        # pylint: disable=missing-docstring
+        return self._color
+
+    def create_unit(self, name, pos):
+        # pylint: disable=missing-docstring
+        if self.can_create(name):
+            return self._allowed_units_dict[name](name, pos)
+        return self._colored_unit(name, pos)
+
+    def can_create(self, name):
+        """Check if unit with given name can be created"""
+        return name in self._allowed_units_dict
+
+    def __str__(self):
+        return "Headquarters\n\tColor: #{:X}".format(self.color)
+
+
+class Infantry(MovableBattleUnit):
+    # pylint: disable=missing-docstring
+    __slots__ = ()
+    _char = 'I'
+
+    def __init__(self, name, pos):
+        super().__init__(name, pos)
+        registry.KINDS["infantry"].apply_stats(self)
+
+    def __str__(self):
+        # pylint: disable=no-member
+        return "Infantry\n\tColor: #{:X}\n\tHealth: {}/{}\n\tDamage: {}"\
+            .format(self.color, self.health, self.max_health, self.damage)
+
+
+class Vehicle(MovableBattleUnit):
+    # pylint: disable=missing-docstring
+    __slots__ = ()
+    _char = 'V'
+
+    def __init__(self, name, pos):
+        super().__init__(name, pos)
+        registry.KINDS["vehicle"].apply_stats(self)
+
+    def __str__(self):
+        # pylint: disable=no-member
+        return "Vehicle\n\tColor: #{:X}\n\tHealth: {}/{}\n\tDamage: {}"\
+            .format(self.color, self.health, self.max_health, self.damage)
+
+
+def allowed_units(kind_name):
+    """Get slotted `unit_dict` for `Headquarters` from the registry"""
+    return {name: _CLASSES[name] for name in registry.KINDS[kind_name].spawns}
+
+
+_CLASSES = {"hq": Headquarters, "infantry": Infantry, "vehicle": Vehicle}
+for _name, _cls in _CLASSES.items():
+    registry.register_class(_cls, _name)
+
+for _ordinary, _cls in ((abc.Unit, Unit), (abc.MovableUnit, MovableUnit),
+                        (abc.SelfMovableUnit, SelfMovableUnit),
+                        (abc.BattleUnit, BattleUnit),
+                        (abc.MovableBattleUnit, MovableBattleUnit),
+                        (abc.UnitFactory, UnitFactory),
+                        (units.Headquarters, Headquarters),
+                        (units.Infantry, Infantry), (units.Vehicle, Vehicle)):
+    _ordinary.register(_cls)
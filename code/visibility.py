@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Fog of war: cells seen by units of every player
+
+Every unit sees a disc of cells with radius `vision` of its kind.
+`Visibility` keeps for every color a grid of counters (how many units
+of that color see the cell) split into chunks which are allocated when
+a unit of that color first looks into them.  It listens to changes of
+`GameState` and moves only footprints of units which appeared, moved
+or died, so updates cost O(changed units) and queries O(viewport).
+"""
+from array import array
+import weakref
+
+from .units import registry
+
+
+CHUNK_SIZE = 64
+
+
+def footprint(radius):
+    """List of `(dy, half_width)` rows of disc with given radius"""
+    result = []
+    for dy in range(-radius, radius + 1):
+        # pylint: disable=invalid-name
+        half = 0
+        while (half + 1) ** 2 + dy ** 2 <= radius ** 2:
+            half += 1
+        result.append((dy, half))
+    return result
+
+
+class Visibility:
+    """
+    Reference-counted visibility grids of one `GameState`
+
+    Listeners added by `add_listener` get `visibility_changed(color,
+    x, y)` when a cell becomes visible or hidden for the color.
+    """
+    game_state = None
+    chunk_size = CHUNK_SIZE
+    listeners = None
+    _chunks = None
+    _units = None
+    _cells = None
+    _footprints = None
+
+    def __init__(self, game_state, chunk_size=CHUNK_SIZE):
+        self.game_state = game_state
+        self.chunk_size = chunk_size
+        self.listeners = weakref.WeakSet()
+        self._footprints = {}
+        self.reset()
+        game_state.add_listener(self)
+
+    def add_listener(self, listener):
+        """Report cells which change visibility (while listener lives)"""
+        self.listeners.add(listener)
+
+    def reset(self):
+        """Compute visibility of all units again (called on load)"""
+        # Color -> {(chunk_x, chunk_y): counters}
+        self._chunks = {}
+        # Unit ID -> (color, x, y, radius) which it was counted with
+        self._units = {}
+        # Cell -> set of IDs of counted units in it
+        self._cells = {}
+        for x, y, _ in self.game_state.grid.occupied_cells():
+            # pylint: disable=invalid-name
+            self.cell_changed(x, y)
+        for listener in self.listeners:
+            listener.reset()
+
+    def cell_changed(self, x, y):
+        """Move footprints of units which left or entered the cell"""
+        # pylint: disable=invalid-name
+        present = set(self.game_state.grid.units_at(x, y))
+        counted = self._cells.get((x, y), set())
+        for unit_id in counted - present:
+            color, _, _, radius = self._units.pop(unit_id)
+            self._apply(color, x, y, radius, -1)
+        for unit_id in present - counted:
+            if unit_id in self._units:
+                # The unit moved here, and its old cell isn't reported yet
+                color, old_x, old_y, radius = self._units.pop(unit_id)
+                self._cells[(old_x, old_y)].discard(unit_id)
+                self._apply(color, old_x, old_y, radius, -1)
+            unit = self.game_state.unit_dict[unit_id]
+            radius = registry.kind_of(unit).vision
+            self._units[unit_id] = (unit.color, x, y, radius)
+            self._apply(unit.color, x, y, radius, 1)
+        if present:
+            self._cells[(x, y)] = present
+        else:
+            self._cells.pop((x, y), None)
+
+    def _footprint(self, radius):
+        rows = self._footprints.get(radius)
+        if rows is None:
+            rows = self._footprints[radius] = footprint(radius)
+        return rows
+
+    def _apply(self, color, x, y, radius, delta):
+        """Add `delta` to counters of footprint of unit at `(x, y)`"""
+        # pylint: disable=invalid-name,too-many-arguments,too-many-locals
+        size = self.chunk_size
+        width, height = self.game_state.width, self.game_state.height
+        chunks = self._chunks.setdefault(color, {})
+        changed = []
+        for dy, half in self._footprint(radius):
+            row = y + dy
+            if not 0 <= row < height:
+                continue
+            x1, x2 = max(x - half, 0), min(x + half, width - 1)
+            chunk_y, local_y = divmod(row, size)
+            for chunk_x in range(x1 // size, x2 // size + 1):
+                counters = chunks.get((chunk_x, chunk_y))
+                if counters is None:
+                    counters = chunks[(chunk_x, chunk_y)] = \
+                        array('I', bytes(4 * size * size))
+                start = local_y * size - chunk_x * size
+                for column in range(max(x1, chunk_x * size),
+                                    min(x2, chunk_x * size + size - 1) + 1):
+                    index = start + column
+                    old = counters[index]
+                    counters[index] = old + delta
+                    if old == 0 or old + delta == 0:
+                        changed.append((column, row))
+        if changed and self.listeners:
+            for listener in list(self.listeners):
+                for column, row in changed:
+                    listener.visibility_changed(color, column, row)
+
+    def visible(self, color, x, y):
+        """Whether any unit of the color sees the cell"""
+        # pylint: disable=invalid-name
+        size = self.chunk_size
+        counters = self._chunks.get(color, {}).get((x // size, y // size))
+        return counters is not None \
+            and counters[(y % size) * size + x % size] > 0
+
+    def count(self, color, x, y):
+        """Number of units of the color which see the cell"""
+        # pylint: disable=invalid-name
+        size = self.chunk_size
+        counters = self._chunks.get(color, {}).get((x // size, y // size))
+        if counters is None:
+            return 0
+        return counters[(y % size) * size + x % size]
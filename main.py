@@ -1,9 +1,6 @@
 # -*- coding: utf-8 -*-
 """A simple strategy game."""
-import random
-
 from code.shells.menu import MenuShell
 
 
-random.seed()
 MenuShell().cmdloop()
@@ -1,9 +1,40 @@
 # -*- coding: utf-8 -*-
 # pylint: disable=missing-docstring
+import asyncio
+import io
+import json
+import os
+import random
+import tempfile
 import unittest
 
+from bench import suite
+from code.batch import BatchRunner
 from code import units
-from code.units import abc
+from code.ai import AIPlayer, set_ai
+from code.area import KERNELS
+from code.catalog import Catalog
+from code.chunks import ChunkedGrid
+from code.commit import commit_actions
+from code.engine import (
+    AreaOrder, AttackOrder, Engine, GotoOrder, MoveOrder, OrderError,
+    SpawnOrder, SquadAreaOrder, SquadGotoOrder, SquadMoveOrder)
+from code import jsonload
+from code.journal import Journal, JournalError, decode_action, \
+    encode_action
+from code.orders import OrderBuffer, OrderConflict
+from code.pathing import FlowField, Pathfinder
+from code.render import Renderer
+from code.replay import Recorder, replay, state_digest
+from code.saving import BackgroundSaver
+from code.server import GameServer
+from code.shells.game import Action, GameShell
+from code.shells.menu import MenuShell
+from code.simulate import GameSettings, random_policy, run_games
+from code.spatial import SpatialIndex
+from code.state import GameEncoder, GameState, game_object_hook
+from code.units import abc, registry, slotted
+from code.visibility import Visibility, footprint
 
 
 class TestMethods(unittest.TestCase):
@@ -32,6 +63,1268 @@ class TestMethods(unittest.TestCase):
         self.assertEqual(red_unit.__class__.__name__, "ColoredInfantry")
         self.assertEqual(red_unit.color, RED)
 
+    def test_colored_class_cache(self):
+        state = GameState(4, 5, 5)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "save.json")
+            state.save(filename)
+            state.load(filename)
+            class_count = registry.colored_class_count()
+            state.load(filename)
+            self.assertEqual(registry.colored_class_count(), class_count)
+        spawned = state.unit_dict[0].create_unit("infantry", (1, 1))
+        self.assertIs(
+            type(spawned),
+            registry.colored_class(units.Infantry, state.unit_dict[0].color))
+
+
+class TestSlottedUnits(unittest.TestCase):
+    def test_no_dict(self):
+        red_hq = slotted.Headquarters(
+            "HQ", (0, 0), 0xFF0000, slotted.allowed_units("hq"))
+        vehicle = red_hq.create_unit("vehicle", (1, 1))
+        self.assertFalse(hasattr(vehicle, "__dict__"))
+        self.assertFalse(hasattr(red_hq, "__dict__"))
+        self.assertEqual((vehicle.health, vehicle.char), (200, 'V'))
+        vehicle.position = (2, 1)
+        vehicle.attack(vehicle)
+        self.assertEqual(vehicle.health, 195)
+        self.assertEqual(vehicle.color, 0xFF0000)
+
+    def test_encoding(self):
+        red_hq = slotted.Headquarters(
+            "HQ", (0, 0), 0xFF0000, slotted.allowed_units("hq"))
+        infantry = red_hq.create_unit("infantry", (1, 1))
+        decoded = json.loads(
+            json.dumps([red_hq, infantry], cls=GameEncoder),
+            object_hook=game_object_hook)
+        self.assertIsInstance(decoded[0], units.Headquarters)
+        self.assertIsInstance(decoded[1], units.Infantry)
+        self.assertEqual(decoded[1].color, 0xFF0000)
+
+
+    def test_play_turn(self):
+        state = GameState(2, 6, 6)
+        hq = state.unit_dict[0]
+        state.unit_dict[0] = slotted.Headquarters(
+            "HQ", hq.position, hq.color, slotted.allowed_units("hq"))
+        engine = Engine(state, random.Random(2))
+        engine.submit(SpawnOrder(0, "infantry"))
+        unit_id, (x, y) = engine.commit().spawned[0]
+        self.assertFalse(hasattr(state.unit_dict[unit_id], "__dict__"))
+        engine.commit()
+        stdout = io.StringIO()
+        shell = GameShell(state, stdout=stdout, engine=engine)
+        shell.onecmd("select {} {}".format(x, y))
+        shell.onecmd("move {} 0".format(1 if x < 5 else -1))
+        shell.onecmd("commit")
+        self.assertNotIn("Please select", stdout.getvalue())
+        self.assertEqual(state.unit_dict[unit_id].position,
+                         (x + (1 if x < 5 else -1), y))
+
+
+class TestUnitStore(unittest.TestCase):
+    def test_views(self):
+        state = GameState(2, 5, 5, array_store=True)
+        hq_id = state.game_field[0][0][0]
+        self.assertIsInstance(state.unit_dict[hq_id], units.Headquarters)
+        hq = state.unit_dict[hq_id]
+        unit_id = state.add_unit(hq.create_unit("vehicle", (1, 1)))
+        vehicle = state.unit_dict[unit_id]
+        self.assertIsInstance(vehicle, units.Vehicle)
+        self.assertEqual(vehicle.color, hq.color)
+        self.assertEqual(vehicle.health, 200)
+        vehicle.attack(vehicle)
+        self.assertEqual(state.unit_dict[unit_id].health, 195)
+        state.move_unit(unit_id, (2, 1))
+        self.assertEqual(state.game_field[1][2], (unit_id,))
+        with self.assertRaises(AttributeError):
+            state.game_field[1][2].append(hq_id)
+        state.remove_unit(unit_id)
+        self.assertNotIn(unit_id, state.unit_dict)
+        self.assertEqual(
+            state.add_unit(hq.create_unit("infantry", (1, 0))), unit_id)
+
+    def test_save_load(self):
+        state = GameState(2, 5, 5, array_store=True)
+        hq = state.unit_dict[0]
+        state.add_unit(hq.create_unit("infantry", (1, 1)))
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "save.json")
+            state.save(filename)
+            loaded = GameState(1, 1, 1, array_store=True)
+            loaded.load(filename)
+        self.assertEqual(len(loaded.unit_dict), 3)
+        self.assertEqual(loaded.unit_dict[2].color, hq.color)
+        self.assertEqual(loaded.game_field[1][1], (2,))
+        self.assertTrue(loaded.unit_dict[0].can_create("vehicle"))
+
+    def test_free_list(self):
+        state = GameState(2, 6, 5, array_store=True)
+        hq = state.unit_dict[0]
+        for i in range(6):
+            state.add_unit(hq.create_unit("infantry", (i, 2)))
+        for unit_id in (3, 7, 2):
+            state.remove_unit(unit_id)
+        spawned = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("save.json", "save.json.gz"):
+                filename = os.path.join(tmp, name)
+                state.save(filename)
+                loaded = GameState(1, 1, 1, array_store=True)
+                loaded.load(filename)
+                spawned[name] = [
+                    loaded.add_unit(hq.create_unit("infantry", (0, 4)))
+                    for _ in range(4)]
+        expected = [state.add_unit(hq.create_unit("infantry", (0, 4)))
+                    for _ in range(4)]
+        self.assertEqual(expected, [2, 7, 3, 8])
+        self.assertEqual(spawned, {"save.json": expected,
+                                   "save.json.gz": expected})
+        with self.assertRaises(ValueError):
+            loaded.store.set_free_list([1])
+
+
+class TestBinaryFormat(unittest.TestCase):
+    def test_roundtrip(self):
+        state = GameState(2, 6, 5)
+        hq = state.unit_dict[0]
+        for pos in ((1, 1), (1, 1), (2, 1)):
+            state.add_unit(hq.create_unit("vehicle", pos))
+        state.remove_unit(4)
+        state.current_player = 1
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "save.bin")
+            state.save(filename)
+            loaded = GameState(1, 1, 1)
+            loaded.load(filename)
+            self.assertEqual(loaded.game_field, state.game_field)
+            self.assertEqual((loaded.width, loaded.height), (6, 5))
+            self.assertEqual(loaded.current_player, 1)
+            self.assertEqual(loaded.list_of_player_infos[0].color, hq.color)
+            self.assertIsInstance(loaded.unit_dict[3], units.Vehicle)
+            self.assertEqual(sorted(loaded.unit_dict), [0, 1, 2, 3])
+            loaded.move_unit(2, (0, 1))
+            new_id = loaded.add_unit(
+                loaded.unit_dict[0].create_unit("infantry", (1, 0)))
+            self.assertEqual(new_id, 4)
+            self.assertEqual(loaded.grid.units_at(0, 1), [2])
+            self.assertEqual(loaded.unit_dict[new_id].health, 100)
+            loaded.save(filename)
+            state.load(filename)
+            self.assertEqual(state.game_field, loaded.game_field)
+
+    def test_free_list(self):
+        state = GameState(2, 6, 5, array_store=True)
+        hq = state.unit_dict[0]
+        for i in range(6):
+            state.add_unit(hq.create_unit("infantry", (i, 2)))
+        for unit_id in (3, 5, 2):
+            state.remove_unit(unit_id)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "save.bin")
+            state.save(filename)
+            loaded = GameState(1, 1, 1)
+            loaded.load(filename)
+            spawned = []
+            for game_state in (state, loaded):
+                spawned.append([
+                    game_state.add_unit(hq.create_unit("infantry", (0, 4)))
+                    for _ in range(4)])
+        self.assertEqual(spawned[0], [2, 5, 3, 8])
+        self.assertEqual(spawned[1], spawned[0])
+
+
+class TestEngine(unittest.TestCase):
+    def test_orders(self):
+        state = GameState(2, 5, 5)
+        engine = Engine(state, random.Random(1))
+        with self.assertRaises(OrderError):
+            engine.submit(SpawnOrder(1, "infantry"))
+        with self.assertRaises(OrderError):
+            engine.submit(SpawnOrder(0, "tank"))
+        engine.submit(SpawnOrder(0, "infantry"))
+        result = engine.commit()
+        self.assertEqual(engine.current_player, 1)
+        self.assertEqual(engine.scores(), [2, 1])
+        unit_id, pos = result.spawned[0]
+        engine.commit()
+        with self.assertRaises(OrderError):
+            engine.submit(MoveOrder(unit_id, 2, 0))
+        engine.submit(MoveOrder(unit_id, 1 - pos[0], 0))
+        engine.commit()
+        self.assertEqual(state.unit_dict[unit_id].position.x, 1)
+
+    def test_batch_runs(self):
+        settings = GameSettings(2, 8, 8, 5)
+        results = run_games(range(3), settings, processes=2)
+        self.assertEqual([result.seed for result in results], [0, 1, 2])
+        self.assertEqual(results, run_games(range(3), settings, processes=1))
+
+
+class TestOrderBuffer(unittest.TestCase):
+    def test_index(self):
+        vector = abc.Vector
+        buffer = OrderBuffer([
+            Action("spawn", 0, {"class": "infantry"}),
+            Action("move", 2, {"delta": vector(1, 0)}),
+            Action("attack", 2, {"target_id": 5}),
+            Action("spawn", 0, {"class": "vehicle"}),
+        ])
+        with self.assertRaises(OrderConflict):
+            buffer.append(Action("move", 2, {"delta": vector(0, 1)}))
+        buffer.replace(Action("move", 2, {"delta": vector(0, 1)}))
+        self.assertEqual(buffer.order_of(2, "move").params["delta"],
+                         vector(0, 1))
+        self.assertEqual(buffer.cancel(0), 2)
+        self.assertEqual(list(buffer), [
+            Action("move", 2, {"delta": vector(0, 1)}),
+            Action("attack", 2, {"target_id": 5})])
+        self.assertEqual(buffer.pop(), Action("attack", 2, {"target_id": 5}))
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.orders_of(0), [])
+
+    def test_compaction(self):
+        buffer = OrderBuffer()
+        for unit_id in range(1000):
+            buffer.append(Action("attack", unit_id, {"target_id": 1}), 10)
+        for unit_id in range(0, 1000, 3):
+            buffer.cancel(unit_id)
+        for unit_id in range(1, 1000, 3):
+            buffer.cancel(unit_id)
+        self.assertLess(len(buffer.kinds), 1000)
+        self.assertEqual([action.unit_id for action in buffer],
+                         list(range(2, 1000, 3)))
+        self.assertEqual(buffer.projected_damage(1), 10 * 333)
+
+    def test_engine_conflicts(self):
+        game_state = GameState(2, 10, 10, seed=7)
+        hq = game_state.unit_dict[0]
+        enemy = game_state.unit_dict[1]
+        game_state.add_unit(hq.create_unit("vehicle", (5, 5)))
+        game_state.add_unit(hq.create_unit("vehicle", (5, 6)))
+        game_state.add_unit(enemy.create_unit("infantry", (6, 5)))
+        game_state.add_unit(hq.create_unit("infantry", (7, 6)))
+        game_state.unit_dict[4].health = 8
+        engine = Engine(game_state)
+        engine.submit(MoveOrder(2, 1, 0))
+        with self.assertRaises(OrderError):
+            engine.submit(MoveOrder(2, 0, 1))
+        engine.submit(MoveOrder(2, 0, 1), replace=True)
+        for _ in range(2):
+            engine.submit(AttackOrder(2, 4), replace=True)
+        with self.assertRaises(OrderError):
+            engine.submit(AttackOrder(2, 4))
+        engine.submit(AttackOrder(3, 4))
+        # Two vehicles kill the target, so another attack would be wasted
+        self.assertEqual(engine.action_queue.projected_damage(4), 10)
+        with self.assertRaises(OrderError):
+            engine.submit(AttackOrder(5, 4))
+        self.assertEqual(engine.cancel(2), 2)
+        self.assertEqual(list(engine.action_queue),
+                         [Action("attack", 3, {"target_id": 4})])
+
+
+class TestArea(unittest.TestCase):
+    def test_batched_damage(self):
+        state = GameState(2, 12, 12, seed=4)
+        hq, enemy = state.unit_dict[0], state.unit_dict[1]
+        attackers = [state.add_unit(hq.create_unit(kind, (3, 3)))
+                     for kind in ("infantry", "vehicle", "infantry")]
+        # Stack of three units and units around it
+        for pos in [(6, 6)] * 3 + [(7, 6), (6, 8), (5, 5), (9, 9)]:
+            state.add_unit(enemy.create_unit("infantry", pos))
+        healths = {unit_id: unit.health
+                   for unit_id, unit in state.unit_dict.items()
+                   if isinstance(unit, abc.BattleUnit)}
+        expected = {}
+        for attacker_id in attackers:
+            attacker = state.unit_dict[attacker_id]
+            for dx, dy, weight in KERNELS[
+                    registry.kind_of(attacker).area].weights:
+                for unit_id in state.grid.units_at(6 + dx, 6 + dy):
+                    expected[(unit_id, 6 + dx, 6 + dy)] = expected.get(
+                        (unit_id, 6 + dx, 6 + dy), 0) \
+                        + attacker.damage * weight
+        engine = Engine(state)
+        for attacker_id in attackers:
+            engine.submit(AreaOrder(attacker_id, 6, 6))
+        with self.assertRaises(OrderError):
+            engine.submit(AttackOrder(attackers[0], 1))
+        with self.assertRaises(OrderError):
+            engine.submit(AreaOrder(2, 7, 7), replace=True)
+        self.assertEqual(str(engine.action_queue.order_of(2, "attack")),
+                         "Unit 2: Attack area around (6, 6)")
+        engine.commit()
+        for (unit_id, _, _), total in expected.items():
+            self.assertEqual(state.unit_dict[unit_id].health,
+                             healths[unit_id] - total // 100)
+        self.assertEqual(state.unit_dict[11].health, 100)
+        self.assertEqual(len([1 for key in expected if key[1:] == (6, 6)]),
+                         3)
+
+    def test_kills(self):
+        state = GameState(2, 12, 12, seed=4)
+        hq, enemy = state.unit_dict[0], state.unit_dict[1]
+        attacker = state.add_unit(hq.create_unit("vehicle", (3, 3)))
+        target = state.add_unit(enemy.create_unit("infantry", (4, 4)))
+        state.unit_dict[target].health = 5
+        action = Action("area", attacker, {"center": abc.Vector(4, 4)})
+        self.assertEqual(decode_action(encode_action(action)), action)
+        result = commit_actions(state, OrderBuffer([
+            action, Action("spawn", 0, {"class": "infantry"})]))
+        # Area kills come after the spawn, so its ID isn't reused
+        self.assertEqual(result.killed, [(target, (4, 4))])
+        self.assertEqual(result.spawned[0][0], 4)
+
+
+    def test_kind_defaults(self):
+        kind = registry.UnitKind("scout", units.Infantry, 'S', {}, ())
+        self.assertEqual((kind.vision, kind.area), (3, None))
+        self.assertIsNone(registry.KINDS["hq"].area)
+        self.assertEqual(registry.KINDS["vehicle"].area, "shell")
+
+
+class TestSquads(unittest.TestCase):
+    def setUp(self):
+        self.state = GameState(2, 12, 12, seed=4)
+        hq = self.state.unit_dict[0]
+        self.members = [self.state.add_unit(hq.create_unit("infantry", pos))
+                        for pos in ((3, 3), (4, 3), (3, 4))]
+        self.engine = Engine(self.state)
+        self.squad_id = self.engine.create_squad(self.members)
+
+    def positions(self):
+        return [tuple(self.state.unit_dict[unit_id].position)
+                for unit_id in self.members]
+
+    def test_formation(self):
+        engine = self.engine
+        self.assertEqual(self.state.squad_dict[self.squad_id],
+                         [[2, 0, 0], [3, 1, 0], [4, 0, 1]])
+        with self.assertRaises(OrderError):
+            engine.create_squad([1])
+        engine.submit(MoveOrder(self.members[2], 0, 1))
+        engine.submit(SquadMoveOrder(self.squad_id, 1, 1))
+        with self.assertRaises(OrderError):
+            engine.submit(SquadMoveOrder(self.squad_id, 2, 0))
+        engine.commit()
+        # The third member keeps its own order
+        self.assertEqual(self.positions(), [(4, 4), (5, 4), (3, 5)])
+        with self.assertRaises(OrderError):
+            engine.submit(SquadMoveOrder(self.squad_id, 1, 1))
+        engine.commit()
+        engine.submit(SquadGotoOrder(self.squad_id, 8, 8))
+        for _ in range(10):
+            engine.commit()
+        self.assertEqual(self.positions(), [(8, 8), (9, 8), (8, 9)])
+
+    def test_area_and_deaths(self):
+        state, engine = self.state, self.engine
+        enemy = state.unit_dict[1]
+        target = state.add_unit(enemy.create_unit("infantry", (6, 3)))
+        state.unit_dict[self.members[1]].health = 1
+        health = state.unit_dict[target].health
+        engine.submit(SquadAreaOrder(self.squad_id, 6, 3))
+        engine.commit()
+        # Center of the first member's grenade, edges of two others
+        self.assertEqual(state.unit_dict[target].health, health - 2 * (
+            state.unit_dict[self.members[0]].damage))
+        state.unit_dict[target].health = 1
+        engine.submit(MoveOrder(target, -1, 0))
+        engine.commit()
+        engine.submit(SquadAreaOrder(self.squad_id, 4, 3))
+        queued = engine.squad_orders.copy()
+        engine.commit()
+        self.assertEqual(queued, {(self.squad_id, "area"): (4, 3)})
+        # Grenades of the squad killed its member and the target
+        self.assertNotIn(target, state.unit_dict)
+        self.assertEqual(engine.squads.squad_of(self.members[1]), None)
+        self.assertEqual([member[0] for member in
+                          state.squad_dict[self.squad_id]],
+                         [self.members[0], self.members[2]])
+        engine.commit()
+        self.assertEqual(engine.disband_squad(self.squad_id), 2)
+        self.assertEqual(state.squad_dict, {})
+
+    def test_shell_and_load(self):
+        stdout = io.StringIO()
+        shell = GameShell(self.state, stdout=stdout, engine=self.engine)
+        shell.onecmd("squad new 4 4 3 3")
+        shell.onecmd("squad list")
+        shell.onecmd("squad move 0 0 1")
+        shell.onecmd("status")
+        shell.onecmd("squad cancel 0")
+        shell.onecmd("squad move 0 1")
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            "Squad 0: 3 unit(s)", "Squad 0: 3 unit(s)",
+            "Squad 0: Move by (0, 1)", "Cancelled 1 order(s).",
+            "Please specify 3 integers."])
+        # Index follows `squad_dict` replaced by loading
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "squads.json")
+            self.state.save(path)
+            self.state.load(path)
+        self.assertEqual(self.engine.squads.squad_of(self.members[0]), 0)
+
+
+class TestPathing(unittest.TestCase):
+    def test_flow_field(self):
+        wall = [(2, y) for y in range(4)]
+        field = FlowField(5, 5, (4, 0), wall)
+        self.assertEqual(field.distance_at(2, 0), -1)
+        self.assertEqual(field.distance_at(0, 0), 8)
+        self.assertEqual(field.step(1, 3), (1, 1))
+        self.assertEqual(field.step(4, 0), (0, 0))
+        self.assertIsNone(FlowField(3, 1, (0, 0), [(1, 0)]).step(2, 0))
+
+    def test_shared_field(self):
+        game_state = GameState(2, 20, 20, seed=6)
+        engine = Engine(game_state)
+        hq = game_state.unit_dict[0]
+        for i in range(10):
+            game_state.add_unit(hq.create_unit("infantry", (i, 5)))
+        for unit_id in range(2, 12):
+            engine.submit(GotoOrder(unit_id, 12, 15))
+        engine.commit()
+        # All ten units share one field
+        self.assertEqual(engine.pathfinder.computed, 1)
+        for _ in range(2 * 20):
+            engine.commit()
+        self.assertEqual(engine.destinations, {})
+        for unit_id in range(2, 12):
+            self.assertEqual(
+                tuple(game_state.unit_dict[unit_id].position), (12, 15))
+        with self.assertRaises(OrderError):
+            engine.submit(GotoOrder(2, 20, 0))
+
+    def test_kept_fields(self):
+        game_state = GameState(2, 20, 20, seed=6)
+        pathfinder = Engine(game_state).pathfinder
+        own, other = game_state.unit_dict[0], game_state.unit_dict[1]
+        unit_id = game_state.add_unit(own.create_unit("infantry", (5, 5)))
+        enemy_id = game_state.add_unit(
+            other.create_unit("infantry", (5, 10)))
+        field = pathfinder.field((12, 15), own.color)
+        other_field = pathfinder.field((12, 15), other.color)
+        # Own unit doesn't block own field, but frees and blocks cells
+        # of the other color
+        game_state.move_unit(unit_id, (6, 6))
+        self.assertIs(pathfinder.field((12, 15), own.color), field)
+        self.assertIsNot(pathfinder.field((12, 15), other.color),
+                         other_field)
+        self.assertEqual(pathfinder.computed, 3)
+        # Cell of enemy stays blocked when own unit joins it
+        game_state.move_unit(unit_id, (5, 10))
+        self.assertIs(pathfinder.field((12, 15), own.color), field)
+        game_state.move_unit(enemy_id, (7, 7))
+        self.assertIsNot(pathfinder.field((12, 15), own.color), field)
+        fresh = Pathfinder(game_state)
+        for color in (own.color, other.color):
+            self.assertEqual(pathfinder.field((12, 15), color).distance,
+                             fresh.field((12, 15), color).distance)
+
+
+class TestAI(unittest.TestCase):
+    def test_turn(self):
+        game_state = suite.make_state(suite.Size(30, 30, 200), seed=4)
+        engine = Engine(game_state)
+        count = AIPlayer(budget=10).play_turn(engine)
+        own = engine.units_of(0)
+        self.assertEqual(count, len(engine.action_queue))
+        self.assertEqual(
+            count, len({action.unit_id for action in engine.action_queue}))
+        self.assertLessEqual(count, len(own))
+        self.assertIn(Action("spawn", 0, {"class": "vehicle"}),
+                      engine.action_queue)
+        engine.commit()
+        self.assertGreater(AIPlayer(budget=0).play_turn(engine), 0)
+
+    def test_shell(self):
+        game_state = GameState(2, 10, 10, seed=5)
+        set_ai(game_state, 1, True)
+        shell = GameShell(game_state, stdout=io.StringIO())
+        shell.onecmd("commit")
+        self.assertEqual(game_state.current_player, 0)
+        self.assertEqual(len(game_state.unit_dict), 3)
+        self.assertIn("Player 1 (AI)", shell.stdout.getvalue())
+
+
+async def server_client(port, lines):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    replies = []
+    for line in lines:
+        writer.write((line + "\n").encode())
+        reply = []
+        while True:
+            reply_line = (await reader.readline()).decode()
+            if reply_line == ".\n":
+                break
+            reply.append(reply_line)
+        replies.append("".join(reply))
+    writer.close()
+    return replies
+
+
+def run_async(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestFork(unittest.TestCase):
+    @staticmethod
+    def play(game_state, seed):
+        engine = Engine(game_state, random.Random(seed))
+        for _ in range(6):
+            AIPlayer(budget=10).play_turn(engine)
+            engine.commit()
+        # Bottom units of stacks leave and come back on top
+        for x, y, ids in list(game_state.grid.occupied_cells()):
+            if len(ids) > 1 and isinstance(game_state.unit_dict[ids[0]],
+                                           abc.MovableUnit):
+                game_state.move_unit(ids[0], (x, (y + 1) % 6))
+                game_state.move_unit(ids[0], (x, y))
+
+    def test_fork_and_promote(self):
+        # The second state has many cells with stacked units
+        sources = (suite.make_state(suite.Size(12, 12, 40), seed=9),
+                   suite.make_state(suite.Size(6, 6, 80), seed=9))
+        for source, array_store in [(source, array_store)
+                                    for source in sources
+                                    for array_store in (False, True)]:
+            with tempfile.TemporaryDirectory() as directory:
+                filename = os.path.join(directory, "source.json")
+                source.save(filename)
+                parent = GameState(1, 1, 1, array_store=array_store)
+                parent.load(filename)
+                expected = GameState(1, 1, 1, array_store=array_store)
+                expected.load(filename)
+            self.play(expected, 10)
+
+            fork = parent.fork()
+            before = parent.game_field
+            self.play(fork, 10)
+            self.assertEqual(parent.game_field, before)
+            nested = fork.fork()
+            self.play(nested, 11)
+            nested.discard()
+            self.assertEqual(fork.game_field, expected.game_field)
+            self.assertEqual(list(fork.grid.cells_in_rect(2, 3, 9, 8)),
+                             list(expected.grid.cells_in_rect(2, 3, 9, 8)))
+            fork.promote()
+            self.assertEqual(parent.game_field, expected.game_field)
+            self.assertEqual(parent.current_player, expected.current_player)
+            for unit_id, unit in expected.unit_dict.items():
+                self.assertEqual(str(parent.unit_dict[unit_id]), str(unit))
+            self.assertEqual(len(parent.unit_dict), len(expected.unit_dict))
+            self.assertEqual(state_digest(parent), state_digest(expected))
+            for x, y, ids in expected.grid.occupied_cells():
+                self.assertEqual(parent.grid.units_at(x, y), ids)
+            hq = expected.unit_dict[0]
+            for _ in range(3):
+                self.assertEqual(
+                    parent.add_unit(hq.create_unit("infantry", (0, 0))),
+                    expected.add_unit(hq.create_unit("infantry", (0, 0))))
+
+
+class TestJsonLoad(unittest.TestCase):
+    def test_chunks(self):
+        state = GameState(2, 30, 30, seed=5)
+        hq = state.unit_dict[0]
+        for i in range(300):
+            state.add_unit(hq.create_unit(
+                ("infantry", "vehicle")[i % 2], (i % 30, i // 30 + 1)))
+        state.squad_dict = {1: [2, 3]}
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "big.json")
+            state.save(filename)
+            with open(filename, encoding="utf-8") as file:
+                data = json.load(file, object_hook=game_object_hook)
+            for processes in (0, 2):
+                expected = GameState(1, 1, 1, array_store=processes == 2)
+                expected.load_json_data(data)
+                loaded = GameState(1, 1, 1, array_store=processes == 2)
+                progress = []
+                jsonload.load(
+                    loaded, filename, processes, chunk_size=500,
+                    progress=lambda done, size: progress.append(done))
+                self.assertEqual(state_digest(loaded), state_digest(expected))
+                self.assertEqual(loaded.squad_dict, {1: [2, 3]})
+                self.assertGreater(len(progress), 10)
+                self.assertEqual(progress, sorted(progress))
+                self.assertEqual(progress[-1], os.path.getsize(filename))
+
+
+class TestReplay(unittest.TestCase):
+    def test_seeded_state(self):
+        first, second = GameState(4, 8, 8, seed=3), GameState(4, 8, 8, seed=3)
+        self.assertEqual(
+            [info.color for info in first.list_of_player_infos],
+            [info.color for info in second.list_of_player_infos])
+        with tempfile.TemporaryDirectory() as directory:
+            for suffix in (".json", ".bin"):
+                filename = os.path.join(directory, "seeded" + suffix)
+                first.rng.random()
+                first.save(filename)
+                second.load(filename)
+                self.assertEqual(first.rng.random(), second.rng.random())
+
+    def test_replay(self):
+        for array_store in (False, True):
+            game_state = GameState(2, 12, 12, array_store=array_store,
+                                   seed=12)
+            engine = Engine(game_state)
+            with tempfile.TemporaryDirectory() as directory:
+                filename = os.path.join(directory, "game.log")
+                engine.recorder = Recorder(filename, game_state)
+                policy_rng = random.Random(0)
+                for _ in range(30):
+                    random_policy(engine, policy_rng)
+                    engine.commit()
+                engine.recorder.finish(game_state)
+                result = replay(filename)
+                self.assertEqual(result.turns, 30)
+                self.assertEqual(result.digest, result.expected)
+                self.assertEqual(result.game_state.game_field,
+                                 game_state.game_field)
+
+                with open(filename, encoding="utf-8") as file:
+                    lines = file.readlines()
+                del lines[5]
+                with open(filename, "w", encoding="utf-8") as file:
+                    file.writelines(lines)
+                result = replay(filename)
+                self.assertNotEqual(result.digest, result.expected)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_stats(self):
+        game_state = GameState(2, 10, 10, seed=13)
+        hq_pos = game_state.unit_dict[0].position
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "stats.json")
+            script = "\n".join([
+                "show 0 0 9 9", "stats on", "show 0 0 9 9",
+                "select {} {}".format(*hq_pos), "spawn infantry",
+                "spawn vehicle", "commit", "stats profile show",
+                "show 0 0 5 5", "stats export " + filename, "stats", "menu",
+            ]) + "\n"
+            shell = GameShell(game_state, stdin=io.StringIO(script),
+                              stdout=io.StringIO())
+            shell.use_rawinput = False
+            shell.cmdloop()
+            with open(filename, encoding="utf-8") as file:
+                data = json.load(file)
+        self.assertEqual(data["latencies"]["show"]["count"], 2)
+        self.assertEqual(sum(data["latencies"]["show"]["buckets"]), 2)
+        self.assertEqual(data["counters"]["commits"], 1)
+        self.assertEqual(data["counters"]["actions.spawn"], 2)
+        self.assertEqual(data["counters"]["units.spawned"], 2)
+        self.assertIn(data["counters"]["cells.touched"], (1, 2))
+        self.assertIn("viewport", data["profiles"]["show"])
+        self.assertIn("engine.commit", shell.stdout.getvalue())
+
+
+class TestBatch(unittest.TestCase):
+    def test_script(self):
+        script = """
+# comment and empty lines are skipped
+touch batch
+start
+select 0 0
+spawn infantry
+commit
+show 0 0 19 19
+status
+menu
+save
+load batch
+start
+inspect 19 19
+bogus
+abort
+ls
+"""
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                output = io.StringIO()
+                runner = BatchRunner(output, discard=["show"], block_size=16)
+                runner.run(io.StringIO(script))
+                state = GameState(1, 1, 1)
+                state.load("saves/batch.json")
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(runner.commands, 13)
+        self.assertEqual(state.unit_count, 3)
+        self.assertNotIn("_ _", output.getvalue())
+        self.assertIn("Unit 1 - Headquarters", output.getvalue())
+        self.assertIn("*** Unknown syntax: bogus", output.getvalue())
+        with self.assertRaises(ValueError):
+            BatchRunner(discard=["commit"])
+
+
+class TestSaving(unittest.TestCase):
+    def test_compressed(self):
+        state = GameState(2, 10, 10, seed=3)
+        state.add_unit(state.unit_dict[0].create_unit("infantry", (1, 1)))
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ("game.gz", "game.xz"):
+                filename = os.path.join(directory, name)
+                state.save(filename)
+                with open(filename, "rb") as file:
+                    self.assertNotEqual(file.read(1), b"[")
+                loaded = GameState(1, 1, 1)
+                loaded.load(filename)
+                self.assertEqual(state_digest(loaded), state_digest(state))
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ["game.gz", "game.xz"])
+
+    def test_background(self):
+        state = GameState(2, 10, 10, seed=3)
+        unit_id = state.add_unit(
+            state.unit_dict[0].create_unit("infantry", (1, 1)))
+        expected = state_digest(state)
+        saver = BackgroundSaver(interval=2)
+        results = []
+        saver.listeners.append(
+            lambda snapshot, name, error: results.append((name, error)))
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "game.gz")
+            self.assertTrue(saver.save(state, filename))
+            # Changes after the snapshot don't get into the save
+            state.move_unit(unit_id, [2, 2])
+            state.unit_dict[unit_id].health = 1
+            set_ai(state, 1, True)
+            saver.wait()
+            loaded = GameState(1, 1, 1)
+            loaded.load(filename)
+            self.assertEqual(state_digest(loaded), expected)
+            self.assertFalse(loaded.list_of_player_infos[1].AI)
+
+            saver.filename = os.path.join(directory, "auto.json")
+            self.assertFalse(saver.committed(state))
+            self.assertTrue(saver.committed(state))
+            self.assertEqual(saver.wait(), 1)
+            loaded.load(saver.filename)
+            self.assertEqual(loaded.unit_dict[unit_id].health, 1)
+        self.assertEqual(results, [(filename, None), (saver.filename, None)])
+
+
+class TestCatalog(unittest.TestCase):
+    def test_menu(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                output = io.StringIO()
+                menu = MenuShell(stdout=output)
+                for name in ("alpha", "beta 4 4", "gamma.bin"):
+                    menu.onecmd("touch " + name)
+                state = menu.game_state
+                state.add_unit(
+                    state.unit_dict[0].create_unit("infantry", (1, 1)))
+                menu.onecmd("save")
+                menu.onecmd("rm beta")
+                self.assertEqual(
+                    [entry.name for entry in menu.catalog.entries(
+                        "units", descending=True)], ["gamma.bin", "alpha"])
+                self.assertEqual(menu.catalog.get("saves/gamma.bin").units, 3)
+                output.truncate(0)
+                menu.onecmd("ls -f json")
+                menu.onecmd("ls -p 3")
+                menu.onecmd("ls -s size a*")
+                self.assertEqual(output.getvalue(), "alpha\nalpha\n")
+                self.assertTrue(menu.catalog.validate("saves/alpha.json"))
+                with open("saves/alpha.json", "a", encoding="utf-8") as file:
+                    file.write("\n")
+                self.assertFalse(menu.catalog.validate("saves/alpha.json"))
+                menu.onecmd("load alpha")
+                self.assertTrue(menu.catalog.validate("saves/alpha.json"))
+                menu.catalog.close()
+                os.remove("saves/catalog.sqlite3")
+                self.assertEqual(Catalog().rescan(), 2)
+            finally:
+                os.chdir(cwd)
+
+    def test_journal(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                menu = MenuShell(stdout=io.StringIO())
+                menu.onecmd("touch delta")
+                menu.onecmd("journal on")
+                state = menu.game_state
+                # Every commit folds the journal into the save file
+                state.journal.threshold = 0
+                engine = Engine(state)
+                for player in (0, 1):
+                    engine.submit(SpawnOrder(player, "infantry"))
+                    engine.commit()
+                menu.onecmd("save")
+                self.assertTrue(menu.catalog.validate("saves/delta.json"))
+                self.assertEqual(menu.catalog.get("saves/delta.json").units, 4)
+                state.journal.threshold = 1 << 20
+                engine.submit(SpawnOrder(0, "infantry"))
+                engine.commit()
+                menu.onecmd("journal off")
+                self.assertTrue(menu.catalog.validate("saves/delta.json"))
+                self.assertEqual(menu.catalog.get("saves/delta.json").units, 5)
+                menu.catalog.close()
+            finally:
+                os.chdir(cwd)
+
+
+class TestServer(unittest.TestCase):
+    def test_sessions(self):
+        async def scenario(directory):
+            server = GameServer(directory)
+            port = (await server.start()).sockets[0].getsockname()[1]
+            await asyncio.gather(*(
+                server_client(port, ["new game{} 2 10 10".format(i)])
+                for i in range(100)))
+
+            async def play(i):
+                other = await server_client(port, [
+                    "join game{} 1".format(i),
+                    '{"order": "spawn", "unit_id": 1,'
+                    ' "class_name": "infantry"}',
+                    "commit"])
+                own = await server_client(port, [
+                    "join game{} 0".format(i),
+                    '{"order": "spawn", "unit_id": 0,'
+                    ' "class_name": "infantry"}',
+                    "commit", "save game{}".format(i),
+                    "save game{}.gz".format(i), "quit"])
+                return own, other
+            replies = await asyncio.gather(*(play(i) for i in range(100)))
+            server.server.close()
+            await server.server.wait_closed()
+            return server, replies
+
+        with tempfile.TemporaryDirectory() as directory:
+            server, replies = run_async(scenario(directory))
+            self.assertEqual(len(server.sessions), 100)
+            own, other = replies[0]
+            self.assertEqual(own[1], '{"ok": true}\n')
+            self.assertIn("Not your turn", other[1])
+            self.assertEqual(other[2], "It's turn of player 0.\n")
+            self.assertEqual(own[3], "Saved.\n")
+            loaded = GameState(1, 1, 1)
+            for name in ("game0.json", "game0.gz"):
+                loaded.load(os.path.join(directory, name))
+                self.assertEqual(loaded.unit_count, 3)
+
+    def test_fog_of_clients(self):
+        async def scenario():
+            server = GameServer()
+            port = (await server.start()).sockets[0].getsockname()[1]
+            await server_client(port, ["new fog 2 10 10", "quit"])
+            other = await server_client(port, [
+                "join fog 1", "inspect 0 0", "inspect 9 9", "fog off",
+                "show 0 0 1 0", "quit"])
+            own = await server_client(port, [
+                "join fog 0", "show 0 0 1 0", "quit"])
+            server.server.close()
+            await server.server.wait_closed()
+            return own, other
+
+        own, other = run_async(scenario())
+        # Player 1 looks during the turn of player 0
+        self.assertEqual(other[1], "Your units don't see this cell.\n")
+        self.assertIn("Headquarters", other[2])
+        self.assertIn("always on", other[3])
+        self.assertEqual(other[4], "? ?\n")
+        self.assertNotIn("?", own[1])
+
+    def test_errors(self):
+        async def scenario(directory):
+            server = GameServer(directory)
+            port = (await server.start()).sockets[0].getsockname()[1]
+            replies = await server_client(port, [
+                "x" * 100000, "open bad", "x" * 300000, "new ok", "quit"])
+            server.server.close()
+            await server.server.wait_closed()
+            return replies
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "bad.json"), "w") as file:
+                file.write('[1, {"width": 3}, [], {}, {}]')
+            replies = run_async(scenario(directory))
+        self.assertEqual(replies[0], "Error: Line is too long.\n")
+        self.assertEqual(replies[1], "Error: Malformed save file.\n")
+        self.assertEqual(replies[2], "Error: Line is too long.\n")
+        self.assertEqual(replies[3], "Created session ok.\n")
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_compare(self):
+        baseline = {"results": {
+            "a": {"seconds": 1.0, "peak_bytes": 100},
+            "b": {"seconds": 1.0, "peak_bytes": 100},
+            "d": {"seconds": 1.0}}}
+        results = {"results": {
+            "a": {"seconds": 1.2, "peak_bytes": 150},
+            "b": {"seconds": 1.4, "peak_bytes": 105},
+            "c": {"seconds": 9.0, "peak_bytes": 900},
+            "d": {"seconds": 1.0, "peak_bytes": 900}}}
+        self.assertEqual(suite.compare(results, baseline, 0.25),
+                         [("b", "seconds", 1.0, 1.4)])
+        self.assertEqual(suite.compare(results, baseline, 0.25, 0.1),
+                         [("a", "peak_bytes", 100, 150),
+                          ("b", "seconds", 1.0, 1.4)])
+
+    def test_commit_fresh_state(self):
+        prepare, run = suite.case_commit(suite.Size(20, 20, 50), None)
+        first, second = prepare(), prepare()
+        self.assertIsNot(first[0].game_state, second[0].game_state)
+        run(first)
+        run(second)
+        self.assertEqual(
+            {unit_id: unit.position
+             for unit_id, unit in first[0].game_state.unit_dict.items()},
+            {unit_id: unit.position
+             for unit_id, unit in second[0].game_state.unit_dict.items()})
+        result = suite.measure(suite.case_commit, suite.Size(20, 20, 50),
+                               2, None)
+        self.assertGreater(result["peak_bytes"], 0)
+
+    def test_synthetic_state(self):
+        state = suite.make_state(suite.Size(30, 20, 100))
+        self.assertEqual(len(state.unit_dict), 102)
+        self.assertEqual(len(state.grid), 102)
+
+
+class TestRenderer(unittest.TestCase):
+    @staticmethod
+    def naive_show(state, player, x1, y1, x2, y2):
+        own_color = state.list_of_player_infos[player].color
+        lines = []
+        for row in state.game_field[y1:y2 + 1]:
+            chars = []
+            for cell in row[x1:x2 + 1]:
+                if not cell:
+                    chars.append('_')
+                elif len(cell) > 1:
+                    chars.append('M')
+                elif state.unit_dict[cell[0]].color == own_color:
+                    chars.append(state.unit_dict[cell[0]].char.upper())
+                else:
+                    chars.append(state.unit_dict[cell[0]].char.lower())
+            lines.append(' '.join(chars) + '\n')
+        return ''.join(lines)
+
+    def test_dirty_cells(self):
+        state = suite.make_state(suite.Size(23, 19, 60), seed=5)
+        renderer = Renderer(state, 1, tile_size=8)
+        rng = random.Random(2)
+        for _ in range(4):
+            rect = (rng.randrange(10), rng.randrange(10),
+                    rng.randrange(10, 23), rng.randrange(10, 19))
+            self.assertEqual(renderer.viewport(*rect),
+                             self.naive_show(state, 1, *rect))
+            for unit_id in rng.sample(sorted(state.unit_dict)[2:], 10):
+                unit = state.unit_dict[unit_id]
+                state.move_unit(unit_id, (
+                    min(unit.position.x + 1, 22), unit.position.y))
+            state.remove_unit(rng.choice(sorted(state.unit_dict)[2:]))
+        self.assertEqual(renderer.viewport(0, 0, 22, 18),
+                         self.naive_show(state, 1, 0, 0, 22, 18))
+
+
+class TestVisibility(unittest.TestCase):
+    @staticmethod
+    def naive_counts(state):
+        counts = {}
+        for unit in state.unit_dict.values():
+            x, y = unit.position
+            for dy, half in footprint(registry.kind_of(unit).vision):
+                for dx in range(-half, half + 1):
+                    key = (unit.color, x + dx, y + dy)
+                    if 0 <= key[1] < state.width \
+                            and 0 <= key[2] < state.height:
+                        counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def test_incremental(self):
+        state = suite.make_state(suite.Size(40, 30, 80), seed=7)
+        visibility = Visibility(state, chunk_size=16)
+        renderer = Renderer(state, 0, tile_size=8, visibility=visibility)
+        renderer.viewport(0, 0, 39, 29)
+        colors = [info.color for info in state.list_of_player_infos]
+        rng = random.Random(3)
+        for _ in range(5):
+            for unit_id in rng.sample(sorted(state.unit_dict)[2:], 10):
+                unit = state.unit_dict[unit_id]
+                state.move_unit(unit_id, (
+                    min(unit.position.x + 3, 39), unit.position.y))
+            state.remove_unit(rng.choice(sorted(state.unit_dict)[2:]))
+            state.add_unit(state.unit_dict[1].create_unit(
+                "vehicle", (rng.randrange(40), rng.randrange(30))))
+        counts = self.naive_counts(state)
+        for color in colors:
+            for y in range(30):
+                for x in range(40):
+                    self.assertEqual(visibility.count(color, x, y),
+                                     counts.get((color, x, y), 0))
+        lines = TestRenderer.naive_show(state, 0, 0, 0, 39, 29).split('\n')
+        expected = [
+            ' '.join(char if (colors[0], x, y) in counts else '?'
+                     for x, char in enumerate(line.split(' '))) + '\n'
+            for y, line in enumerate(lines[:-1])]
+        self.assertEqual(renderer.viewport(0, 0, 39, 29), ''.join(expected))
+
+    def test_shell(self):
+        state = GameState(2, 20, 20, seed=1)
+        shell = GameShell(state, stdout=io.StringIO())
+        shell.onecmd("inspect 19 19")
+        shell.onecmd("fog off")
+        shell.onecmd("inspect 19 19")
+        self.assertEqual(shell.stdout.getvalue(),
+                         "Your units don't see this cell.\n"
+                         "Unit 1 - " + str(state.unit_dict[1]) + "\n")
+
+
+class TestJournal(unittest.TestCase):
+    def test_replay_and_compaction(self):
+        state = GameState(2, 5, 5, seed=3)
+        vector = abc.Vector
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "save.json")
+            state.save(filename)
+            state.journal = Journal(filename)
+            shell = GameShell(state, stdout=io.StringIO())
+            shell.action_queue.extend([
+                Action("spawn", 0, {"class": "infantry"}),
+                Action("spawn", 0, {"class": "vehicle"})])
+            shell.do_commit("")
+            shell.action_queue.append(Action("spawn", 1, {"class": "vehicle"}))
+            shell.do_commit("")
+            shell.action_queue.extend([
+                Action("move", 2, {"delta": vector(1, 1)}),
+                Action("attack", 3, {"target_id": 2})])
+            shell.do_commit("")
+            self.assertTrue(os.path.exists(filename + ".journal"))
+
+            loaded = GameState(1, 1, 1)
+            loaded.load(filename)
+            self.assertEqual(loaded.game_field, state.game_field)
+            self.assertEqual(loaded.unit_dict[2].health, 95)
+            self.assertEqual(loaded.current_player, 1)
+
+            state.journal.threshold = 0
+            shell.do_commit("")
+            self.assertFalse(os.path.exists(filename + ".journal"))
+            loaded.load(filename)
+            self.assertEqual(loaded.game_field, state.game_field)
+
+    def test_spawn_after_deaths(self):
+        state = GameState(2, 8, 8, array_store=True, seed=3)
+        hq = state.unit_dict[0]
+        for i in range(5):
+            state.add_unit(hq.create_unit("infantry", (i + 1, 4)))
+        state.remove_unit(3)
+        state.remove_unit(5)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "save.bin")
+            state.save(filename)
+            state.journal = Journal(filename)
+            shell = GameShell(state, stdout=io.StringIO())
+            shell.action_queue.append(Action("spawn", 0, {"class": "vehicle"}))
+            shell.do_commit("")
+            shell.do_commit("")
+            self.assertIsInstance(state.unit_dict[5], units.Vehicle)
+            shell.action_queue.append(
+                Action("move", 5, {"delta": abc.Vector(1, 1)}))
+            shell.do_commit("")
+            loaded = GameState(1, 1, 1)
+            loaded.load(filename)
+            self.assertEqual(state_digest(loaded), state_digest(state))
+
+            with open(filename + ".journal", encoding="utf-8") as file:
+                lines = file.read().replace(
+                    '"spawned_ids": [5]', '"spawned_ids": [3]')
+            with open(filename + ".journal", "w", encoding="utf-8") as file:
+                file.write(lines)
+            with self.assertRaises(JournalError):
+                loaded.load(filename)
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def test_stacking(self):
+        grid = SpatialIndex(4, 3)
+        for unit_id in range(3):
+            grid.add(unit_id, 1, 2)
+        grid.add(3, 3, 0)
+        grid.remove(0, 1, 2)
+        self.assertEqual(grid.units_at(1, 2), [1, 2])
+        grid.move(1, (1, 2), (2, 1))
+        self.assertEqual(grid.units_at(1, 2), [2])
+        self.assertEqual(grid.count_at(2, 1), 1)
+        self.assertEqual(grid.to_nested(), [
+            [[], [], [], [3]],
+            [[], [], [1], []],
+            [[], [2], [], []],
+        ])
+
+    def test_queries(self):
+        grid = SpatialIndex(10, 10)
+        for unit_id, pos in enumerate(((0, 0), (5, 5), (6, 4), (9, 9))):
+            grid.add(unit_id, *pos)
+        self.assertEqual(grid.units_in_rect(4, 4, 9, 9), [2, 1, 3])
+        self.assertEqual(sorted(grid.units_within(5, 5, 1)), [1, 2])
+        self.assertEqual(grid.neighbour_cells(0, 0), [(1, 0), (0, 1), (1, 1)])
+
+
+class TestChunkedGrid(unittest.TestCase):
+    def test_same_as_dense(self):
+        rng = random.Random(3)
+        dense = SpatialIndex(50, 40)
+        sparse = ChunkedGrid(50, 40, chunk_size=8)
+        for unit_id in range(200):
+            pos = (rng.randrange(50), rng.randrange(40))
+            dense.add(unit_id, *pos)
+            sparse.add(unit_id, *pos)
+        self.assertEqual(list(sparse.cells_in_rect(3, 5, 45, 33)),
+                         list(dense.cells_in_rect(3, 5, 45, 33)))
+        self.assertEqual(sparse.to_nested(), dense.to_nested())
+        self.assertEqual(sorted(sparse.units_within(20, 20, 3)),
+                         sorted(dense.units_within(20, 20, 3)))
+
+    def test_chunks_are_freed(self):
+        grid = ChunkedGrid(100000, 100000)
+        grid.add(0, 99999, 99999)
+        grid.add(1, 5, 5)
+        self.assertEqual(len(grid.chunks), 2)
+        grid.move(0, (99999, 99999), (6, 5))
+        self.assertEqual(len(grid.chunks), 1)
+        self.assertEqual(grid.units_in_rect(0, 0, 99999, 99999), [1, 0])
+
+    def test_save_load(self):
+        game_state = GameState(2, 100000, 100000, array_store=True)
+        self.assertIsInstance(game_state.grid, ChunkedGrid)
+        with self.assertRaises(ValueError):
+            game_state.game_field  # pylint: disable=pointless-statement
+        hq = game_state.unit_dict[0]
+        game_state.add_unit(hq.create_unit("infantry", (50000, 7)))
+        with tempfile.TemporaryDirectory() as directory:
+            for suffix in (".json", ".bin"):
+                filename = os.path.join(directory, "sparse" + suffix)
+                game_state.save(filename)
+                loaded = GameState(1, 1, 1)
+                loaded.load(filename)
+                self.assertIsInstance(loaded.grid, ChunkedGrid)
+                self.assertEqual(list(loaded.grid.occupied_cells()),
+                                 list(game_state.grid.occupied_cells()))
+                self.assertEqual(loaded.unit_count, game_state.unit_count)
+
+
+def commit_sequentially(state, actions, rng):
+    # Units removed during the commit (their IDs may be reused by spawns)
+    gone = set()
+
+    def present(unit_id):
+        return unit_id in state.unit_dict and unit_id not in gone
+
+    for action in actions:
+        if not present(action.unit_id):
+            continue
+        if action.name == "spawn":
+            hq = state.unit_dict[action.unit_id]
+            possible_pos = [
+                (hq.position.x + dx, hq.position.y + dy)
+                for dy in range(-1, 2) for dx in range(-1, 2)
+                if (dx or dy) and 0 <= hq.position.x + dx < state.width
+                and 0 <= hq.position.y + dy < state.height]
+            state.add_unit(hq.create_unit(
+                action.params["class"], rng.choice(possible_pos)))
+        elif action.name == "move":
+            unit = state.unit_dict[action.unit_id]
+            state.move_unit(
+                action.unit_id, unit.position + action.params["delta"])
+        elif action.name == "attack":
+            if not present(action.params["target_id"]):
+                continue
+            target = state.unit_dict[action.params["target_id"]]
+            state.unit_dict[action.unit_id].attack(target)
+            if target.health <= 0:
+                state.remove_unit(action.params["target_id"])
+                gone.add(action.params["target_id"])
+
+
+class TestCommit(unittest.TestCase):
+    @staticmethod
+    def make_state(array_store, seed):
+        rng = random.Random(seed)
+        state = GameState(2, 5, 5, array_store=array_store, seed=1)
+        for _ in range(8):
+            hq = state.unit_dict[rng.randrange(2)]
+            unit_id = state.add_unit(hq.create_unit(
+                rng.choice(("infantry", "vehicle")),
+                (rng.randrange(1, 4), rng.randrange(1, 4))))
+            state.unit_dict[unit_id].damage = rng.choice((5, 60, 200))
+        return state
+
+    @staticmethod
+    def random_actions(state, seed):
+        rng = random.Random(seed)
+        fighters = sorted(unit_id for unit_id in state.unit_dict
+                          if unit_id > 1)
+        actions = []
+        moving = set()
+        for _ in range(rng.randrange(4, 16)):
+            kind = rng.choice(("spawn", "move", "attack", "attack"))
+            if kind == "spawn":
+                actions.append(Action("spawn", rng.randrange(2), {
+                    "class": rng.choice(("infantry", "vehicle"))}))
+                continue
+            unit_id = rng.choice(fighters)
+            if kind == "attack":
+                actions.append(Action("attack", unit_id, {
+                    "target_id": rng.choice(fighters)}))
+            elif unit_id not in moving:
+                # One move per unit (as `OrderBuffer` allows), zero too
+                moving.add(unit_id)
+                actions.append(Action("move", unit_id, {
+                    "delta": abc.Vector(rng.randrange(-1, 2),
+                                        rng.randrange(-1, 2))}))
+        return actions
+
+    def test_same_as_sequential(self):
+        for seed in range(300):
+            array_store = bool(seed % 2)
+            actions = self.random_actions(
+                self.make_state(array_store, seed), seed)
+            expected = self.make_state(array_store, seed)
+            commit_sequentially(expected, actions, random.Random(seed))
+            state = self.make_state(array_store, seed)
+            commit_actions(state, actions, random.Random(seed))
+            self.assertEqual(state.game_field, expected.game_field,
+                             (seed, actions))
+            self.assertEqual(
+                {key: (unit.position, getattr(unit, "health", None))
+                 for key, unit in state.unit_dict.items()},
+                {key: (unit.position, getattr(unit, "health", None))
+                 for key, unit in expected.unit_dict.items()})
+
+    def test_reused_id(self):
+        state = self.make_state(True, 0)
+        state.unit_dict[2].health = 1
+        actions = [Action("attack", 3, {"target_id": 2}),
+                   Action("spawn", 0, {"class": "vehicle"}),
+                   Action("move", 2, {"delta": abc.Vector(1, 0)})]
+        result = commit_actions(state, actions, random.Random(1))
+        # The new unit got ID 2, but the move was given to the killed one
+        self.assertEqual(result.killed[0][0], 2)
+        self.assertEqual(result.spawned[0], (2, tuple(
+            state.unit_dict[2].position)))
+        self.assertEqual(result.moved, [])
+
 
 if __name__ == "__main__":
     unittest.main()